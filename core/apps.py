@@ -4,3 +4,9 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from django.conf import settings
+        from . import signals
+        #A bad SQLITE_PRAGMAS fails here rather than on the first connection
+        signals.pragma_statements(getattr(settings, 'SQLITE_PRAGMAS', {}))
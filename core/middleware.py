@@ -0,0 +1,45 @@
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+
+from .routers import PIN_COOKIE, routing
+
+class ReplicaRoutingMiddleware:
+   """
+   Keeps the replica routing state of each request (see
+   core.routers.ReplicaRouter). A request that writes sets a cookie that keeps
+   the client's reads on the primary for DATABASE_REPLICA_LAG seconds, so it
+   reads its own writes while the replicas catch up. Runs natively in both
+   WSGI and ASGI stacks, so async views pay no thread hop for it.
+   """
+   sync_capable = True
+   async_capable = True
+
+   def __init__(self, get_response):
+      self.get_response = get_response
+      if iscoroutinefunction(get_response):
+         markcoroutinefunction(self)
+
+   def __call__(self, request):
+      if iscoroutinefunction(self):
+         return self.__acall__(request)
+      state = {'request': request, 'wrote': False}
+      token = routing.set(state)
+      try:
+         response = self.get_response(request)
+      finally:
+         routing.reset(token)
+      return self.pin(state, response)
+
+   async def __acall__(self, request):
+      state = {'request': request, 'wrote': False}
+      token = routing.set(state)
+      try:
+         response = await self.get_response(request)
+      finally:
+         routing.reset(token)
+      return self.pin(state, response)
+
+   def pin(self, state, response):
+      if state['wrote'] and settings.DATABASE_REPLICAS:
+         response.set_cookie(PIN_COOKIE, '1', max_age=settings.DATABASE_REPLICA_LAG, httponly=True, samesite='Lax')
+      return response
@@ -0,0 +1,53 @@
+import random
+from contextvars import ContextVar
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+PIN_COOKIE = 'primary_pin'
+
+#Set by ReplicaRoutingMiddleware for each request: the request, the database
+#its reads go to (decided on its first read once the URL is resolved) and
+#whether it has written yet
+routing = ContextVar('replica_routing', default=None)
+
+def replica_for(request):
+   """The replica a request may read from, or None when it reads the primary."""
+   func = request.resolver_match.func
+   view = getattr(func, 'cls', None) or getattr(func, 'view_class', None) or func
+   if request.method not in SAFE_METHODS or not getattr(view, 'replica_reads', False) or PIN_COOKIE in request.COOKIES:
+      return None
+   return random.choice(settings.DATABASE_REPLICAS) if settings.DATABASE_REPLICAS else None
+
+def reads_from_replica():
+   return ReplicaRouter().db_for_read(None) != DEFAULT_DB_ALIAS
+
+class ReplicaRouter:
+   """
+   Sends the reads of a safe request to a view with replica_reads = True to
+   one of settings.DATABASE_REPLICAS and everything else to the primary. Once
+   the request writes (or locks rows, which also asks for the write database),
+   its reads stay on the primary so it sees what it wrote. Migrations run
+   everywhere: a real replica gets the schema from the primary, the stand-in
+   one in tests needs it.
+   """
+   def db_for_read(self, model, **hints):
+      state = routing.get()
+      if not state or state['wrote']:
+         return DEFAULT_DB_ALIAS
+      if 'database' not in state:
+         if state['request'].resolver_match is None:
+            #Reads made by middleware before the URL is resolved
+            return DEFAULT_DB_ALIAS
+         state['database'] = replica_for(state['request']) or DEFAULT_DB_ALIAS
+      return state['database']
+
+   def db_for_write(self, model, **hints):
+      state = routing.get()
+      if state:
+         state['wrote'] = True
+      return DEFAULT_DB_ALIAS
+
+   def allow_relation(self, obj1, obj2, **hints):
+      #Replicas hold the primary's rows
+      return True
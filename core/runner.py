@@ -0,0 +1,16 @@
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+class TestRunner(DiscoverRunner):
+   """
+   Runs the suite with request metrics off: their flushes would outlive the
+   test databases and reach the real one. The metrics tests turn them on.
+   """
+   def setup_test_environment(self, **kwargs):
+      super().setup_test_environment(**kwargs)
+      self.test_settings = override_settings(METRICS_ENABLED=False)
+      self.test_settings.enable()
+
+   def teardown_test_environment(self, **kwargs):
+      self.test_settings.disable()
+      super().teardown_test_environment(**kwargs)
@@ -0,0 +1,36 @@
+import re
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+#The pragmas SQLITE_PRAGMAS may set. Names and values are interpolated into
+#the statement (PRAGMA takes no parameters), so both are checked first
+KNOWN_PRAGMAS = {
+   'analysis_limit', 'auto_vacuum', 'automatic_index', 'busy_timeout', 'cache_size', 'cache_spill',
+   'foreign_keys', 'journal_mode', 'journal_size_limit', 'locking_mode', 'mmap_size', 'page_size',
+   'secure_delete', 'synchronous', 'temp_store', 'threads', 'wal_autocheckpoint',
+}
+PRAGMA_VALUE = re.compile(r'-?\d+|[A-Za-z_]+')
+
+def pragma_statements(pragmas):
+   """The PRAGMA statements for a SQLITE_PRAGMAS dict, refusing unknown names and values that aren't an integer or a keyword."""
+   statements = []
+   for name, value in pragmas.items():
+      if name not in KNOWN_PRAGMAS:
+         raise ImproperlyConfigured(f'SQLITE_PRAGMAS: unknown pragma {name!r}.')
+      if isinstance(value, bool) or not isinstance(value, (int, str)) or not PRAGMA_VALUE.fullmatch(str(value)):
+         raise ImproperlyConfigured(f'SQLITE_PRAGMAS: {name} must be an integer or a keyword, not {value!r}.')
+      statements.append(f'PRAGMA {name} = {value}')
+   return statements
+
+#Pragmas are per connection (journal_mode is kept in the file), so each new
+#SQLite connection is set up here; with CONN_MAX_AGE that happens once per
+#thread rather than once per request.
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+   if connection.vendor != 'sqlite':
+      return
+   with connection.cursor() as cursor:
+      for statement in pragma_statements(getattr(settings, 'SQLITE_PRAGMAS', {})):
+         cursor.execute(statement)
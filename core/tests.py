@@ -1,3 +1,24 @@
-from django.test import TestCase
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connections
+from django.test import TestCase, override_settings
 
-# Create your tests here.
+class SQLiteProfileTests(TestCase):
+   def pragmas(self, *names):
+      connection = connections.create_connection('default')
+      self.addCleanup(connection.close)
+      with connection.cursor() as cursor:
+         return [cursor.execute(f'PRAGMA {name}').fetchone()[0] for name in names]
+
+   @override_settings(SQLITE_PRAGMAS={'synchronous': 'OFF', 'cache_size': -1000, 'busy_timeout': 1234})
+   def test_new_connections_run_the_pragmas(self):
+      self.assertEqual(self.pragmas('synchronous', 'cache_size', 'busy_timeout'), [0, -1000, 1234])
+
+   @override_settings(SQLITE_PRAGMAS={})
+   def test_no_pragmas_keeps_sqlite_defaults(self):
+      self.assertEqual(self.pragmas('synchronous', 'busy_timeout'), [2, 5000])
+
+   def test_bad_pragmas_are_refused(self):
+      for pragmas in [{'synchronous = OFF; DROP TABLE store_product; --': 1}, {'journal_mode': 'WAL; DROP TABLE store_product'}, {'cache_size': 1.5}]:
+         with self.subTest(pragmas=pragmas), override_settings(SQLITE_PRAGMAS=pragmas):
+            with self.assertRaises(ImproperlyConfigured):
+               self.pragmas('synchronous')
@@ -0,0 +1,76 @@
+import atexit
+import threading
+from collections import Counter
+from django.conf import settings
+from django.db import connections, transaction
+from django.dispatch import Signal
+
+from .models import LikeCount
+
+#Sent once pending deltas are written, with the (content_type_id, object_id)
+#pairs whose totals changed
+counts_flushed = Signal()
+
+def flush_interval():
+   return getattr(settings, 'LIKES_FLUSH_INTERVAL', 5)
+
+class LikeCounter:
+   """
+   Sums like/unlike deltas in this process and writes them to LikeCount once
+   per LIKES_FLUSH_INTERVAL seconds, in one transaction. Likes of a popular
+   product then only insert LikedItem rows instead of queueing on the
+   UPDATE of its one LikeCount row, which takes the summed delta once per
+   window. Totals trail the likes by at most that window; an interval of 0
+   writes every delta through.
+   """
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.pending = Counter()
+      self.timer = None
+
+   def add(self, content_type_id, object_id, delta):
+      interval = flush_interval()
+      with self.lock:
+         self.pending[content_type_id, object_id] += delta
+         self.schedule(interval)
+      if interval <= 0:
+         self.flush()
+
+   def schedule(self, interval):
+      #Called with the lock held
+      if interval > 0 and self.timer is None:
+         self.timer = threading.Timer(interval, self.flush_in_thread)
+         self.timer.daemon = True
+         self.timer.start()
+
+   def flush_in_thread(self):
+      try:
+         self.flush()
+      finally:
+         connections.close_all()
+
+   def flush(self):
+      """Writes the pending deltas and returns them as (content_type_id, object_id, delta) rows."""
+      with self.lock:
+         pending, self.pending = self.pending, Counter()
+         if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+      deltas = [(content_type_id, object_id, delta) for (content_type_id, object_id), delta in pending.items() if delta]
+      if not deltas:
+         return []
+      try:
+         with transaction.atomic(using=LikeCount.objects.db):
+            LikeCount.objects.apply(deltas)
+      except Exception:
+         #Kept for the next flush, which is due in one interval rather than
+         #at the next like
+         with self.lock:
+            self.pending.update(pending)
+            self.schedule(flush_interval())
+         raise
+      counts_flushed.send(sender=LikeCount, objects=[(content_type_id, object_id) for content_type_id, object_id, _ in deltas])
+      return deltas
+
+counter = LikeCounter()
+atexit.register(counter.flush)
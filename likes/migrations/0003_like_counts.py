@@ -0,0 +1,50 @@
+# Generated by Django 4.1.6 on 2026-10-18 09:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+#Keeps the first of any duplicate likes so the unique constraint can be added
+DELETE_DUPLICATES = '''
+    DELETE FROM likes_likeditem WHERE id NOT IN (
+        SELECT MIN(id) FROM likes_likeditem GROUP BY user_id, content_type_id, object_id
+    )
+'''
+
+COUNT_LIKES = '''
+    INSERT INTO likes_likecount (content_type_id, object_id, total)
+    SELECT content_type_id, object_id, COUNT(*) FROM likes_likeditem GROUP BY content_type_id, object_id
+'''
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('likes', '0002_content_object_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LikeCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('total', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.RunSQL(DELETE_DUPLICATES, migrations.RunSQL.noop),
+        migrations.AddConstraint(
+            model_name='likeditem',
+            constraint=models.UniqueConstraint(fields=('user', 'content_type', 'object_id'), name='likes_one_like_per_user'),
+        ),
+        migrations.AddField(
+            model_name='likecount',
+            name='content_type',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype'),
+        ),
+        migrations.AddConstraint(
+            model_name='likecount',
+            constraint=models.UniqueConstraint(fields=('content_type', 'object_id'), name='likes_one_count_per_object'),
+        ),
+        migrations.RunSQL(COUNT_LIKES, migrations.RunSQL.noop),
+    ]
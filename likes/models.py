@@ -1,10 +1,74 @@
-from django.db import models
+from django.db import IntegrityError, connections, models, transaction
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.contenttypes.fields import GenericForeignKey
 
+class LikedItemManager(models.Manager):
+   def like(self, user, obj):
+      """Records that user likes obj. Returns False if they already did."""
+      try:
+         with transaction.atomic(using=self.db):
+            self.create(user=user, content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk)
+      except IntegrityError:
+         return False
+      return True
+
+   def unlike(self, user, obj):
+      """Removes user's like of obj. Returns False if there was none."""
+      deleted, _ = self.filter(user=user, content_type=ContentType.objects.get_for_model(obj), object_id=obj.pk).delete()
+      return bool(deleted)
+
+   def counts_for(self, objects):
+      """
+      How many likes each object has, keyed by the object itself, as of the
+      last flush of the like counter. Objects may be of any model; each model
+      costs one query.
+      """
+      objects = list(objects)
+      counts = {obj: 0 for obj in objects}
+      content_types = ContentType.objects.get_for_models(*{type(obj) for obj in objects})
+      for model, content_type in content_types.items():
+         by_id = {obj.pk: obj for obj in objects if type(obj) is model}
+         for object_id, total in LikeCount.objects.filter(content_type=content_type, object_id__in=by_id).values_list('object_id', 'total'):
+            counts[by_id[object_id]] = total
+      return counts
+
 class LikedItem(models.Model):
+   objects = LikedItemManager()
    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
    object_id = models.PositiveIntegerField()
    content_object = GenericForeignKey()
+
+   class Meta:
+      indexes = [models.Index(fields=['content_type', 'object_id'])]
+      constraints = [models.UniqueConstraint(fields=['user', 'content_type', 'object_id'], name='likes_one_like_per_user')]
+
+class LikeCountManager(models.Manager):
+   def apply(self, deltas):
+      """Adds (content_type_id, object_id, delta) rows to the totals, creating missing rows."""
+      with connections[self.db].cursor() as cursor:
+         cursor.executemany('''
+            INSERT INTO likes_likecount (content_type_id, object_id, total) VALUES (%s, %s, %s)
+            ON CONFLICT (content_type_id, object_id) DO UPDATE SET total = likes_likecount.total + excluded.total
+         ''', deltas)
+
+   def recount(self):
+      """Recomputes every total from LikedItem, e.g. after likes were bulk loaded."""
+      with transaction.atomic(using=self.db), connections[self.db].cursor() as cursor:
+         cursor.execute('DELETE FROM likes_likecount')
+         cursor.execute('''
+            INSERT INTO likes_likecount (content_type_id, object_id, total)
+            SELECT content_type_id, object_id, COUNT(*) FROM likes_likeditem GROUP BY content_type_id, object_id
+         ''')
+
+#Kept by likes.counters from LikedItem's signals, a flush window behind
+class LikeCount(models.Model):
+   objects = LikeCountManager()
+   content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+   object_id = models.PositiveIntegerField()
+   total = models.IntegerField(default=0)
+   content_object = GenericForeignKey()
+
+   class Meta:
+      constraints = [models.UniqueConstraint(fields=['content_type', 'object_id'], name='likes_one_count_per_object')]
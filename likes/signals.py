@@ -0,0 +1,17 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .counters import counter
+from .models import LikedItem
+
+#Counted once the like commits, so a rolled back like is never counted.
+#bulk_create() and update() send no signals; LikeCount.objects.recount() fixes totals after them.
+@receiver(post_save, sender=LikedItem)
+def count_like(sender, instance, created, **kwargs):
+   if created:
+      transaction.on_commit(lambda: counter.add(instance.content_type_id, instance.object_id, 1))
+
+@receiver(post_delete, sender=LikedItem)
+def count_unlike(sender, instance, **kwargs):
+   transaction.on_commit(lambda: counter.add(instance.content_type_id, instance.object_id, -1))
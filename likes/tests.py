@@ -1,3 +1,67 @@
-from django.test import TestCase
+from unittest import mock
+from django.db import IntegrityError
+from django.test import TestCase, override_settings
+from core.models import User
+from store.models import Collection, Product
+from .counters import LikeCounter
+from .models import LikeCount, LikedItem
 
-# Create your tests here.
+class CountsForTests(TestCase):
+   def test_objects_of_different_models_take_one_query_each(self):
+      collection = Collection.objects.create(title='Kitchen')
+      product = Product.objects.create(title='Mug', slug='mug', price=10, inventory=1, collection=collection)
+      user = User.objects.create_user('ana', 'ana@example.com', 'secret')
+      LikedItem.objects.create(user=user, content_object=product)
+      LikedItem.objects.create(user=user, content_object=collection)
+      LikedItem.objects.create(user=User.objects.create_user('bia', 'bia@example.com', 'secret'), content_object=product)
+      LikeCount.objects.recount()
+      other = Product.objects.create(title='Cup', slug='cup', price=10, inventory=1, collection=collection)
+
+      with self.assertNumQueries(2):
+         counts = LikedItem.objects.counts_for([product, collection, other])
+
+      self.assertEqual(counts, {product: 2, collection: 1, other: 0})
+
+class LikeCounterTests(TestCase):
+   def setUp(self):
+      self.product = Product.objects.create(title='Mug', slug='mug', price=10, inventory=1, collection=Collection.objects.create(title='Kitchen'))
+      self.users = [User.objects.create_user(f'user{i}', f'user{i}@example.com', 'secret') for i in range(3)]
+
+   def test_a_user_likes_an_object_once(self):
+      self.assertTrue(LikedItem.objects.like(self.users[0], self.product))
+      self.assertFalse(LikedItem.objects.like(self.users[0], self.product))
+      with self.assertRaises(IntegrityError):
+         LikedItem.objects.create(user=self.users[0], content_object=self.product)
+
+   @override_settings(LIKES_FLUSH_INTERVAL=60)
+   def test_deltas_are_written_once_per_flush(self):
+      counter = LikeCounter()
+      content_type_id = LikedItem.objects.create(user=self.users[0], content_object=self.product).content_type_id
+      for delta in [1, 1, 1, -1]:
+         counter.add(content_type_id, self.product.id, delta)
+      self.assertFalse(LikeCount.objects.exists())
+
+      self.assertEqual(counter.flush(), [(content_type_id, self.product.id, 2)])
+      self.assertEqual(LikedItem.objects.counts_for([self.product]), {self.product: 2})
+      self.assertEqual(counter.flush(), [])
+
+   @override_settings(LIKES_FLUSH_INTERVAL=60)
+   def test_a_failed_flush_is_retried_by_the_timer(self):
+      counter = LikeCounter()
+      content_type_id = LikedItem.objects.create(user=self.users[0], content_object=self.product).content_type_id
+      counter.add(content_type_id, self.product.id, 1)
+
+      with mock.patch.object(LikeCount.objects, 'apply', side_effect=IntegrityError), self.assertRaises(IntegrityError):
+         counter.flush()
+      self.assertIsNotNone(counter.timer)
+
+      self.assertEqual(counter.flush(), [(content_type_id, self.product.id, 1)])
+      self.assertIsNone(counter.timer)
+
+   def test_likes_are_counted_when_they_commit(self):
+      with override_settings(LIKES_FLUSH_INTERVAL=0), self.captureOnCommitCallbacks(execute=True):
+         for user in self.users:
+            LikedItem.objects.like(user, self.product)
+         LikedItem.objects.unlike(self.users[0], self.product)
+
+      self.assertEqual(LikedItem.objects.counts_for([self.product]), {self.product: 2})
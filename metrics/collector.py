@@ -0,0 +1,122 @@
+import atexit
+import copy
+import threading
+from bisect import bisect_left
+from django.conf import settings
+from django.db import connections, transaction
+
+from .models import ViewStats
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def flush_interval():
+   return settings.METRICS_FLUSH_INTERVAL
+
+def latency_buckets():
+   return getattr(settings, 'METRICS_LATENCY_BUCKETS', LATENCY_BUCKETS)
+
+class Tally:
+   __slots__ = ['requests', 'errors', 'seconds', 'queries', 'db_seconds', 'max_queries', 'n_plus_one', 'n_plus_one_sql', 'bounds', 'buckets']
+
+   def __init__(self, bounds):
+      self.requests = self.errors = self.queries = self.max_queries = self.n_plus_one = 0
+      self.seconds = self.db_seconds = 0.0
+      self.n_plus_one_sql = None
+      #Read once per view and flush rather than per request
+      self.bounds = bounds
+      self.buckets = [0] * len(bounds)
+
+class MetricsCollector:
+   """
+   Sums the requests of each view in this process and adds them to ViewStats
+   and ViewLatency once per METRICS_FLUSH_INTERVAL seconds, in one
+   transaction, the way likes.counters buffers like counts. Recording a
+   request is a few additions under a lock; an interval of 0 writes every
+   request through.
+   """
+   def __init__(self):
+      self.lock = threading.Lock()
+      self.pending = {}
+      self.timer = None
+
+   def record(self, view, seconds, status, queries, db_seconds, repeated_sql=None):
+      interval = flush_interval()
+      with self.lock:
+         tally = self.pending.get(view)
+         if tally is None:
+            tally = self.pending[view] = Tally(latency_buckets())
+         tally.requests += 1
+         tally.errors += status >= 500
+         tally.seconds += seconds
+         tally.queries += queries
+         tally.db_seconds += db_seconds
+         tally.max_queries = max(tally.max_queries, queries)
+         if repeated_sql is not None:
+            tally.n_plus_one += 1
+            tally.n_plus_one_sql = repeated_sql
+         bucket = bisect_left(tally.bounds, seconds)
+         if bucket < len(tally.bounds):
+            tally.buckets[bucket] += 1
+         self.schedule(interval)
+      if interval <= 0:
+         self.flush()
+
+   def schedule(self, interval):
+      #Called with the lock held
+      if interval > 0 and self.timer is None:
+         self.timer = threading.Timer(interval, self.flush_in_thread)
+         self.timer.daemon = True
+         self.timer.start()
+
+   def snapshot(self):
+      """A copy of the totals not flushed yet, by view."""
+      with self.lock:
+         pending = {view: copy.copy(tally) for view, tally in self.pending.items()}
+      for tally in pending.values():
+         tally.buckets = list(tally.buckets)
+      return pending
+
+   def flush_in_thread(self):
+      try:
+         self.flush()
+      finally:
+         connections.close_all()
+
+   def flush(self):
+      """Writes the pending totals and returns the views they were for."""
+      with self.lock:
+         pending, self.pending = self.pending, {}
+         if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+      if not pending:
+         return []
+      try:
+         with transaction.atomic(using=ViewStats.objects.db):
+            ViewStats.objects.apply(
+               [(view, t.requests, t.errors, t.seconds, t.queries, t.db_seconds, t.max_queries, t.n_plus_one, t.n_plus_one_sql) for view, t in pending.items()],
+               [(view, le, count) for view, t in pending.items() for le, count in zip(t.bounds, t.buckets) if count],
+            )
+      except Exception:
+         #Kept for the next flush, which is due in one interval rather than
+         #at the next request
+         with self.lock:
+            for view, tally in pending.items():
+               self.merge(view, tally)
+            self.schedule(flush_interval())
+         raise
+      return list(pending)
+
+   def merge(self, view, tally):
+      current = self.pending.setdefault(view, tally)
+      if current is tally:
+         return
+      for name in ['requests', 'errors', 'seconds', 'queries', 'db_seconds', 'n_plus_one']:
+         setattr(current, name, getattr(current, name) + getattr(tally, name))
+      current.max_queries = max(current.max_queries, tally.max_queries)
+      current.n_plus_one_sql = current.n_plus_one_sql or tally.n_plus_one_sql
+      if current.bounds == tally.bounds:
+         current.buckets = [a + b for a, b in zip(current.buckets, tally.buckets)]
+
+collector = MetricsCollector()
+atexit.register(collector.flush)
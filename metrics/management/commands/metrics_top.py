@@ -0,0 +1,57 @@
+from django.core.management.base import BaseCommand
+from django.db.models import F, FloatField
+from django.db.models.functions import Cast
+
+from metrics.collector import collector
+from metrics.models import ViewLatency, ViewStats
+
+ORDERINGS = {
+   'requests': F('requests'),
+   'seconds': F('seconds'),
+   'avg_seconds': F('seconds') / F('requests'),
+   'queries': F('queries'),
+   'avg_queries': Cast('queries', FloatField()) / F('requests'),
+   'max_queries': F('max_queries'),
+   'db_seconds': F('db_seconds'),
+   'n_plus_one': F('n_plus_one'),
+   'errors': F('errors'),
+}
+
+def quantile(buckets, requests, q):
+   """Upper bound of the latency bucket holding the q quantile, None past the last bucket."""
+   rank, seen = q * requests, 0
+   for le, count in buckets:
+      seen += count
+      if seen >= rank:
+         return le
+   return None
+
+class Command(BaseCommand):
+   help = 'Shows the views with the most requests, time, queries or likely N+1 queries.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('--by', choices=list(ORDERINGS), default='seconds', help='What to rank the views by.')
+      parser.add_argument('--limit', type=int, default=10)
+      parser.add_argument('--reset', action='store_true', help='Delete the totals after printing them.')
+
+   def handle(self, *args, **options):
+      collector.flush()
+      rows = list(ViewStats.objects.filter(requests__gt=0).order_by(ORDERINGS[options['by']].desc(), 'view')[:options['limit']])
+      buckets = {}
+      for view, le, requests in ViewLatency.objects.filter(view__in=[row.view for row in rows]).order_by('le').values_list('view', 'le', 'requests'):
+         buckets.setdefault(view, []).append((le, requests))
+
+      self.stdout.write(f"{'view':<40} {'requests':>9} {'errors':>6} {'avg ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'avg q':>6} {'max q':>6} {'db ms':>8} {'n+1':>6}")
+      for row in rows:
+         latency = [quantile(buckets.get(row.view, []), row.requests, q) for q in (0.95, 0.99)]
+         latency = [f'<={le * 1000:g}' if le is not None else 'slower' for le in latency]
+         self.stdout.write(
+            f'{row.view:<40} {row.requests:>9} {row.errors:>6} {row.seconds / row.requests * 1000:>8.1f} {latency[0]:>8} {latency[1]:>8} '
+            f'{row.queries / row.requests:>6.1f} {row.max_queries:>6} {row.db_seconds / row.requests * 1000:>8.1f} {row.n_plus_one:>6}'
+         )
+      for row in rows:
+         if row.n_plus_one_sql:
+            self.stdout.write(f'\n{row.view} repeated: {row.n_plus_one_sql}')
+      if options['reset']:
+         ViewStats.objects.all().delete()
+         ViewLatency.objects.all().delete()
@@ -0,0 +1,91 @@
+import time
+from collections import Counter
+from contextvars import ContextVar
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from .collector import collector, flush_interval
+
+#The QueryTimer of the request being handled, if MetricsMiddleware is timing it
+current = ContextVar('metrics_query_timer', default=None)
+
+class QueryTimer:
+   """Counts a request's queries, their time and how often each statement ran."""
+   def __init__(self):
+      self.queries = 0
+      self.seconds = 0.0
+      self.statements = Counter()
+
+   def repeated_statement(self):
+      """The statement run the most, if that was METRICS_N_PLUS_ONE_THRESHOLD times or more: a likely N+1."""
+      if not self.statements:
+         return None
+      sql, times = max(self.statements.items(), key=lambda item: item[1])
+      return sql if times >= settings.METRICS_N_PLUS_ONE_THRESHOLD else None
+
+def time_queries(execute, sql, params, many, context):
+   """
+   An execute wrapper every connection keeps (see metrics.signals): installing
+   one per request on each connection would cost more than the timing itself.
+   """
+   timer = current.get()
+   if timer is None:
+      return execute(sql, params, many, context)
+   start = time.perf_counter()
+   try:
+      return execute(sql, params, many, context)
+   finally:
+      timer.seconds += time.perf_counter() - start
+      timer.queries += 1
+      timer.statements[sql] += 1
+
+class MetricsMiddleware:
+   """
+   Records each request's latency, status, query count and query time under
+   its resolved view name (see metrics.collector). Outermost, so the other
+   middleware's time and queries count too. Does nothing unless
+   METRICS_ENABLED.
+   """
+   sync_capable = True
+   async_capable = True
+
+   def __init__(self, get_response):
+      self.get_response = get_response
+      if iscoroutinefunction(get_response):
+         markcoroutinefunction(self)
+
+   def __call__(self, request):
+      if iscoroutinefunction(self):
+         return self.__acall__(request)
+      if not settings.METRICS_ENABLED:
+         return self.get_response(request)
+      timer, start = QueryTimer(), time.perf_counter()
+      token = current.set(timer)
+      try:
+         response = self.get_response(request)
+      finally:
+         current.reset(token)
+      self.record(request, response, timer, time.perf_counter() - start)
+      return response
+
+   async def __acall__(self, request):
+      if not settings.METRICS_ENABLED:
+         return await self.get_response(request)
+      #sync_to_async copies the context, so queries run in worker threads are timed too
+      timer, start = QueryTimer(), time.perf_counter()
+      token = current.set(timer)
+      try:
+         response = await self.get_response(request)
+      finally:
+         current.reset(token)
+      seconds = time.perf_counter() - start
+      if flush_interval() > 0:
+         self.record(request, response, timer, seconds)
+      else:
+         #Writing through queries the database
+         await sync_to_async(self.record)(request, response, timer, seconds)
+      return response
+
+   def record(self, request, response, timer, seconds):
+      match = request.resolver_match
+      collector.record(match.view_name if match else 'unmatched', seconds, response.status_code, timer.queries, timer.seconds, timer.repeated_statement())
@@ -0,0 +1,45 @@
+# Generated by Django 4.1.6 on 2026-10-18 10:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewLatency',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(max_length=255)),
+                ('le', models.FloatField()),
+                ('requests', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ViewStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('view', models.CharField(max_length=255, unique=True)),
+                ('requests', models.PositiveBigIntegerField(default=0)),
+                ('errors', models.PositiveBigIntegerField(default=0)),
+                ('seconds', models.FloatField(default=0)),
+                ('queries', models.PositiveBigIntegerField(default=0)),
+                ('db_seconds', models.FloatField(default=0)),
+                ('max_queries', models.PositiveIntegerField(default=0)),
+                ('n_plus_one', models.PositiveBigIntegerField(default=0)),
+                ('n_plus_one_sql', models.TextField(null=True)),
+            ],
+            options={
+                'verbose_name_plural': 'view stats',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='viewlatency',
+            constraint=models.UniqueConstraint(fields=('view', 'le'), name='metrics_one_bucket_per_view'),
+        ),
+    ]
@@ -0,0 +1,55 @@
+from django.db import connections, models
+
+class ViewStatsManager(models.Manager):
+   def apply(self, rows, buckets):
+      """
+      Adds (view, requests, errors, seconds, queries, db_seconds, max_queries,
+      n_plus_one, n_plus_one_sql) rows and (view, le, requests) latency bucket
+      rows to the totals, creating missing rows.
+      """
+      with connections[self.db].cursor() as cursor:
+         cursor.executemany('''
+            INSERT INTO metrics_viewstats (view, requests, errors, seconds, queries, db_seconds, max_queries, n_plus_one, n_plus_one_sql)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (view) DO UPDATE SET
+               requests = metrics_viewstats.requests + excluded.requests,
+               errors = metrics_viewstats.errors + excluded.errors,
+               seconds = metrics_viewstats.seconds + excluded.seconds,
+               queries = metrics_viewstats.queries + excluded.queries,
+               db_seconds = metrics_viewstats.db_seconds + excluded.db_seconds,
+               max_queries = max(metrics_viewstats.max_queries, excluded.max_queries),
+               n_plus_one = metrics_viewstats.n_plus_one + excluded.n_plus_one,
+               n_plus_one_sql = coalesce(excluded.n_plus_one_sql, metrics_viewstats.n_plus_one_sql)
+         ''', rows)
+         cursor.executemany('''
+            INSERT INTO metrics_viewlatency (view, le, requests) VALUES (%s, %s, %s)
+            ON CONFLICT (view, le) DO UPDATE SET requests = metrics_viewlatency.requests + excluded.requests
+         ''', buckets)
+
+#Totals per resolved view name since the last reset, kept by metrics.collector
+class ViewStats(models.Model):
+   objects = ViewStatsManager()
+   view = models.CharField(max_length=255, unique=True)
+   requests = models.PositiveBigIntegerField(default=0)
+   #Responses with a 5xx status
+   errors = models.PositiveBigIntegerField(default=0)
+   seconds = models.FloatField(default=0)
+   queries = models.PositiveBigIntegerField(default=0)
+   db_seconds = models.FloatField(default=0)
+   max_queries = models.PositiveIntegerField(default=0)
+   #Requests that ran one statement METRICS_N_PLUS_ONE_THRESHOLD times or more, and the last such statement
+   n_plus_one = models.PositiveBigIntegerField(default=0)
+   n_plus_one_sql = models.TextField(null=True)
+
+   class Meta:
+      verbose_name_plural = 'view stats'
+
+#Requests per latency bucket: le is the bucket's upper bound in seconds, the
+#slower ones only count in ViewStats.requests
+class ViewLatency(models.Model):
+   view = models.CharField(max_length=255)
+   le = models.FloatField()
+   requests = models.PositiveBigIntegerField(default=0)
+
+   class Meta:
+      constraints = [models.UniqueConstraint(fields=['view', 'le'], name='metrics_one_bucket_per_view')]
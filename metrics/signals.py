@@ -0,0 +1,10 @@
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .middleware import time_queries
+
+#execute_wrappers belongs to the connection handle, which outlives reconnects
+@receiver(connection_created)
+def install_query_timer(sender, connection, **kwargs):
+   if time_queries not in connection.execute_wrappers:
+      connection.execute_wrappers.append(time_queries)
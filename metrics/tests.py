@@ -0,0 +1,134 @@
+from io import StringIO
+from unittest import mock
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.http import HttpResponse
+from django.test import AsyncClient, RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
+
+from core.models import User
+from store.models import Collection, Product
+from .collector import MetricsCollector, collector
+from .middleware import MetricsMiddleware
+from .models import ViewLatency, ViewStats
+
+@override_settings(METRICS_ENABLED=True, METRICS_FLUSH_INTERVAL=0, METRICS_N_PLUS_ONE_THRESHOLD=5)
+class MetricsMiddlewareTests(TestCase):
+   def setUp(self):
+      collection = Collection.objects.create(title='Kitchen')
+      for i in range(3):
+         Product.objects.create(title=f'Mug {i}', slug=f'mug-{i}', price=10, inventory=1, collection=collection)
+
+   def run_view(self, queries):
+      def view(request):
+         for _ in range(queries):
+            Product.objects.filter(id=1).exists()
+         return HttpResponse()
+      request = RequestFactory().get('/store/products/')
+      request.resolver_match = resolve('/store/products/')
+      MetricsMiddleware(view)(request)
+
+   def test_requests_are_counted_per_view(self):
+      self.client.get('/store/products/')
+      self.client.get('/store/products/', {'ordering': 'price'})
+      self.client.get('/store/collections/')
+      self.client.get('/nowhere/')
+
+      stats = {row.view: row for row in ViewStats.objects.all()}
+      self.assertEqual(set(stats), {'product-list', 'collection-list', 'unmatched'})
+      self.assertEqual(stats['product-list'].requests, 2)
+      self.assertGreater(stats['product-list'].queries, 0)
+      self.assertGreater(stats['product-list'].db_seconds, 0)
+      self.assertEqual(stats['product-list'].n_plus_one, 0)
+      self.assertEqual(sum(ViewLatency.objects.filter(view='product-list').values_list('requests', flat=True)), 2)
+
+   def test_repeated_statements_are_flagged(self):
+      self.run_view(queries=4)
+      self.run_view(queries=6)
+      stats = ViewStats.objects.get(view='product-list')
+      self.assertEqual((stats.requests, stats.queries, stats.max_queries, stats.n_plus_one), (2, 10, 6, 1))
+      self.assertIn('FROM "store_product"', stats.n_plus_one_sql)
+
+   async def test_async_views_are_counted(self):
+      await AsyncClient().get('/store/async/products/')
+      stats = await ViewStats.objects.aget(view='async-product-list')
+      self.assertEqual(stats.requests, 1)
+      self.assertGreater(stats.queries, 0)
+
+   def test_prometheus_endpoint(self):
+      self.client.get('/store/products/')
+      response = self.client.get('/metrics')
+      self.assertEqual(response.status_code, 200)
+      self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+      text = response.content.decode()
+      self.assertIn('# TYPE django_view_request_duration_seconds histogram', text)
+      self.assertIn('django_view_request_duration_seconds_bucket{view="product-list",le="+Inf"} 1\n', text)
+      self.assertIn('django_view_request_duration_seconds_count{view="product-list"} 1\n', text)
+      self.assertRegex(text, r'django_view_db_queries_total\{view="product-list"\} [1-9]')
+
+   @override_settings(METRICS_FLUSH_INTERVAL=60)
+   def test_prometheus_endpoint_serves_unflushed_totals_without_writing(self):
+      self.client.get('/store/products/')
+      try:
+         with CaptureQueriesContext(connection) as queries:
+            text = self.client.get('/metrics').content.decode()
+         self.assertIn('django_view_request_duration_seconds_count{view="product-list"} 1\n', text)
+         self.assertFalse(ViewStats.objects.exists())
+         self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries.captured_queries))
+      finally:
+         collector.flush()
+
+   def test_prometheus_endpoint_is_internal(self):
+      self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+      self.client.force_login(User.objects.create_user('admin', 'admin@example.com', 'secret', is_staff=True))
+      self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 200)
+
+   def test_top_command(self):
+      self.run_view(queries=6)
+      self.client.get('/store/collections/')
+      out = StringIO()
+      call_command('metrics_top', '--by', 'queries', '--reset', stdout=out)
+      lines = out.getvalue().splitlines()
+      self.assertTrue(lines[1].startswith('product-list '))
+      self.assertTrue(lines[2].startswith('collection-list '))
+      self.assertIn('product-list repeated: SELECT', out.getvalue())
+      self.assertFalse(ViewStats.objects.exists())
+
+   @override_settings(METRICS_ENABLED=False)
+   def test_disabled(self):
+      self.client.get('/store/products/')
+      self.assertFalse(ViewStats.objects.exists())
+
+class MetricsCollectorTests(TestCase):
+   @override_settings(METRICS_FLUSH_INTERVAL=60, METRICS_LATENCY_BUCKETS=(0.1, 1))
+   def test_requests_are_written_once_per_flush(self):
+      collector = MetricsCollector()
+      collector.record('home', 0.05, 200, 2, 0.01)
+      collector.record('home', 0.5, 500, 4, 0.02)
+      collector.record('home', 3, 200, 0, 0)
+      collector.timer.cancel()
+      self.assertFalse(ViewStats.objects.exists())
+
+      #The savepoint, one insert per table and the release
+      with self.assertNumQueries(4):
+         self.assertEqual(collector.flush(), ['home'])
+      collector.record('home', 0.05, 200, 1, 0)
+      collector.flush()
+
+      stats = ViewStats.objects.get()
+      self.assertEqual((stats.requests, stats.errors, stats.queries, stats.max_queries), (4, 1, 7, 4))
+      self.assertAlmostEqual(stats.seconds, 3.6)
+      self.assertEqual(list(ViewLatency.objects.order_by('le').values_list('le', 'requests')), [(0.1, 2), (1, 1)])
+
+   @override_settings(METRICS_FLUSH_INTERVAL=60)
+   def test_a_failed_flush_is_retried_by_the_timer(self):
+      collector = MetricsCollector()
+      collector.record('home', 0.05, 200, 2, 0.01)
+
+      with mock.patch.object(ViewStats.objects, 'apply', side_effect=DatabaseError), self.assertRaises(DatabaseError):
+         collector.flush()
+      self.assertIsNotNone(collector.timer)
+
+      self.assertEqual(collector.flush(), ['home'])
+      self.assertEqual(ViewStats.objects.get().requests, 1)
@@ -0,0 +1,58 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
+
+from .collector import collector
+from .models import ViewLatency, ViewStats
+
+SUMMED = ['requests', 'errors', 'seconds', 'queries', 'db_seconds', 'n_plus_one']
+
+def labels(view, **extra):
+   pairs = {'view': view, **extra}
+   return '{' + ','.join(f'{name}="{value}"' for name, value in pairs.items()) + '}'
+
+def metric(lines, name, kind, help, samples):
+   lines.append(f'# HELP {name} {help}')
+   lines.append(f'# TYPE {name} {kind}')
+   lines.extend(f'{name}{labels} {value}' for labels, value in samples)
+
+def prometheus(request):
+   """The view totals in the Prometheus text format, for INTERNAL_IPS or staff."""
+   user = getattr(request, 'user', None)
+   if request.META.get('REMOTE_ADDR') not in settings.INTERNAL_IPS and not (user and user.is_staff):
+      raise PermissionDenied
+   #The stored totals plus this process's unflushed ones; the scrape never writes
+   stats = {row['view']: row for row in ViewStats.objects.values('view', *SUMMED, 'max_queries')}
+   buckets = {}
+   for view, le, requests in ViewLatency.objects.values_list('view', 'le', 'requests'):
+      buckets.setdefault(view, {})[le] = requests
+   for view, tally in collector.snapshot().items():
+      row = stats.setdefault(view, dict.fromkeys(SUMMED + ['max_queries'], 0))
+      for name in SUMMED:
+         row[name] += getattr(tally, name)
+      row['max_queries'] = max(row['max_queries'], tally.max_queries)
+      counts = buckets.setdefault(view, {})
+      for le, requests in zip(tally.bounds, tally.buckets):
+         counts[float(le)] = counts.get(float(le), 0) + requests
+
+   lines = []
+   histogram = []
+   views = sorted(stats)
+   for view in views:
+      total = 0
+      for le, requests in sorted(buckets.get(view, {}).items()):
+         total += requests
+         histogram.append((f'_bucket{labels(view, le=le)}', total))
+      histogram.append((f'_bucket{labels(view, le="+Inf")}', stats[view]['requests']))
+      histogram.append((f'_sum{labels(view)}', stats[view]['seconds']))
+      histogram.append((f'_count{labels(view)}', stats[view]['requests']))
+   metric(lines, 'django_view_request_duration_seconds', 'histogram', 'Request latency by resolved view name.', histogram)
+   for name, field, help in [
+      ('django_view_errors_total', 'errors', 'Responses with a 5xx status.'),
+      ('django_view_db_queries_total', 'queries', 'Database queries run.'),
+      ('django_view_db_duration_seconds_total', 'db_seconds', 'Time spent in database queries.'),
+      ('django_view_n_plus_one_requests_total', 'n_plus_one', 'Requests that repeated one statement METRICS_N_PLUS_ONE_THRESHOLD times or more.'),
+   ]:
+      metric(lines, name, 'counter', help, [(labels(view), stats[view][field]) for view in views])
+   metric(lines, 'django_view_db_queries_max', 'gauge', 'Most queries run by one request.', [(labels(view), stats[view]['max_queries']) for view in views])
+   return HttpResponse('\n'.join(lines) + '\n', content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -1,3 +1,16 @@
 from django.test import TestCase
 
-# Create your tests here.
+from store.models import Collection, Product
+
+class SayHelloTests(TestCase):
+   def test_streamed_page_matches_rendered_page(self):
+      collection = Collection.objects.create(title='Toys')
+      for i in range(3):
+         Product.objects.create(title=f'Product {i}', slug='product', price=1, inventory=1, collection=collection)
+
+      rendered = self.client.get('/playground/hello/').content.decode()
+      streamed = b''.join(self.client.get('/playground/hello/', {'stream': 'true'}).streaming_content).decode()
+
+      normalize = lambda page: ''.join(page.split())
+      self.assertEqual(normalize(streamed), normalize(rendered))
+      self.assertEqual(streamed.count('<li>'), 3)
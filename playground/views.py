@@ -1,9 +1,26 @@
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
+from django.template.loader import get_template, render_to_string
 
 from store.models import Customer, Product
+from store.streaming import wants_stream
 
 def say_hello(request):
    queryset = Product.objects.values('id', 'title', 'collection__title')
-   
+
+   if wants_stream(request.GET):
+      return StreamingHttpResponse(stream_products(queryset))
    return render(request, 'playground/hello.html', {'products': list(queryset)})
+
+def stream_products(queryset, chunk_size=2000):
+   #Renders the same page as hello.html, a chunk of list items at a time
+   head, end_of_list, tail = render_to_string('playground/hello.html', {'products': []}).partition('</ul>')
+   item = get_template('playground/product_item.html')
+   chunk = [head]
+   for product in queryset.iterator(chunk_size=chunk_size):
+      chunk.append(item.render({'product': product}))
+      if len(chunk) >= chunk_size:
+         yield ''.join(chunk)
+         chunk = []
+   chunk.append(end_of_list + tail)
+   yield ''.join(chunk)
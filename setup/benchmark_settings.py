@@ -0,0 +1,12 @@
+# Settings of the servers started by the asgi benchmark (store.benchmarks):
+# production-like, on the benchmark's database
+from .settings import *
+
+DEBUG = False
+ALLOWED_HOSTS = ['localhost']
+
+DATABASES['default']['NAME'] = DATABASES['replica']['NAME'] = os.environ['BENCHMARK_DB_NAME']
+
+# Installed by settings while DEBUG was still on
+INSTALLED_APPS.remove('debug_toolbar')
+MIDDLEWARE.remove('debug_toolbar.middleware.DebugToolbarMiddleware')
@@ -28,7 +28,6 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'rest_framework',
     'django_filters',
 
@@ -38,9 +37,15 @@ INSTALLED_APPS = [
     'tags',
     'likes',
     'core',
+    'metrics',
 ]
 
 MIDDLEWARE = [
+    # Times everything below it; its own flushes then happen after the routing
+    # middleware is done, so they never pin the client to the primary
+    'metrics.middleware.MetricsMiddleware',
+    # Outermost after metrics, so the session and everything else it writes pins the client to the primary
+    'core.middleware.ReplicaRoutingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -48,9 +53,14 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# The toolbar's middleware is sync only: under ASGI it would move every
+# request, async views included, onto a worker thread
+if DEBUG:
+    INSTALLED_APPS.insert(INSTALLED_APPS.index('rest_framework'), 'debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
@@ -83,9 +93,110 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Seconds a connection is kept between requests (0 opens one per
+        # request, which is what ASGI servers should use)
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # A file rather than the shared in-memory database, so tests can run concurrent connections
+        'TEST': {
+            'NAME': BASE_DIR / 'test_db.sqlite3',
+        },
     }
 }
 
+# Stand-in read replica: the primary's own file unless DB_REPLICA_NAME points
+# elsewhere, and a second file in tests so they can simulate lag. Reads of
+# views with replica_reads = True go to the aliases in DATABASE_REPLICAS.
+DATABASES['replica'] = {
+    **DATABASES['default'],
+    'NAME': os.getenv('DB_REPLICA_NAME', DATABASES['default']['NAME']),
+    'TEST': {
+        'NAME': BASE_DIR / 'test_replica.sqlite3',
+    },
+}
+
+DATABASE_REPLICAS = [alias for alias in os.getenv('DB_REPLICAS', '').split(',') if alias]
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+
+TEST_RUNNER = 'core.runner.TestRunner'
+
+# Longest replica lag expected, in seconds: clients that wrote read from the
+# primary this long, and responses read from a replica are not cached for
+# cache versions younger than it
+DATABASE_REPLICA_LAG = int(os.getenv('DB_REPLICA_LAG', 5))
+
+# Pragmas run on every new SQLite connection by core.signals
+SQLITE_PROFILES = {
+    # SQLite's defaults: rollback journal, readers and the writer block each other
+    'default': {},
+    # WAL lets readers run alongside the writer; synchronous=NORMAL only syncs
+    # at checkpoints, which is safe in WAL mode (a power loss can drop the last
+    # commits, not corrupt the file)
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'temp_store': 'MEMORY',
+    },
+}
+
+SQLITE_PRAGMAS = SQLITE_PROFILES[os.getenv('SQLITE_PROFILE', 'production')]
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+CACHE_BACKENDS = {
+    'locmem': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'file': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('CACHE_LOCATION', BASE_DIR / '.cache'),
+    },
+}
+
+CACHES = {
+    'default': CACHE_BACKENDS[os.getenv('CACHE_BACKEND', 'locmem')],
+}
+
+# Product list/detail response cache (store.cache)
+STORE_CACHE_ENABLED = os.getenv('STORE_CACHE_ENABLED', 'true').lower() == 'true'
+STORE_CACHE_ALIAS = 'default'
+STORE_CACHE_TIMEOUT = int(os.getenv('STORE_CACHE_TIMEOUT', 300))
+
+
+# Anonymous carts older than this are deleted by the reap_carts command
+STORE_CART_TTL_DAYS = int(os.getenv('STORE_CART_TTL_DAYS', 30))
+
+# Maintenance commands the run_jobs command runs, and the seconds between runs;
+# cron or a task queue beat can run the same commands instead
+STORE_JOBS = {
+    'reap_carts': 3600,
+    'refresh_sales_rollups': 300,
+    'recompute_memberships': 86400,
+}
+
+# Completed-order spend over the last 12 months needed for each membership tier,
+# see the recompute_memberships command
+STORE_MEMBERSHIP_SILVER_SPEND = int(os.getenv('STORE_MEMBERSHIP_SILVER_SPEND', 500))
+STORE_MEMBERSHIP_GOLD_SPEND = int(os.getenv('STORE_MEMBERSHIP_GOLD_SPEND', 2000))
+
+# Likes are counted in process and written to likes.LikeCount at most this many
+# seconds later (0 writes every like through)
+LIKES_FLUSH_INTERVAL = float(os.getenv('LIKES_FLUSH_INTERVAL', 5))
+
+# Per-view request metrics (metrics.middleware), opt-in with METRICS_ENABLED=true
+# and always off while the test suite runs (see core.runner). They are summed
+# in process and added to metrics.ViewStats at most this many seconds later
+# (0 writes through). A request that runs one statement this many times is
+# counted as a likely N+1
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'false').lower() == 'true'
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 10))
+METRICS_N_PLUS_ONE_THRESHOLD = int(os.getenv('METRICS_N_PLUS_ONE_THRESHOLD', 10))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
@@ -1,7 +1,10 @@
-import debug_toolbar
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from metrics.views import prometheus
+from store.urls import tag_urlpatterns
+
 admin.site.site_header = 'Storefront Admin'
 admin.site.index_title = 'Admin Area'
 
@@ -9,5 +12,9 @@ urlpatterns = [
     path('admin/', admin.site.urls),
     path('playground/', include('playground.urls')),
     path('store/', include('store.urls')),
-    path('__debug__/', include(debug_toolbar.urls)),
+    path('tags/', include(tag_urlpatterns)),
+    path('metrics', prometheus, name='metrics'),
 ]
+
+if 'debug_toolbar' in settings.INSTALLED_APPS:
+    urlpatterns.append(path('__debug__/', include('debug_toolbar.urls')))
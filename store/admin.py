@@ -1,9 +1,8 @@
 from django.contrib import admin, messages
-from django.db.models import Count
 from django.utils.html import format_html, urlencode
 from django.urls import reverse
 
-from . import models
+from . import cache, models, pricing
 
 #Classe que irá filtrar os produtos com menos de 10 itens no estoque
 class InventoryFilter(admin.SimpleListFilter):
@@ -22,7 +21,7 @@ class InventoryFilter(admin.SimpleListFilter):
 class ProductAdmin(admin.ModelAdmin):
    actions = ['clear_inventory']
    autocomplete_fields = ['collection']
-   list_display = ['title', 'price', 'inventory_status', 'collection_title']
+   list_display = ['title', 'price', 'effective_price', 'inventory_status', 'collection_title']
    list_editable = ['price']
    list_filter = ['collection', 'last_update', InventoryFilter]
    list_per_page = 10
@@ -41,9 +40,17 @@ class ProductAdmin(admin.ModelAdmin):
          return 'Low'
       return 'OK'
 
+   def save_model(self, request, obj, form, change):
+      super().save_model(request, obj, form, change)
+      #New promotion links are saved after this and reprice through store.signals
+      if change and 'price' in form.changed_data:
+         pricing.reprice_edited(obj)
+
    @admin.action(description='Clear inventory')
    def clear_inventory(self, request, queryset):
+      products = list(queryset.values_list('id', 'collection_id'))
       updated_count = queryset.update(inventory=0)
+      cache.invalidate_products([id for id, _ in products], [collection_id for _, collection_id in products])
       self.message_user(request, f'{updated_count} products were successfully updated.', messages.SUCCESS)
 
 #Customer
@@ -80,9 +87,4 @@ class CollectionAdmin(admin.ModelAdmin):
    def products_count(self, collection):
       url =  reverse('admin:store_product_changelist') + '?' + urlencode({'collection__id': str(collection.id)})
       return format_html('<a href="{}">{}</a>', url, collection.products_count)
-        
-   def get_queryset(self, request):
-      return super().get_queryset(request).annotate(
-         products_count=Count('products')
-      )
 
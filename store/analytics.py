@@ -0,0 +1,271 @@
+import heapq
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as midnight, timedelta
+from operator import itemgetter
+from django.db import connections, transaction
+from django.db.models import Case, DateField, F, Max, Min, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import MONEY_TOTAL, Collection, DailyCollectionSales, DailyProductSales, Order, OrderItem, Product, SalesLeaderboard, Watermark
+
+WATERMARK = 'sales_rollups'
+
+#Trailing windows (in days, ending today) whose top sellers are precomputed,
+#and how many entries each keeps per metric
+LEADERBOARD_WINDOWS = [7, 30, 90, 365]
+LEADERBOARD_SIZE = 100
+
+def local_days(first, last):
+   """(day, start of the next day) for each local day from first to last, inclusive."""
+   tz = timezone.get_current_timezone()
+   day = first
+   while day <= last:
+      yield day, datetime.combine(day + timedelta(days=1), midnight.min, tz)
+      day += timedelta(days=1)
+
+def daily_sales(order_items, first, last):
+   """
+   Units and revenue of `order_items`, all placed between the local days first
+   and last, grouped by day, product and the product's collection.
+   """
+   #Bucketing placed_at against each local midnight stays in SQL; TruncDate
+   #would call back into Python for every order item
+   day = Case(*[When(order__placed_at__lt=next_day, then=Value(day)) for day, next_day in local_days(first, last)], output_field=DateField())
+   return (
+      order_items
+      .annotate(sale_day=day, sale_collection=F('product__collection_id'))
+      .values_list('sale_day', 'product_id', 'sale_collection')
+      .annotate(units=Sum('quantity'), revenue=Sum(F('quantity') * F('unit_price'), output_field=MONEY_TOTAL))
+      .order_by()
+   )
+
+def sold(order_items):
+   #Only orders whose payment completed are sales; apply_payment_change keeps
+   #the rollups right when a payment completes or fails later
+   return order_items.filter(order__payment_status=Order.COMPLETE)
+
+def rollup_values(rows):
+   """(model, key column, parameter rows) of both rollups for (day, product_id, collection_id, units, revenue) rows."""
+   collections = {}
+   for day, _, collection_id, units, revenue in rows:
+      totals = collections.setdefault((day, collection_id), [0, 0])
+      totals[0] += units
+      totals[1] += revenue
+   connection = connections[DailyProductSales.objects.db]
+   day, money = connection.ops.adapt_datefield_value, connection.ops.adapt_decimalfield_value
+   return [
+      (DailyProductSales, 'product_id', [(day(row[0]), row[1], row[3], money(row[4])) for row in rows]),
+      (DailyCollectionSales, 'collection_id', [(day(key[0]), key[1], units, money(revenue)) for key, (units, revenue) in collections.items()]),
+   ]
+
+def add_to_rollups(rows):
+   """Adds (day, product_id, collection_id, units, revenue) rows into both rollups, summing into existing days."""
+   with connections[DailyProductSales.objects.db].cursor() as cursor:
+      for model, column, values in rollup_values(rows):
+         table = model._meta.db_table
+         cursor.executemany(f'''
+            INSERT INTO {table} (day, {column}, units, revenue) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (day, {column}) DO UPDATE SET
+               units = {table}.units + excluded.units,
+               revenue = {table}.revenue + excluded.revenue
+         ''', values)
+
+def take_from_rollups(rows):
+   """Takes (day, product_id, collection_id, units, revenue) rows added before back out of both rollups."""
+   with connections[DailyProductSales.objects.db].cursor() as cursor:
+      for model, column, values in rollup_values(rows):
+         table = model._meta.db_table
+         cursor.executemany(f'''
+            UPDATE {table} SET units = units - %s, revenue = revenue - %s WHERE day = %s AND {column} = %s
+         ''', [(units, revenue, day, key) for day, key, units, revenue in values])
+         #A rebuild would have no row for a day left without sales
+         cursor.executemany(f'DELETE FROM {table} WHERE day = %s AND {column} = %s AND units = 0', [(day, key) for day, key, _, _ in values])
+
+def refresh_sales_rollups(batch_size=100_000, log=None):
+   """
+   Folds order items added since the last refresh into the daily rollups,
+   batch_size items at a time. A batch and the watermark move in the same
+   transaction, so an item is never counted twice or skipped. Only items of
+   orders whose payment is complete are counted, and only new items are
+   picked up: edits to existing order items need a rebuild. The leaderboards
+   are recomputed at the end. Returns the totals.
+   """
+   tz = timezone.get_current_timezone()
+   totals = {'items': 0, 'batches': 0, 'seconds': 0.0}
+   started = time.perf_counter()
+   while True:
+      batch_started = time.perf_counter()
+      with transaction.atomic():
+         watermark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK)
+         ids = list(OrderItem.objects.filter(id__gt=watermark.position).order_by('id').values_list('id', flat=True)[:batch_size])
+         if not ids:
+            break
+         items = OrderItem.objects.filter(id__gt=watermark.position, id__lte=ids[-1])
+         span = items.aggregate(first=Min('order__placed_at'), last=Max('order__placed_at'))
+         add_to_rollups(list(daily_sales(sold(items), timezone.localdate(span['first'], tz), timezone.localdate(span['last'], tz))))
+         watermark.position = ids[-1]
+         watermark.save()
+      elapsed = time.perf_counter() - batch_started
+      totals['items'] += len(ids)
+      totals['batches'] += 1
+      if log:
+         log(f'folded {len(ids)} order items in {elapsed * 1000:.1f} ms ({len(ids) / elapsed:,.0f} items/s)')
+      if len(ids) < batch_size:
+         break
+   refresh_leaderboards()
+   totals['seconds'] = time.perf_counter() - started
+   return totals
+
+def apply_payment_change(order_id, sign):
+   """
+   Adds (sign 1) or takes back (sign -1) the items of an order whose payment
+   just completed, or stopped being complete. Only the items a refresh has
+   already passed are touched; it judges the later ones itself. The
+   leaderboards of the windows holding the order's day are dropped, so
+   top_sellers ranks those periods on the rollups until the next refresh.
+   """
+   with transaction.atomic():
+      watermark, _ = Watermark.objects.select_for_update().get_or_create(name=WATERMARK)
+      day = timezone.localdate(Order.objects.values_list('placed_at', flat=True).get(pk=order_id), timezone.get_current_timezone())
+      rows = list(daily_sales(OrderItem.objects.filter(order_id=order_id, id__lte=watermark.position), day, day))
+      (add_to_rollups if sign > 0 else take_from_rollups)(rows)
+      covering = Q()
+      for window in LEADERBOARD_WINDOWS:
+         covering |= Q(window_days=window, end_day__gte=day, end_day__lt=day + timedelta(days=window))
+      SalesLeaderboard.objects.filter(covering).delete()
+
+def refresh_leaderboards(today=None):
+   """
+   Recomputes the top LEADERBOARD_SIZE products and collections, by revenue
+   and by units, of each trailing window from the daily rollups. A long window
+   sums every product's rollup rows, which is too slow to do per request.
+   """
+   today = today or timezone.localdate()
+   with transaction.atomic():
+      SalesLeaderboard.objects.all().delete()
+      for window in LEADERBOARD_WINDOWS:
+         start = today - timedelta(days=window - 1)
+         for by, sales in [('product', DailyProductSales), ('collection', DailyCollectionSales)]:
+            totals = list(sales.objects.filter(day__gte=start, day__lte=today).values_list(f'{by}_id').annotate(units=Sum('units'), revenue=Sum('revenue')).order_by())
+            leaders = set(heapq.nlargest(LEADERBOARD_SIZE, totals, key=itemgetter(1))) | set(heapq.nlargest(LEADERBOARD_SIZE, totals, key=itemgetter(2)))
+            SalesLeaderboard.objects.bulk_create(
+               SalesLeaderboard(window_days=window, end_day=today, by=by, key_id=key_id, units=units, revenue=revenue)
+               for key_id, units, revenue in leaders
+            )
+
+def day_ranges(first, last, days):
+   day = first
+   while day <= last:
+      end = min(day + timedelta(days=days - 1), last)
+      yield day, end
+      day = end + timedelta(days=1)
+
+def aggregate_range(bounds):
+   first, last, last_id = bounds
+   tz = timezone.get_current_timezone()
+   start, end = datetime.combine(first, midnight.min, tz), datetime.combine(last + timedelta(days=1), midnight.min, tz)
+   items = OrderItem.objects.filter(order__placed_at__gte=start, order__placed_at__lt=end, id__lte=last_id)
+   return first, list(daily_sales(sold(items), first, last))
+
+def fork_context():
+   """
+   The fork start method where it is the platform's default, otherwise None.
+   Workers have to inherit this process's Django setup, test databases
+   included; fork does not exist on Windows and is unsafe on macOS.
+   """
+   if multiprocessing.get_all_start_methods()[0] != 'fork':
+      return None
+   return multiprocessing.get_context('fork')
+
+def allows_concurrent_reads(connection):
+   #Outside WAL mode, SQLite readers block the writer's commit
+   if connection.vendor != 'sqlite':
+      return True
+   with connection.cursor() as cursor:
+      cursor.execute('PRAGMA journal_mode')
+      return cursor.fetchone()[0] == 'wal'
+
+def rebuild_sales_rollups(days_per_chunk=31, workers=4, log=None):
+   """
+   Recomputes the rollups from scratch. History is split into date ranges of
+   days_per_chunk days that are aggregated in parallel worker processes (the
+   expensive, read-only part); each range is then written by this process in
+   its own short transaction, so SQLite only ever sees one writer. On SQLite
+   that needs WAL mode, and workers need fork (see fork_context); otherwise
+   the ranges are aggregated in this process.
+   The watermark ends at the last order item that existed when the rebuild
+   began.
+   """
+   started = time.perf_counter()
+   last_id = OrderItem.objects.aggregate(last=Max('id'))['last'] or 0
+   bounds = Order.objects.aggregate(first=Min('placed_at'), last=Max('placed_at'))
+   with transaction.atomic():
+      DailyProductSales.objects.all().delete()
+      DailyCollectionSales.objects.all().delete()
+      Watermark.objects.update_or_create(name=WATERMARK, defaults={'position': last_id})
+   if bounds['first'] is None:
+      refresh_leaderboards()
+      return {'chunks': 0, 'rows': 0, 'seconds': time.perf_counter() - started}
+
+   tz = timezone.get_current_timezone()
+   chunks = [(first, last, last_id) for first, last in day_ranges(timezone.localdate(bounds['first'], tz), timezone.localdate(bounds['last'], tz), days_per_chunk)]
+   context = fork_context()
+   if workers > 1 and context and allows_concurrent_reads(connections[OrderItem.objects.db]):
+      #Forked workers must not share this process's database connections
+      connections.close_all()
+      executor = ProcessPoolExecutor(workers, mp_context=context)
+      results = executor.map(aggregate_range, chunks)
+   else:
+      executor, results = None, map(aggregate_range, chunks)
+
+   totals = {'chunks': len(chunks), 'rows': 0}
+   try:
+      for first, rows in results:
+         with transaction.atomic():
+            add_to_rollups(rows)
+         totals['rows'] += len(rows)
+         if log:
+            log(f'rebuilt from {first}: {len(rows)} product rollup rows')
+   finally:
+      if executor:
+         executor.shutdown()
+   refresh_leaderboards()
+   totals['seconds'] = time.perf_counter() - started
+   return totals
+
+def top_sellers(start, end, by='product', metric='revenue', limit=10):
+   """The products (or collections) with the highest units or revenue between two days, inclusive."""
+   model, sales = (Collection, DailyCollectionSales) if by == 'collection' else (Product, DailyProductSales)
+   key = f'{by}_id'
+   window = (end - start).days + 1
+   rows = []
+   if window in LEADERBOARD_WINDOWS and limit <= LEADERBOARD_SIZE:
+      leaderboard = SalesLeaderboard.objects.filter(window_days=window, by=by, end_day=end)
+      rows = list(leaderboard.values('units', 'revenue', **{key: F('key_id')}).order_by(f'-{metric}', 'key_id')[:limit])
+   if not rows:
+      #Any other period is ranked on the rollup alone
+      rows = list(
+         sales.objects.filter(day__gte=start, day__lte=end)
+         .values(key)
+         .annotate(units=Sum('units'), revenue=Sum('revenue'))
+         .order_by(f'-{metric}', key)[:limit]
+      )
+   titles = dict(model.objects.filter(id__in=[row[key] for row in rows]).values_list('id', 'title'))
+   return [{key: row[key], 'title': titles.get(row[key]), 'units': row['units'], 'revenue': row['revenue']} for row in rows]
+
+def sales_series(start, end, product_id=None, collection_id=None):
+   """Daily units and revenue between two days for a product, a collection or the whole store."""
+   if product_id is not None:
+      sales = DailyProductSales.objects.filter(product_id=product_id)
+   elif collection_id is not None:
+      sales = DailyCollectionSales.objects.filter(collection_id=collection_id)
+   else:
+      sales = DailyCollectionSales.objects.all()
+   return list(
+      sales.filter(day__gte=start, day__lte=end)
+      .values('day')
+      .annotate(units=Sum('units'), revenue=Sum('revenue'))
+      .order_by('day')
+   )
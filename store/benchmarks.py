@@ -0,0 +1,1246 @@
+import json
+import os
+import random
+import re
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from decimal import Decimal
+from itertools import cycle, islice
+from django.core.management import call_command
+from django.db import OperationalError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+
+from . import seeding
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product
+from .seeding import ADJECTIVES, NOUNS
+
+SCENARIOS = {}
+
+def scenario(func):
+   SCENARIOS[func.__name__.replace('_', '-')] = func
+   return func
+
+def percentile(timings, q):
+   ordered = sorted(timings)
+   return ordered[min(len(ordered) - 1, int(q / 100 * len(ordered)))]
+
+def measure(func, repeat=20, warmup=2):
+   for _ in range(warmup):
+      func()
+   with CaptureQueriesContext(connection) as queries:
+      func()
+   timings = []
+   for _ in range(repeat):
+      start = time.perf_counter()
+      func()
+      timings.append((time.perf_counter() - start) * 1000)
+   return {
+      'p50_ms': round(percentile(timings, 50), 3),
+      'p99_ms': round(percentile(timings, 99), 3),
+      'mean_ms': round(sum(timings) / len(timings), 3),
+      'queries': len(queries),
+   }
+
+def request_factory():
+   return APIRequestFactory(SERVER_NAME='localhost')
+
+def call_view(view, path, params=None, **kwargs):
+   response = view(request_factory().get(path, params or {}), **kwargs)
+   response.render()
+   assert response.status_code == 200, response.status_code
+   return response
+
+@contextmanager
+def scratch_database():
+   """Points the default connection at an empty, migrated SQLite file for the duration of the block."""
+   original = connection.settings_dict['NAME']
+   with tempfile.TemporaryDirectory() as directory:
+      connection.close()
+      connection.settings_dict['NAME'] = os.path.join(directory, 'scratch.sqlite3')
+      try:
+         call_command('migrate', verbosity=0)
+         yield
+      finally:
+         connection.close()
+         connection.settings_dict['NAME'] = original
+
+@contextmanager
+def dataset_database(dataset, workers=4, log=print):
+   """
+   Points the default connection at a SQLite file next to the benchmark
+   database holding one of seeding.DATASETS, seeding it on first use.
+   """
+   original = connection.settings_dict['NAME']
+   connection.close()
+   connection.settings_dict['NAME'] = os.path.join(os.path.dirname(original), f'benchmark-{dataset}.sqlite3')
+   try:
+      call_command('migrate', verbosity=0)
+      if not Product.objects.exists():
+         seeding.seed(seeding.DATASETS[dataset], workers=workers, log=log)
+      yield
+   finally:
+      connection.close()
+      connection.settings_dict['NAME'] = original
+
+def max_rss_mb():
+   return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def seed_catalog(products, collections=100, batch_size=10000, log=print):
+   existing = Product.objects.count()
+   if existing >= products:
+      return
+   rng = random.Random(existing)
+   collection_ids = list(Collection.objects.values_list('id', flat=True))
+   if not collection_ids:
+      Collection.objects.bulk_create(Collection(title=f'Collection {i}') for i in range(collections))
+      collection_ids = list(Collection.objects.values_list('id', flat=True))
+   for start in range(existing, products, batch_size):
+      Product.objects.bulk_create(
+         Product(
+            title=f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+            slug=f'product-{i}',
+            description=' '.join(rng.choices(ADJECTIVES + NOUNS, k=12)),
+            price=Decimal(rng.randint(100, 999999)) / 100,
+            inventory=rng.randint(0, 500),
+            collection_id=rng.choice(collection_ids),
+         )
+         for i in range(start, min(start + batch_size, products))
+      )
+      log(f'seeded {min(start + batch_size, products)}/{products} products')
+
+def seed_orders(items, hot_products=10_000, days=365, lines=3, log=print):
+   """Grows OrderItem to `items` rows over the last `days` days, skewed towards the first hot_products products."""
+   existing = OrderItem.objects.count()
+   if existing >= items:
+      return
+   customer, _ = Customer.objects.get_or_create(email='benchmark@example.com', defaults={'first_name': 'Bench', 'last_name': 'Mark', 'phone': '0'})
+   first_product = Product.objects.order_by('id').values_list('id', flat=True).first()
+   batch = 1_000_000
+   for start in range(existing, items, batch):
+      orders = min(batch, items - start) // lines
+      with connection.cursor() as cursor:
+         last_order = cursor.execute('SELECT coalesce(max(id), 0) FROM store_order').fetchone()[0]
+         #Generated in SQL: a million rows a second instead of a few thousand through the ORM
+         cursor.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s)
+            INSERT INTO store_order (id, placed_at, payment_status, customer_id)
+            SELECT %s + i, datetime('now', '-' || (abs(random()) %% (%s * 86400)) || ' seconds'), 'C', %s FROM n
+         ''', [orders, last_order, days, customer.id])
+         #MATERIALIZED so random() runs once per line, not once per product compared in the join
+         cursor.execute('''
+            WITH RECURSIVE line(l) AS (SELECT 1 UNION ALL SELECT l + 1 FROM line WHERE l < %s),
+            pick AS MATERIALIZED (
+               SELECT store_order.id AS order_id,
+                      %s + (abs(random()) %% %s) * (abs(random()) %% %s) / %s AS product_id,
+                      1 + abs(random()) %% 3 AS quantity
+               FROM store_order, line WHERE store_order.id > %s
+            )
+            INSERT INTO store_orderitem (order_id, product_id, quantity, unit_price)
+            SELECT pick.order_id, pick.product_id, pick.quantity, store_product.price
+            FROM pick JOIN store_product ON store_product.id = pick.product_id
+         ''', [lines, first_product, hot_products, hot_products, hot_products, last_order])
+      log(f'seeded {OrderItem.objects.count()}/{items} order items')
+
+@scenario
+def pagination(stdout, products=1_000_000, page_size=10, depth=10_000):
+   """Keyset vs OFFSET pagination on the product list at page 1 and page `depth`."""
+   from rest_framework.pagination import LimitOffsetPagination
+   from .pagination import KeysetPagination
+   from .views import ProductViewSet
+
+   seed_catalog(products, log=stdout.write)
+   keyset_view = ProductViewSet.as_view({'get': 'list'})
+   offset_view = ProductViewSet.as_view({'get': 'list'}, pagination_class=LimitOffsetPagination)
+   offset = (depth - 1) * page_size
+   results = {}
+   for ordering in ['title', 'price', '-last_update']:
+      ordered = Product.objects.order_by(*KeysetPagination().get_ordering(Product.objects.order_by(ordering)))
+      fields = [field.lstrip('-') for field in ordered.query.order_by]
+      last_row = ordered.values_list(*fields)[offset - 1]
+      paginator = KeysetPagination()
+      cursor = paginator.encode_cursor([paginator.to_json(value) for value in last_row])
+      params = {'ordering': ordering, 'page_size': page_size}
+      results[ordering] = {
+         'keyset_page_1': measure(lambda: call_view(keyset_view, '/store/products/', params)),
+         f'keyset_page_{depth}': measure(lambda: call_view(keyset_view, '/store/products/', {**params, 'cursor': cursor})),
+         'offset_page_1': measure(lambda: call_view(offset_view, '/store/products/', {'ordering': ordering, 'limit': page_size})),
+         f'offset_page_{depth}': measure(lambda: call_view(offset_view, '/store/products/', {'ordering': ordering, 'limit': page_size, 'offset': offset})),
+      }
+   return results
+
+@scenario
+def filtered_lists(stdout, products=1_000_000, page_size=10):
+   """First and next page of the product list for collection and range filters under different sort orders."""
+   from urllib.parse import parse_qs, urlsplit
+   from .views import ProductViewSet
+
+   seed_catalog(products, log=stdout.write)
+   view = ProductViewSet.as_view({'get': 'list'})
+   collection_id = Collection.objects.values_list('id', flat=True).first()
+   results = {}
+   for filters in [{'collection_id': collection_id}, {'price__gt': 5000}, {'price__lt': 20}, {'collection_id': collection_id, 'price__gt': 5000}]:
+      for ordering in ['title', 'price', '-last_update']:
+         params = {**filters, 'ordering': ordering, 'page_size': page_size}
+         next_page = call_view(view, '/store/products/', params).data['next']
+         cursor = parse_qs(urlsplit(next_page).query)['cursor'][0]
+         results[' '.join(f'{key}={value}' for key, value in params.items() if key != 'page_size')] = {
+            'page_1': measure(lambda: call_view(view, '/store/products/', params)),
+            'page_2': measure(lambda: call_view(view, '/store/products/', {**params, 'cursor': cursor})),
+         }
+   return results
+
+@scenario
+def search(stdout, products=1_000_000, checkpoint=100_000):
+   """FTS5 search vs SearchFilter's icontains scan, at `checkpoint` and at `products` rows."""
+   from django_filters.rest_framework import DjangoFilterBackend
+   from rest_framework.filters import OrderingFilter, SearchFilter
+   from .views import ProductViewSet
+
+   fts_view = ProductViewSet.as_view({'get': 'list'})
+   like_view = ProductViewSet.as_view({'get': 'list'}, filter_backends=[DjangoFilterBackend, SearchFilter, OrderingFilter])
+   searches = {
+      'common_term': 'chair',
+      'two_terms': 'wooden chair',
+      'prefix': 'waterpr',
+      'rare_term': '999999',
+      'no_match': 'unicorn',
+   }
+   results = {}
+   for size in sorted({checkpoint, products}):
+      seed_catalog(size, log=stdout.write)
+      results[Product.objects.count()] = {
+         label: {
+            'fts': measure(lambda: call_view(fts_view, '/store/products/', {'search': term}), repeat=10),
+            'icontains': measure(lambda: call_view(like_view, '/store/products/', {'search': term}), repeat=10),
+         }
+         for label, term in searches.items()
+      }
+   return results
+
+@scenario
+def cart_totals(stdout, products=10_000):
+   """Cart retrieve and totals computed in SQL vs summed per item in Python, at 1, 50 and 500 lines."""
+   from .views import CartViewSet
+
+   seed_catalog(products, log=stdout.write)
+   product_ids = list(Product.objects.values_list('id', flat=True)[:500])
+   view = CartViewSet.as_view({'get': 'retrieve'})
+
+   def python_total(cart_id):
+      cart = Cart.objects.prefetch_related('items__product').get(pk=cart_id)
+      return sum(item.quantity * item.product.price for item in cart.items.all())
+
+   def db_total(cart_id):
+      return Cart.objects.with_total_price().get(pk=cart_id).total_price
+
+   results = {}
+   for lines in [1, 50, 500]:
+      cart = Cart.objects.create()
+      CartItem.objects.bulk_create(CartItem(cart=cart, product_id=product_id, quantity=2) for product_id in product_ids[:lines])
+      assert python_total(cart.id) == db_total(cart.id)
+      results[f'{lines}_items'] = {
+         'python_total': measure(lambda: python_total(cart.id)),
+         'db_total': measure(lambda: db_total(cart.id)),
+         'retrieve': measure(lambda: call_view(view, f'/store/carts/{cart.id}/', pk=cart.id)),
+      }
+      cart.delete()
+   return results
+
+@scenario
+def collection_counts(stdout, products=1_000_000):
+   """Collection listing with a Count('products') annotation vs the maintained products_count column."""
+   from django.db.models import Count
+   from .views import CollectionViewSet
+
+   seed_catalog(products, log=stdout.write)
+   view = CollectionViewSet.as_view({'get': 'list'})
+   return {
+      'annotation_queryset': measure(lambda: list(Collection.objects.annotate(annotated_count=Count('products'))), repeat=10),
+      'counter_queryset': measure(lambda: list(Collection.objects.all()), repeat=10),
+      'counter_list_endpoint': measure(lambda: call_view(view, '/store/collections/'), repeat=10),
+   }
+
+@scenario
+def catalog_import(stdout, rows=1_000_000, chunk_size=5000):
+   """Streaming NDJSON import and export of `rows` products into an empty database."""
+   from .catalog import CatalogImporter, export_rows, read_rows
+
+   def generate():
+      rng = random.Random(0)
+      for i in range(rows):
+         yield json.dumps({
+            'title': f'{rng.choice(ADJECTIVES)} {rng.choice(NOUNS)} {i}',
+            'description': ' '.join(rng.choices(ADJECTIVES + NOUNS, k=12)),
+            'price': str(Decimal(rng.randint(100, 999999)) / 100),
+            'inventory': rng.randint(0, 500),
+            'collection': f'Collection {rng.randrange(100)}',
+         }) + '\n'
+
+   with scratch_database(), tempfile.TemporaryFile('w+') as file:
+      file.writelines(generate())
+      file.seek(0)
+      rss_before = max_rss_mb()
+      reports = []
+      def progress(report):
+         reports.append(report['rows_per_second'])
+         if report['chunk'] % 20 == 0:
+            stdout.write(f"imported {report['chunk'] * chunk_size} rows ({report['rows_per_second']:,.0f} rows/s)")
+      totals = CatalogImporter(chunk_size=chunk_size, progress=progress).run(read_rows(file, 'ndjson'))
+      import_rss = max_rss_mb()
+
+      started = time.perf_counter()
+      exported = sum(text.count('\n') for text in export_rows(chunk_size=chunk_size))
+      export_seconds = time.perf_counter() - started
+
+   return {
+      'import_seconds': round(totals['seconds'], 1),
+      'import_rows_per_second': round(totals['rows'] / totals['seconds']),
+      'slowest_chunk_rows_per_second': round(min(reports)),
+      'fastest_chunk_rows_per_second': round(max(reports)),
+      'max_rss_growth_mb': round(import_rss - rss_before, 1),
+      'export_seconds': round(export_seconds, 1),
+      'export_rows_per_second': round(exported / export_seconds),
+   }
+
+def measure_response(view, params, repeat=3):
+   """Time to first byte, total time and peak traced memory for one response, streamed or not."""
+   def consume():
+      start = time.perf_counter()
+      response = view(request_factory().get('/store/products/', params))
+      if response.streaming:
+         content = iter(response.streaming_content)
+         size = len(next(content))
+         first_byte = time.perf_counter()
+         size += sum(len(chunk) for chunk in content)
+      else:
+         size = len(response.render().content)
+         first_byte = time.perf_counter()
+      return (first_byte - start) * 1000, (time.perf_counter() - start) * 1000, size
+
+   timings = [consume() for _ in range(repeat)]
+   tracemalloc.start()
+   consume()
+   peak = tracemalloc.get_traced_memory()[1]
+   tracemalloc.stop()
+   return {
+      'ttfb_ms': round(min(timing[0] for timing in timings), 1),
+      'total_ms': round(min(timing[1] for timing in timings), 1),
+      'bytes': timings[0][2],
+      'peak_memory_mb': round(peak / 2**20, 1),
+   }
+
+@scenario
+def streaming(stdout, products=1_000_000):
+   """Unpaginated product list rendered whole vs ?stream=true, at ~1%, ~10% and 100% of the catalog."""
+   from .views import ProductViewSet
+
+   seed_catalog(products, log=stdout.write)
+   view = ProductViewSet.as_view({'get': 'list'}, pagination_class=None)
+   results = {}
+   for inventory in [5, 50, 501]:
+      params = {'inventory__lt': inventory}
+      rows = Product.objects.filter(inventory__lt=inventory).count()
+      stdout.write(f'measuring {rows} rows')
+      results[f'{rows}_rows'] = {
+         'rendered': measure_response(view, params),
+         'streamed': measure_response(view, {**params, 'stream': 'true'}),
+      }
+   return results
+
+@scenario
+def product_includes(stdout, products=100_000, tags_per_product=3, users=200, likes_per_product=5, page_size=100):
+   """Product list pages with ?include=tags,likes_count against per-row generic relation lookups."""
+   from django.contrib.contenttypes.models import ContentType
+   from core.models import User
+   from likes.models import LikedItem
+   from tags.models import Tag, TaggedItem
+   from .views import ProductViewSet
+
+   seed_catalog(products, log=stdout.write)
+   content_type = ContentType.objects.get_for_model(Product)
+   if not TaggedItem.objects.exists():
+      rng = random.Random(0)
+      tags = Tag.objects.bulk_create(Tag(label=label) for label in ADJECTIVES + NOUNS)
+      user_ids = [user.id for user in User.objects.bulk_create(User(username=f'bench{i}', email=f'bench{i}@example.com') for i in range(users))]
+      product_ids = list(Product.objects.values_list('id', flat=True))
+      TaggedItem.objects.bulk_create((TaggedItem(tag=tag, content_type=content_type, object_id=id) for id in product_ids for tag in rng.sample(tags, tags_per_product)), batch_size=10_000)
+      LikedItem.objects.bulk_create((LikedItem(user_id=user, content_type=content_type, object_id=id) for id in product_ids for user in rng.sample(user_ids, rng.randint(0, 2 * likes_per_product))), batch_size=10_000)
+      stdout.write(f'seeded {TaggedItem.objects.count()} tagged items and {LikedItem.objects.count()} likes')
+
+   view = ProductViewSet.as_view({'get': 'list'})
+   params = {'page_size': page_size}
+
+   def per_row():
+      for product in Product.objects.order_by('title', 'id')[:page_size]:
+         list(TaggedItem.objects.filter(content_type=content_type, object_id=product.id).values_list('tag__label', flat=True))
+         LikedItem.objects.filter(content_type=content_type, object_id=product.id).count()
+
+   return {
+      'page': measure(lambda: call_view(view, '/store/products/', params)),
+      'page_with_includes': measure(lambda: call_view(view, '/store/products/', {**params, 'include': 'tags,likes_count'})),
+      'per_row_lookups': measure(per_row),
+   }
+
+@scenario
+def tag_filters(stdout, products=400_000, page_size=10):
+   """?tag= product lists and tag counts from the tag index and TagCount vs joins over TaggedItem's old indexes."""
+   from django.contrib.contenttypes.models import ContentType
+   from tags.models import Tag, TaggedItem
+   from .views import ProductViewSet, TagViewSet
+
+   seed_catalog(products, log=stdout.write)
+   content_type = ContentType.objects.get_for_model(Product).id
+   if not TaggedItem.objects.exists():
+      #An adjective and a noun on every product, 'sale' on 30%, 'featured' on 3% and
+      #one of 100 'edition' tags on 0.05%
+      labels = ADJECTIVES + NOUNS + ['sale', 'featured'] + [f'edition-{i}' for i in range(100)]
+      Tag.objects.bulk_create(Tag(label=label) for label in set(labels) - set(Tag.objects.values_list('label', flat=True)))
+      tags = dict(Tag.objects.filter(label__in=labels).values_list('label', 'id'))
+      groups = [
+         (' + '.join(f'CASE WHEN p.id % {len(ADJECTIVES)} = {i} THEN {tags[label]} ELSE 0 END' for i, label in enumerate(ADJECTIVES)), '1'),
+         (' + '.join(f'CASE WHEN (p.id / {len(ADJECTIVES)}) % {len(NOUNS)} = {i} THEN {tags[label]} ELSE 0 END' for i, label in enumerate(NOUNS)), '1'),
+         (str(tags['sale']), 'p.id % 10 < 3'),
+         (str(tags['featured']), 'p.id % 100 < 3'),
+         (f"{tags['edition-0']} + (p.id / 2000) % 100", 'p.id % 2000 = 7'),
+      ]
+      with connection.cursor() as cursor:
+         for tag_id, condition in groups:
+            cursor.execute(f'INSERT INTO tags_taggeditem (tag_id, content_type_id, object_id) SELECT {tag_id}, %s, p.id FROM store_product p WHERE {condition}', [content_type])
+            stdout.write(f'tagged {TaggedItem.objects.count()} items')
+
+   with connection.cursor() as cursor:
+      cursor.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'tags_taggeditem' AND sql LIKE '%(\"tag_id\")'")
+      tag_id_index = cursor.fetchone()[0]
+
+   def join(labels_groups):
+      #What ?tag= would have cost over the tag_id foreign key index: join, dedupe, sort
+      where = ' AND '.join(
+         f'p.id IN (SELECT t.object_id FROM tags_taggeditem t INDEXED BY {tag_id_index} JOIN tags_tag g ON g.id = t.tag_id '
+         f'WHERE t.content_type_id = %s AND g.label IN ({", ".join(["%s"] * len(labels))}))'
+         for labels in labels_groups
+      )
+      params = [value for labels in labels_groups for value in [content_type, *labels]]
+      with connection.cursor() as cursor:
+         cursor.execute(f'SELECT p.id, p.title FROM store_product p WHERE {where} ORDER BY p.title, p.id LIMIT {page_size + 1}', params)
+         return cursor.fetchall()
+
+   def join_counts():
+      with connection.cursor() as cursor:
+         cursor.execute(f'SELECT t.tag_id, COUNT(*) FROM tags_taggeditem t INDEXED BY {tag_id_index} WHERE t.content_type_id = %s GROUP BY t.tag_id ORDER BY 2 DESC LIMIT {page_size + 1}', [content_type])
+         return cursor.fetchall()
+
+   products_view = ProductViewSet.as_view({'get': 'list'})
+   results = {'tagged_items': TaggedItem.objects.count()}
+   for name, groups in [
+      ('sale (30%)', ['sale']), ('featured (3%)', ['featured']), ('edition-5 (0.05%)', ['edition-5']),
+      ('red or blue', ['red,blue']), ('sale and chair', ['sale', 'chair']), ('sale and edition-5', ['sale', 'edition-5']),
+   ]:
+      results[name] = {
+         'endpoint': measure(lambda: call_view(products_view, '/store/products/', {'tag': groups, 'page_size': page_size})),
+         'join': measure(lambda: join([group.split(',') for group in groups]), repeat=5, warmup=1),
+      }
+   results['tag_counts'] = {
+      'endpoint': measure(lambda: call_view(TagViewSet.as_view({'get': 'list'}), '/tags/', {'page_size': page_size})),
+      'join': measure(join_counts, repeat=5, warmup=1),
+   }
+   return results
+
+@scenario
+def checkout(stdout, products=10_000, orders=2000, workers=8, lines=3, hot_products=50):
+   """Concurrent checkouts on SQLite in WAL mode; hot products are stocked for about half of the demand."""
+   from rest_framework.test import force_authenticate
+   from core.models import User
+   from .views import OrderViewSet
+
+   seed_catalog(products, log=stdout.write)
+   with connection.cursor() as cursor:
+      cursor.execute('PRAGMA journal_mode=WAL')
+   customer, _ = Customer.objects.get_or_create(email='benchmark@example.com', defaults={'first_name': 'Bench', 'last_name': 'Mark', 'phone': '0'})
+   user, _ = User.objects.get_or_create(username='benchmark', defaults={'email': customer.email})
+   hot = list(Product.objects.order_by('id').values('id', 'inventory')[:hot_products])
+   Product.objects.filter(id__in=[product['id'] for product in hot]).update(inventory=orders * lines // hot_products // 2)
+
+   rng = random.Random(0)
+   carts = Cart.objects.bulk_create(Cart() for _ in range(orders))
+   CartItem.objects.bulk_create(
+      CartItem(cart=cart, product_id=product['id'], quantity=1)
+      for cart in carts for product in rng.sample(hot, lines)
+   )
+   view = OrderViewSet.as_view({'post': 'create'})
+
+   def place(cart):
+      start = time.perf_counter()
+      try:
+         request = request_factory().post('/store/orders/', {'cart_id': str(cart.id), 'customer_id': customer.id}, format='json')
+         force_authenticate(request, user)
+         response = view(request)
+         return response.status_code, (time.perf_counter() - start) * 1000
+      except OperationalError:
+         return 'locked', (time.perf_counter() - start) * 1000
+
+   def place_all(carts):
+      #Each worker keeps its connection, like a threaded server with persistent connections
+      try:
+         return [place(cart) for cart in carts]
+      finally:
+         connection.close()
+
+   first_order = (Order.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+   started = time.perf_counter()
+   with ThreadPoolExecutor(max_workers=workers) as executor:
+      outcomes = [outcome for batch in executor.map(place_all, [carts[i::workers] for i in range(workers)]) for outcome in batch]
+   elapsed = time.perf_counter() - started
+
+   placed = OrderItem.objects.filter(order_id__gte=first_order)
+   stock = Product.objects.filter(id__in=[product['id'] for product in hot]).values_list('inventory', flat=True)
+   timings = [timing for _, timing in outcomes]
+   statuses = [status for status, _ in outcomes]
+   results = {
+      'checkouts_per_second': round(len(carts) / elapsed),
+      'placed': statuses.count(201),
+      'out_of_stock': statuses.count(400),
+      'locked': statuses.count('locked'),
+      'p50_ms': round(percentile(timings, 50), 2),
+      'p99_ms': round(percentile(timings, 99), 2),
+      'min_inventory': min(stock),
+      'units_sold': sum(placed.values_list('quantity', flat=True)),
+      'units_stocked': orders * lines // hot_products // 2 * hot_products,
+   }
+
+   placed.delete()
+   Order.objects.filter(id__gte=first_order).delete()
+   Cart.objects.filter(id__in=[cart.id for cart in carts]).delete()
+   Product.objects.bulk_update([Product(id=product['id'], inventory=product['inventory']) for product in hot], ['inventory'])
+   return results
+
+@scenario
+def likes(stdout, users=2000, workers=8, flush_interval=1.0):
+   """Concurrent likes of one product on SQLite in WAL mode, counted write-through vs buffered."""
+   from rest_framework.test import force_authenticate
+   from core.models import User
+   from likes.counters import counter
+   from likes.models import LikeCount, LikedItem
+   from .views import ProductViewSet
+
+   seed_catalog(1000, log=stdout.write)
+   with connection.cursor() as cursor:
+      cursor.execute('PRAGMA journal_mode=WAL')
+   if User.objects.filter(username__startswith='liker').count() < users:
+      User.objects.bulk_create(User(username=f'liker{i}', email=f'liker{i}@example.com') for i in range(users))
+   likers = list(User.objects.filter(username__startswith='liker')[:users])
+   product = Product.objects.order_by('id').first()
+   view = ProductViewSet.as_view({'post': 'like'})
+
+   def like(user):
+      request = request_factory().post(f'/store/products/{product.id}/like/')
+      force_authenticate(request, user)
+      start = time.perf_counter()
+      try:
+         status = view(request, pk=product.id).status_code
+      except OperationalError:
+         status = 'locked'
+      return status, (time.perf_counter() - start) * 1000
+
+   def like_all(users):
+      try:
+         return [like(user) for user in users]
+      finally:
+         connection.close()
+
+   results = {}
+   for mode, interval in [('write_through', 0), ('buffered', flush_interval)]:
+      LikedItem.objects.filter(object_id=product.id).delete()
+      counter.flush()
+      LikeCount.objects.recount()
+      with override_settings(LIKES_FLUSH_INTERVAL=interval):
+         started = time.perf_counter()
+         with ThreadPoolExecutor(max_workers=workers) as executor:
+            outcomes = [outcome for batch in executor.map(like_all, [likers[i::workers] for i in range(workers)]) for outcome in batch]
+         elapsed = time.perf_counter() - started
+         counter.flush()
+      timings = [timing for _, timing in outcomes]
+      results[mode] = {
+         'likes_per_second': round(len(likers) / elapsed),
+         'p50_ms': round(percentile(timings, 50), 2),
+         'p99_ms': round(percentile(timings, 99), 2),
+         'locked': [status for status, _ in outcomes].count('locked'),
+         'liked': LikedItem.objects.filter(object_id=product.id).count(),
+         'counted': LikedItem.objects.counts_for([product])[product],
+      }
+   return results
+
+@scenario
+def connection_profiles(stdout, products=100_000, readers=6, writers=2, seconds=10):
+   """Product reads alongside cart writes from concurrent threads, per SQLite profile and CONN_MAX_AGE."""
+   from django.conf import settings
+   from django.db import close_old_connections
+   from .views import CartItemViewSet, ProductViewSet
+
+   seed_catalog(products, log=stdout.write)
+   collection_ids = list(Collection.objects.values_list('id', flat=True))
+   product_ids = list(Product.objects.values_list('id', flat=True)[:10_000])
+   list_view = ProductViewSet.as_view({'get': 'list'})
+   detail_view = ProductViewSet.as_view({'get': 'retrieve'})
+   add_view = CartItemViewSet.as_view({'post': 'create'})
+
+   def read(rng, _):
+      if rng.random() < 0.5:
+         call_view(list_view, '/store/products/', {'collection_id': rng.choice(collection_ids)})
+      else:
+         product_id = rng.choice(product_ids)
+         call_view(detail_view, f'/store/products/{product_id}/', pk=product_id)
+
+   def write(rng, cart):
+      request = request_factory().post(f'/store/carts/{cart.id}/items/', {'product_id': rng.choice(product_ids), 'quantity': 1}, format='json')
+      assert add_view(request, cart_pk=str(cart.id)).status_code == 201
+
+   def work(role, seed, deadline, cart):
+      rng, timings, locked = random.Random(seed), [], 0
+      try:
+         while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+               role(rng, cart)
+               timings.append((time.perf_counter() - start) * 1000)
+            except OperationalError:
+               locked += 1
+            #What request_finished does after every request
+            close_old_connections()
+         return role, timings, locked
+      finally:
+         connection.close()
+
+   results = {}
+   for mode, profile, max_age in [('default', 'default', 0), ('production_pragmas', 'production', 0), ('production', 'production', 60)]:
+      connection.close()
+      with connection.cursor() as cursor:
+         cursor.execute('PRAGMA journal_mode=DELETE')
+      connection.close()
+      connection.settings_dict['CONN_MAX_AGE'] = max_age
+      carts = Cart.objects.bulk_create(Cart() for _ in range(writers))
+      with override_settings(SQLITE_PRAGMAS=settings.SQLITE_PROFILES[profile]):
+         deadline = time.perf_counter() + seconds
+         with ThreadPoolExecutor(max_workers=readers + writers) as executor:
+            outcomes = list(executor.map(work, [read] * readers + [write] * writers, range(readers + writers), [deadline] * (readers + writers), [None] * readers + carts))
+      Cart.objects.filter(id__in=[cart.id for cart in carts]).delete()
+      results[mode] = {}
+      for name, role in [('reads', read), ('writes', write)]:
+         timings = [timing for done, batch, _ in outcomes if done is role for timing in batch]
+         results[mode][name] = {
+            'per_second': round(len(timings) / seconds),
+            'p50_ms': round(percentile(timings, 50), 2) if timings else None,
+            'p99_ms': round(percentile(timings, 99), 2) if timings else None,
+            'locked': sum(locked for done, _, locked in outcomes if done is role),
+         }
+      stdout.write(f'{mode}: {results[mode]}')
+   connection.close()
+   connection.settings_dict['CONN_MAX_AGE'] = settings.DATABASES['default']['CONN_MAX_AGE']
+   return results
+
+async def http_load(port, paths, connections, seconds):
+   """
+   A load generator: `connections` keep-alive HTTP/1.1 connections, each
+   sending the next of `paths` as soon as its previous response is read, for
+   `seconds`. Returns the latencies of 200 responses and a count of the rest.
+   """
+   import asyncio
+   deadline = time.perf_counter() + seconds
+   timings, failures = [], Counter()
+
+   async def client(number):
+      try:
+         reader, writer = await asyncio.open_connection('127.0.0.1', port)
+      except OSError:
+         failures['refused'] += 1
+         return
+      try:
+         for path in islice(cycle(paths), number, None):
+            if time.perf_counter() >= deadline:
+               break
+            start = time.perf_counter()
+            writer.write(f'GET {path} HTTP/1.1\r\nHost: localhost\r\n\r\n'.encode())
+            head = await reader.readuntil(b'\r\n\r\n')
+            length = re.search(rb'content-length: *(\d+)', head, re.IGNORECASE)
+            if length:
+               await reader.readexactly(int(length.group(1)))
+            else:
+               #Chunked
+               while size := int(await reader.readuntil(b'\r\n'), 16):
+                  await reader.readexactly(size + 2)
+               await reader.readexactly(2)
+            status = int(head.split(b' ', 2)[1])
+            if status == 200:
+               timings.append((time.perf_counter() - start) * 1000)
+            else:
+               failures[status] += 1
+      except (OSError, asyncio.IncompleteReadError):
+         failures['disconnected'] += 1
+      finally:
+         writer.close()
+
+   await asyncio.gather(*(client(number) for number in range(connections)))
+   return timings, failures
+
+@contextmanager
+def server(command, port, env):
+   """Runs an HTTP server process for the duration of the block, once it accepts connections."""
+   from django.conf import settings
+   process = subprocess.Popen(command, cwd=settings.BASE_DIR, env={**os.environ, **env}, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+   try:
+      for _ in range(300):
+         try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            break
+         except OSError:
+            assert process.poll() is None, f'{command[2]} exited with {process.returncode}'
+            time.sleep(0.1)
+      yield
+   finally:
+      process.terminate()
+      process.wait(30)
+
+@scenario
+def asgi(stdout, products=100_000, connections=1000, seconds=20, threads=8, port=8765):
+   """
+   Requests per second and latency of product list, product detail and cart
+   requests at `connections` concurrent connections: the sync viewsets under
+   WSGI (gunicorn, one process with `threads` threads) and under ASGI, and the
+   async views under ASGI (uvicorn, one process).
+   """
+   import asyncio
+   seed_catalog(products, log=stdout.write)
+   with connection.cursor() as cursor:
+      cursor.execute('PRAGMA journal_mode=WAL')
+   cart = Cart.objects.create()
+   CartItem.objects.bulk_create(CartItem(cart=cart, product_id=product_id, quantity=1) for product_id in Product.objects.values_list('id', flat=True)[:5])
+   collection_ids = list(Collection.objects.values_list('id', flat=True)[:20])
+   product_ids = list(Product.objects.values_list('id', flat=True)[:20])
+
+   def paths(prefix):
+      return [
+         path for collection_id, product_id in zip(collection_ids, product_ids) for path in [
+            f'/store/{prefix}products/?collection_id={collection_id}',
+            f'/store/{prefix}products/{product_id}/',
+            f'/store/{prefix}carts/{cart.id}/',
+         ]
+      ]
+
+   env = {'DJANGO_SETTINGS_MODULE': 'setup.benchmark_settings', 'BENCHMARK_DB_NAME': str(connection.settings_dict['NAME']), 'STORE_CACHE_ENABLED': 'false'}
+   wsgi = [sys.executable, '-m', 'gunicorn', 'setup.wsgi:application', '--bind', f'127.0.0.1:{port}', '--worker-class', 'gthread', '--threads', str(threads), '--worker-connections', str(connections * 2), '--backlog', '4096']
+   asgi = [sys.executable, '-m', 'uvicorn', 'setup.asgi:application', '--port', str(port), '--no-access-log', '--backlog', '4096']
+   results = {}
+   try:
+      for name, command, prefix in [('wsgi_sync_views', wsgi, ''), ('asgi_sync_views', asgi, ''), ('asgi_async_views', asgi, 'async/')]:
+         #Django's persistent connections are per thread, which ASGI does not keep
+         with server(command, port, {**env, 'DB_CONN_MAX_AGE': '0'} if command is asgi else env):
+            started = time.perf_counter()
+            timings, failures = asyncio.run(http_load(port, paths(prefix), connections, seconds))
+            elapsed = time.perf_counter() - started
+         results[name] = {
+            'requests_per_second': round(len(timings) / elapsed),
+            'p50_ms': round(percentile(timings, 50), 2) if timings else None,
+            'p99_ms': round(percentile(timings, 99), 2) if timings else None,
+            'failures': dict(failures),
+         }
+         stdout.write(f'{name}: {results[name]}')
+   finally:
+      cart.delete()
+   return results
+
+@scenario
+def metrics_overhead(stdout, products=100_000, rounds=40, requests=50):
+   """
+   Product list requests through the whole middleware stack with and without
+   metrics.middleware.MetricsMiddleware, in alternating rounds so drift in the
+   machine's speed hits both alike.
+   """
+   from django.conf import settings
+   from django.test import Client
+   from metrics.collector import collector
+   from metrics.models import ViewLatency, ViewStats
+
+   seed_catalog(products, log=stdout.write)
+   collection_ids = list(Collection.objects.values_list('id', flat=True)[:20])
+   paths = [f'/store/products/?collection_id={collection_id}' for collection_id in collection_ids] + ['/store/products/']
+   clients = {}
+   for name, middleware in [('without_metrics', [m for m in settings.MIDDLEWARE if not m.startswith('metrics.')]), ('with_metrics', settings.MIDDLEWARE)]:
+      #A client loads the middleware on its first request
+      with override_settings(MIDDLEWARE=middleware):
+         clients[name] = Client(SERVER_NAME='localhost')
+         assert clients[name].get(paths[0]).status_code == 200
+
+   timings = {name: [] for name in clients}
+   with override_settings(METRICS_ENABLED=True, METRICS_FLUSH_INTERVAL=10):
+      for number in range(rounds):
+         for name in (list(clients) if number % 2 else list(reversed(clients))):
+            for path in islice(cycle(paths), number, number + requests):
+               start = time.perf_counter()
+               clients[name].get(path)
+               timings[name].append((time.perf_counter() - start) * 1000)
+      collector.flush()
+
+   results = {
+      name: {'p50_ms': round(percentile(values, 50), 3), 'p99_ms': round(percentile(values, 99), 3), 'mean_ms': round(sum(values) / len(values), 3)}
+      for name, values in timings.items()
+   }
+   for stat in ['p50_ms', 'mean_ms']:
+      results[f'overhead_{stat[:-3]}_percent'] = round((results['with_metrics'][stat] / results['without_metrics'][stat] - 1) * 100, 2)
+   results['recorded_requests'] = ViewStats.objects.get(view='product-list').requests
+   ViewStats.objects.all().delete()
+   ViewLatency.objects.all().delete()
+   return results
+
+@scenario
+def sales_analytics(stdout, products=100_000, items=10_000_000, workers=4):
+   """Top sellers and sales series from the daily rollups vs ad-hoc aggregates over OrderItem."""
+   from datetime import timedelta
+   from django.db.models import F, Sum
+   from django.utils import timezone
+   from rest_framework.test import force_authenticate
+   from core.models import User
+   from . import analytics
+   from .views import SalesAnalyticsViewSet
+
+   seed_catalog(products, log=stdout.write)
+   seed_orders(items, log=stdout.write)
+   with connection.cursor() as cursor:
+      cursor.execute('PRAGMA journal_mode=WAL')
+   results = {'order_items': OrderItem.objects.count()}
+   rebuild = analytics.rebuild_sales_rollups(workers=workers)
+   results['rebuild'] = {'workers': workers, 'seconds': round(rebuild['seconds'], 1), 'rollup_rows': rebuild['rows']}
+   results['rebuild_single_process_seconds'] = round(analytics.rebuild_sales_rollups(workers=1)['seconds'], 1)
+
+   end = timezone.localdate()
+   collection_id = Product.objects.order_by('id').values_list('collection_id', flat=True).first()
+   revenue = Sum(F('quantity') * F('unit_price'))
+   admin, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com', 'is_staff': True})
+   view = SalesAnalyticsViewSet.as_view({'get': 'top_sellers'})
+
+   def endpoint(params):
+      request = request_factory().get('/store/analytics/top-sellers/', params)
+      force_authenticate(request, admin)
+      response = view(request)
+      response.render()
+      assert response.status_code == 200, response.status_code
+
+   for days in [7, 30, 365]:
+      start = end - timedelta(days=days - 1)
+      placed = OrderItem.objects.filter(order__placed_at__date__gte=start)
+      results[f'last_{days}_days'] = {
+         'top_products_adhoc': measure(lambda: list(placed.values('product_id').annotate(revenue=revenue).order_by('-revenue')[:10]), repeat=1, warmup=0),
+         'top_products_rollup': measure(lambda: analytics.top_sellers(start, end)),
+         'top_products_endpoint': measure(lambda: endpoint({'start': start, 'end': end})),
+         'top_collections_rollup': measure(lambda: analytics.top_sellers(start, end, by='collection')),
+         'collection_series_adhoc': measure(lambda: list(placed.filter(product__collection_id=collection_id).values(day=F('order__placed_at__date')).annotate(revenue=revenue).order_by('day')), repeat=1, warmup=0),
+         'collection_series_rollup': measure(lambda: analytics.sales_series(start, end, collection_id=collection_id)),
+      }
+
+   #Incremental refresh of one day's worth of new orders
+   seed_orders(OrderItem.objects.count() + items // 365, log=stdout.write)
+   refresh = analytics.refresh_sales_rollups()
+   results['refresh_one_day'] = {'items': refresh['items'], 'seconds': round(refresh['seconds'], 2), 'items_per_second': round(refresh['items'] / refresh['seconds'])}
+   return results
+
+@scenario
+def customer_history(stdout, products=100_000, items=300_000, page_size=50):
+   """A customer's order history page with and without prefetching, and the cached order summary."""
+   from rest_framework.test import force_authenticate
+   from core.models import User
+   from .serializers import OrderSerializer
+   from .views import CustomerOrderViewSet, CustomerViewSet
+
+   seed_catalog(products, log=stdout.write)
+   seed_orders(items, log=stdout.write)
+   customer = Customer.objects.get(email='benchmark@example.com')
+   admin, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com', 'is_staff': True})
+
+   def endpoint(view, path, params=None, **kwargs):
+      request = request_factory().get(path, params or {})
+      force_authenticate(request, admin)
+      response = view(request, **kwargs)
+      response.render()
+      assert response.status_code == 200, response.status_code
+
+   orders_view = CustomerOrderViewSet.as_view({'get': 'list'})
+   detail_view = CustomerViewSet.as_view({'get': 'retrieve'})
+   naive = Order.objects.filter(customer=customer).order_by('-placed_at', '-id').with_total_price()
+   with override_settings(STORE_CACHE_ENABLED=True):
+      return {
+         'orders': Order.objects.filter(customer=customer).count(),
+         'naive_page': measure(lambda: OrderSerializer(naive[:page_size], many=True).data, repeat=5),
+         'prefetched_page_endpoint': measure(lambda: endpoint(orders_view, f'/store/customers/{customer.id}/orders/', {'page_size': page_size}, customer_pk=customer.id)),
+         'summary_uncached': measure(customer.order_summary, repeat=5),
+         'profile_endpoint_cached': measure(lambda: endpoint(detail_view, f'/store/customers/{customer.id}/', pk=customer.id)),
+      }
+
+@scenario
+def promotions(stdout, products=1_000_000, promoted=100_000, promotion_count=10):
+   """Product list cost before and after `promoted` products get promotions, vs applying discounts at read time."""
+   from django.db.models import ExpressionWrapper, F, Value
+   from django.db.models.functions import Coalesce
+   from . import pricing
+   from .models import Promotion
+   from .views import ProductViewSet
+
+   seed_catalog(products, log=stdout.write)
+   Promotion.objects.all().delete()
+   Product.objects.update(effective_price=F('price'))
+   view = ProductViewSet.as_view({'get': 'list'})
+   requests = {
+      'list': {},
+      'ordered_by_effective_price': {'ordering': 'effective_price'},
+      'filtered_on_effective_price': {'effective_price__lt': 50, 'ordering': '-effective_price'},
+   }
+   def measure_list():
+      return {name: measure(lambda: call_view(view, '/store/products/', params)) for name, params in requests.items()}
+
+   results = {'before': measure_list()}
+   rng = random.Random(0)
+   promotions = Promotion.objects.bulk_create(Promotion(description=f'Promotion {i}', discount=rng.choice([0.05, 0.1, 0.2, 0.3])) for i in range(promotion_count))
+   product_ids = rng.sample(list(Product.objects.values_list('id', flat=True)), promoted)
+   Link = Product.promotions.through
+   Link.objects.bulk_create((Link(product_id=id, promotion_id=rng.choice(promotions).id) for id in product_ids), batch_size=10_000)
+   started = time.perf_counter()
+   changed = pricing.reprice(product_ids)
+   seconds = time.perf_counter() - started
+   results['initial_reprice'] = {'products': len(changed), 'seconds': round(seconds, 2), 'products_per_second': round(len(changed) / seconds)}
+   results['after'] = measure_list()
+
+   #What the list would cost if discounts were applied per read instead of stored
+   read_time_price = ExpressionWrapper(F('price') * (1 - Coalesce(pricing.best_discount(), Value(0.0))), output_field=Product._meta.get_field('price'))
+   results['read_time_discount'] = {
+      'list': measure(lambda: list(Product.objects.annotate(read_price=read_time_price).order_by('title', 'id')[:11]), repeat=5),
+      'ordered_by_effective_price': measure(lambda: list(Product.objects.annotate(read_price=read_time_price).order_by('read_price', 'id')[:11]), repeat=1, warmup=0),
+   }
+
+   promotion = promotions[0]
+   promotion.discount = 0.5
+   started = time.perf_counter()
+   promotion.save()
+   results['promotion_edit'] = {'linked_products': promotion.product_set.count(), 'seconds': round(time.perf_counter() - started, 2)}
+   return results
+
+@scenario
+def review_stats(stdout, products=1_000_000, reviews=1_000_000, hot_products=10_000):
+   """Product list sorted by review statistics: stored trigger-kept columns vs Count/Avg subqueries."""
+   from django.db.models import Avg, Count, OuterRef, Subquery
+   from .models import Review
+   from .views import ProductViewSet, ReviewViewSet
+
+   seed_catalog(products, log=stdout.write)
+   existing = Review.objects.count()
+   if existing < reviews:
+      first_product = Product.objects.order_by('id').values_list('id', flat=True).first()
+      started = time.perf_counter()
+      with connection.cursor() as cursor:
+         cursor.execute('''
+            WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s)
+            INSERT INTO store_review (product_id, name, description, date, rating)
+            SELECT %s + abs(random()) %% %s, 'Reviewer', 'Fine', date('now', '-' || (abs(random()) %% 365) || ' days'),
+                   CASE WHEN abs(random()) %% 4 = 0 THEN NULL ELSE 1 + abs(random()) %% 5 END
+            FROM n
+         ''', [reviews - existing, first_product, hot_products])
+      stdout.write(f'seeded {reviews - existing} reviews in {time.perf_counter() - started:.1f} s, triggers included')
+
+   view = ProductViewSet.as_view({'get': 'list'})
+   reviews_of = Review.objects.filter(product=OuterRef('pk')).order_by().values('product')
+   subquery_stats = Product.objects.annotate(
+      review_count=Subquery(reviews_of.annotate(count=Count('id')).values('count')),
+      rating=Subquery(reviews_of.annotate(average=Avg('rating')).values('average')),
+   )
+   product_id = Product.objects.order_by('id').values_list('id', flat=True).first()
+   create_review = ReviewViewSet.as_view({'post': 'create'})
+   def post_review():
+      response = create_review(request_factory().post(f'/store/products/{product_id}/reviews/', {'name': 'Bench', 'description': 'Fine', 'rating': 4, 'product': product_id}), product_pk=product_id)
+      assert response.status_code == 201, response.status_code
+
+   return {
+      'subquery_page_by_title': measure(lambda: list(subquery_stats.order_by('title', 'id')[:11]), repeat=5),
+      'subquery_top_rated': measure(lambda: list(subquery_stats.order_by('-rating', '-id')[:11]), repeat=1, warmup=0),
+      'list_by_title': measure(lambda: call_view(view, '/store/products/')),
+      'list_top_rated': measure(lambda: call_view(view, '/store/products/', {'ordering': '-average_rating'})),
+      'list_most_reviewed': measure(lambda: call_view(view, '/store/products/', {'ordering': '-reviews_count'})),
+      'list_filtered_on_rating': measure(lambda: call_view(view, '/store/products/', {'average_rating__gt': 3.5, 'ordering': 'average_rating'})),
+      'create_review_endpoint': measure(post_review),
+   }
+
+def seed_customers(customers, orders_per_customer=2, days=730, log=print):
+   """Grows Customer to `customers` rows, each with about orders_per_customer one-line orders over the last `days` days."""
+   existing = Customer.objects.count()
+   if existing >= customers:
+      return
+   first_product = Product.objects.order_by('id').values_list('id', flat=True).first()
+   with connection.cursor() as cursor:
+      last_customer = cursor.execute('SELECT coalesce(max(id), 0) FROM store_customer').fetchone()[0]
+      last_order = cursor.execute('SELECT coalesce(max(id), 0) FROM store_order').fetchone()[0]
+      cursor.execute('''
+         WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s)
+         INSERT INTO store_customer (id, first_name, last_name, email, phone, membership)
+         SELECT %s + i, 'Customer', i, 'customer' || (%s + i) || '@example.com', '0', 'B' FROM n
+      ''', [customers - existing, last_customer, last_customer])
+      cursor.execute('''
+         WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < %s)
+         INSERT INTO store_order (id, placed_at, payment_status, customer_id)
+         SELECT %s + i, datetime('now', '-' || (abs(random()) %% (%s * 86400)) || ' seconds'),
+                CASE WHEN abs(random()) %% 10 = 0 THEN 'F' ELSE 'C' END,
+                %s + 1 + abs(random()) %% %s
+         FROM n
+      ''', [(customers - existing) * orders_per_customer, last_order, days, last_customer, customers - existing])
+      cursor.execute('''
+         INSERT INTO store_orderitem (order_id, product_id, quantity, unit_price)
+         SELECT id, %s, 1 + abs(random()) %% 3, 1 + abs(random()) %% 500 FROM store_order WHERE id > %s
+      ''', [first_product, last_order])
+   log(f'seeded {customers} customers')
+
+@scenario
+def memberships(stdout, customers=1_000_000, batch_size=5000):
+   """Membership tier recomputation over `customers` customers with about two orders each."""
+   from django.db.models import Count
+   from . import jobs
+
+   seed_catalog(1000, log=stdout.write)
+   seed_customers(customers, log=stdout.write)
+   Customer.objects.update(membership=Customer.MEMBERSHIP_BRONZE)
+   results = {}
+   for run in ['first_run', 'unchanged_run']:
+      rss_before = max_rss_mb()
+      marks = [time.perf_counter()]
+      def progress(message):
+         marks.append(time.perf_counter())
+         if len(marks) % 50 == 0:
+            stdout.write(message)
+      totals = jobs.recompute_memberships(batch_size=batch_size, log=progress)
+      rates = [batch_size / (end - start) for start, end in zip(marks, marks[1:-1])]
+      results[run] = {
+         'customers': totals['customers'],
+         'changed': totals['changed'],
+         'seconds': round(totals['seconds'], 1),
+         'customers_per_second': round(totals['customers'] / totals['seconds']),
+         'slowest_batch_customers_per_second': round(min(rates)),
+         'fastest_batch_customers_per_second': round(max(rates)),
+         'max_rss_growth_mb': round(max_rss_mb() - rss_before, 1),
+      }
+   results['tiers'] = dict(Customer.objects.values_list('membership').annotate(count=Count('id')).order_by())
+   return results
+
+def store_route_names():
+   """The name of every route in store/urls.py, the tag list's included, format suffixes and the API root aside."""
+   from django.urls import URLPattern
+   from .urls import tag_urlpatterns, urlpatterns
+   return {
+      pattern.name for pattern in urlpatterns + tag_urlpatterns
+      if isinstance(pattern, URLPattern) and pattern.name != 'api-root'
+   }
+
+def git_commit():
+   from django.conf import settings
+   try:
+      return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True).stdout.strip()
+   except (OSError, subprocess.CalledProcessError):
+      return None
+
+def route_flows(client, rng):
+   """
+   Lists of (label, request) steps, a request being a function of the flow's
+   state that makes one request. The steps of a flow run in order, so writes
+   come in pairs (create then delete) and leave the dataset as it was.
+   """
+   from django.db.models import Count
+   from tags.models import Tag
+   from .catalog import export_rows
+   from .models import Review
+
+   product = Product.objects.filter(reviews_count__gt=0).order_by('-reviews_count').values('id', 'collection_id', 'price', 'inventory').first()
+   review_id = Review.objects.filter(product_id=product['id']).values_list('id', flat=True).first()
+   cart = CartItem.objects.order_by('cart_id').values('cart_id', 'id').first()
+   order_id = Order.objects.order_by('-id').values_list('id', flat=True).first()
+   customer_id = Order.objects.values_list('customer_id').annotate(count=Count('id')).order_by('-count').values_list('customer_id', flat=True).first()
+   tag = Tag.objects.filter(counts__total__gt=0).order_by('-counts__total').values_list('label', flat=True).first()
+   collection_url = f"http://localhost/store/collections/{product['collection_id']}/"
+   catalog = ''.join(export_rows(Product.objects.filter(id__in=Product.objects.filter(collection_id=product['collection_id']).values('id')[:100])))
+   product_ids = list(Product.objects.filter(inventory__gte=100).values_list('id', flat=True)[:1000])
+   json = 'application/json'
+
+   def get(path):
+      return lambda state: client.get(path)
+
+   def created(key):
+      #Keeps the id of what a step created for the steps after it
+      def keep(response):
+         return response.json()[key]
+      return keep
+
+   products = f"/store/products/{product['id']}"
+   carts = f"/store/carts/{cart['cart_id']}"
+   return [
+      [('GET /store/', get('/store/'))],
+      [('GET products/', get('/store/products/'))],
+      [('GET products/?collection_id', get(f"/store/products/?collection_id={product['collection_id']}"))],
+      [('GET products/?ordering=-average_rating', get('/store/products/?ordering=-average_rating'))],
+      [('GET products/?search', get('/store/products/?search=red+chair'))],
+      [('GET products/?tag', get(f'/store/products/?tag={tag}'))],
+      [('GET products/?include=tags,likes_count', get('/store/products/?include=tags,likes_count'))],
+      [('GET products/{id}/', get(f'{products}/'))],
+      [('GET products/export/', get('/store/products/export/'))],
+      [('POST products/import/', lambda state: client.post('/store/products/import/', catalog, content_type='application/x-ndjson'))],
+      [
+         ('POST products/', lambda state: client.post('/store/products/', {'title': 'Benchmark lamp', 'slug': 'benchmark-lamp', 'inventory': 10, 'unit_price': 20, 'collection': collection_url}, content_type=json)),
+         ('DELETE products/{id}/', lambda state: client.delete(f"/store/products/{state['POST products/']['id']}/")),
+      ],
+      [('PATCH products/{id}/', lambda state: client.patch(f'{products}/', {'unit_price': str(product['price'])}, content_type=json))],
+      [
+         ('POST products/{id}/like/', lambda state: client.post(f'{products}/like/')),
+         ('DELETE products/{id}/like/', lambda state: client.delete(f'{products}/like/')),
+      ],
+      [('GET products/{id}/reviews/', get(f'{products}/reviews/'))],
+      [('GET products/{id}/reviews/{id}/', get(f'{products}/reviews/{review_id}/'))],
+      [
+         ('POST products/{id}/reviews/', lambda state: client.post(f'{products}/reviews/', {'name': 'Bench', 'description': 'Fine', 'rating': 4, 'product': product['id']}, content_type=json)),
+         ('PATCH products/{id}/reviews/{id}/', lambda state: client.patch(f"{products}/reviews/{state['POST products/{id}/reviews/']['id']}/", {'rating': 5}, content_type=json)),
+         ('DELETE products/{id}/reviews/{id}/', lambda state: client.delete(f"{products}/reviews/{state['POST products/{id}/reviews/']['id']}/")),
+      ],
+      [('GET collections/', get('/store/collections/'))],
+      [('GET collections/{id}/', get(f"/store/collections/{product['collection_id']}/"))],
+      [
+         ('POST collections/', lambda state: client.post('/store/collections/', {'title': 'Benchmark'}, content_type=json)),
+         ('PATCH collections/{id}/', lambda state: client.patch(f"/store/collections/{state['POST collections/']['id']}/", {'title': 'Benchmarked'}, content_type=json)),
+         ('DELETE collections/{id}/', lambda state: client.delete(f"/store/collections/{state['POST collections/']['id']}/")),
+      ],
+      [('GET carts/{id}/', get(f'{carts}/'))],
+      [('GET carts/{id}/items/', get(f'{carts}/items/'))],
+      [('GET carts/{id}/items/{id}/', get(f"{carts}/items/{cart['id']}/"))],
+      [
+         ('POST carts/', lambda state: client.post('/store/carts/')),
+         ('POST carts/{id}/items/', lambda state: client.post(f"/store/carts/{state['POST carts/']['id']}/items/", {'product_id': rng.choice(product_ids), 'quantity': 1}, content_type=json)),
+         ('PATCH carts/{id}/items/{id}/', lambda state: client.patch(f"/store/carts/{state['POST carts/']['id']}/items/{state['POST carts/{id}/items/']['id']}/", {'quantity': 2}, content_type=json)),
+         ('DELETE carts/{id}/items/{id}/', lambda state: client.delete(f"/store/carts/{state['POST carts/']['id']}/items/{state['POST carts/{id}/items/']['id']}/")),
+         ('DELETE carts/{id}/', lambda state: client.delete(f"/store/carts/{state['POST carts/']['id']}/")),
+      ],
+      [
+         ('POST carts/ (checkout)', lambda state: client.post('/store/carts/')),
+         ('POST carts/{id}/items/ (checkout)', lambda state: client.post(f"/store/carts/{state['POST carts/ (checkout)']['id']}/items/", {'product_id': rng.choice(product_ids), 'quantity': 1}, content_type=json)),
+         ('POST orders/', lambda state: client.post('/store/orders/', {'cart_id': state['POST carts/ (checkout)']['id'], 'customer_id': customer_id}, content_type=json)),
+      ],
+      [('GET orders/{id}/', get(f'/store/orders/{order_id}/'))],
+      [('GET customers/{id}/', get(f'/store/customers/{customer_id}/'))],
+      [('GET customers/{id}/orders/', get(f'/store/customers/{customer_id}/orders/'))],
+      [('GET tags/', get('/tags/'))],
+      [('GET analytics/sales/', get(f"/store/analytics/sales/?collection_id={product['collection_id']}"))],
+      [('GET analytics/top-sellers/', get('/store/analytics/top-sellers/'))],
+      [('GET async/products/', get('/store/async/products/'))],
+      [('GET async/products/{id}/', get(f'/store/async/products/{product["id"]}/'))],
+      [('GET async/carts/{id}/', get(f'/store/async/carts/{cart["cart_id"]}/'))],
+   ]
+
+def admin_flows(client):
+   """The changelist of every model registered with the admin, and a search where it has search fields."""
+   from django.contrib import admin
+   from django.urls import reverse
+   flows = []
+   for model, model_admin in sorted(admin.site._registry.items(), key=lambda item: item[0]._meta.label):
+      path = reverse(f'admin:{model._meta.app_label}_{model._meta.model_name}_changelist')
+      flows.append([(f'GET {path}', lambda state, path=path: client.get(path))])
+      if model_admin.search_fields:
+         flows.append([(f'GET {path}?q', lambda state, path=path: client.get(path, {'q': 'a'}))])
+   return flows
+
+def run_flows(flows, repeat, budget):
+   """
+   Runs each flow up to `repeat` times, or for `budget` seconds once it has
+   run three times. The first run counts queries and is not timed.
+   """
+   def send(request, state):
+      response = request(state)
+      if response.streaming:
+         b''.join(response.streaming_content)
+      return response
+
+   results = {}
+   for flow in flows:
+      timings, queries, routes = {}, {}, {}
+      started = time.perf_counter()
+      for number in range(repeat + 1):
+         if number > 3 and time.perf_counter() - started > budget:
+            break
+         state = {}
+         for label, request in flow:
+            if number:
+               start = time.perf_counter()
+               response = send(request, state)
+               timings.setdefault(label, []).append((time.perf_counter() - start) * 1000)
+            else:
+               with CaptureQueriesContext(connection) as captured:
+                  response = send(request, state)
+               queries[label], routes[label] = len(captured), response.resolver_match.url_name
+            assert response.status_code < 400, f'{label}: {response.status_code}'
+            if response.get('Content-Type', '').startswith('application/json') and not response.streaming:
+               state[label] = response.json()
+      for label, values in timings.items():
+         mean = sum(values) / len(values)
+         results[label] = {
+            'route': routes[label],
+            'requests': len(values),
+            'requests_per_second': round(1000 / mean, 1),
+            'p50_ms': round(percentile(values, 50), 3),
+            'p99_ms': round(percentile(values, 99), 3),
+            'mean_ms': round(mean, 3),
+            'queries': queries[label],
+         }
+   return results
+
+@scenario
+def routes(stdout, dataset='small', repeat=50, budget=10, workers=4):
+   """
+   Every route of store/urls.py and tags/urls.py and the admin changelists,
+   one request at a time through the whole middleware stack as a staff user,
+   on a database holding one of seeding.DATASETS (seeded on first use). Each
+   step's requests per second, p50/p99 and query count are keyed by a fixed
+   label, so the JSON of two commits can be diffed.
+   """
+   from django.test import Client
+   from core.models import User
+   from .models import Review
+
+   #No flush threads writing behind the requests' backs: runs stay repeatable,
+   #and no request's transaction is cut short by SQLite's busy error
+   with dataset_database(dataset, workers, log=stdout.write), override_settings(METRICS_ENABLED=False, LIKES_FLUSH_INTERVAL=0):
+      user, _ = User.objects.get_or_create(username='benchmark', defaults={'email': 'benchmark@example.com', 'is_staff': True, 'is_superuser': True})
+      client = Client(SERVER_NAME='localhost')
+      client.force_login(user)
+      last_order = Order.objects.order_by('-id').values_list('id', flat=True).first()
+      inventory = dict(Product.objects.values_list('id', 'inventory'))
+      try:
+         store = run_flows(route_flows(client, random.Random(0)), repeat, budget)
+         admin = run_flows(admin_flows(client), repeat, budget)
+      finally:
+         #Checkout orders are the one write not undone by the flows
+         checkout = Order.objects.filter(id__gt=last_order)
+         restock = list(OrderItem.objects.filter(order__in=checkout).values_list('product_id', flat=True).distinct())
+         OrderItem.objects.filter(order__in=checkout).delete()
+         checkout.delete()
+         Product.objects.bulk_update([Product(id=id, inventory=inventory[id]) for id in restock], ['inventory'])
+         Review.objects.filter(name='Bench').delete()
+
+      missing = store_route_names() - {result['route'] for result in store.values()}
+      assert not missing, f"Routes not benchmarked: {', '.join(sorted(missing))}"
+      return {
+         'dataset': dataset,
+         'rows': {model._meta.label: model.objects.count() for model in [Collection, Product, Customer, Order, OrderItem, Cart, Review]},
+         'commit': git_commit(),
+         'store': store,
+         'admin': admin,
+      }
+
+def run(name, stdout, **options):
+   with override_settings(DEBUG=False, ALLOWED_HOSTS=['localhost'], STORE_CACHE_ENABLED=False):
+      return SCENARIOS[name](stdout, **options)
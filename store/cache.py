@@ -0,0 +1,135 @@
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.response import Response
+
+from core.routers import reads_from_replica
+
+CATALOG_VERSION_KEY = 'store:v:catalog'
+HITS_KEY = 'store:cache:hits'
+MISSES_KEY = 'store:cache:misses'
+
+def get_cache():
+   return caches[getattr(settings, 'STORE_CACHE_ALIAS', 'default')]
+
+def is_enabled():
+   return getattr(settings, 'STORE_CACHE_ENABLED', True)
+
+def product_version_key(product_id):
+   return f'store:v:product:{product_id}'
+
+def collection_version_key(collection_id):
+   return f'store:v:collection:{collection_id}'
+
+#Versions are never incremented in place: invalidating a key deletes it and the
+#next read starts a fresh counter from the clock, so an evicted version can never
+#bring an old response back to life.
+def get_versions(keys):
+   cache = get_cache()
+   versions = cache.get_many(keys)
+   for key in keys:
+      if key not in versions:
+         cache.add(key, time.time_ns(), None)
+         versions[key] = cache.get(key)
+   return [versions[key] for key in keys]
+
+def invalidate(keys):
+   get_cache().delete_many(list(keys))
+
+def invalidate_products(product_ids=(), collection_ids=()):
+   keys = [product_version_key(pk) for pk in product_ids]
+   keys += [collection_version_key(pk) for pk in set(collection_ids) if pk is not None]
+   keys.append(CATALOG_VERSION_KEY)
+   invalidate(keys)
+
+def invalidate_collections(collection_ids):
+   invalidate_products(collection_ids=collection_ids)
+
+def customer_version_key(customer_id):
+   return f'store:v:customer:{customer_id}'
+
+def get_customer_summary(customer_id, compute):
+   """
+   The customer's cached summary, computed with compute() on a miss. It is
+   keyed by the customer's version, so a read racing an invalidation stores
+   the old totals under a version nobody reads again.
+   """
+   if not is_enabled():
+      return compute()
+   [version] = get_versions([customer_version_key(customer_id)])
+   return get_cache().get_or_set(f'store:customer:{customer_id}:summary:{version}', compute, getattr(settings, 'STORE_CACHE_TIMEOUT', 300))
+
+def invalidate_customers(customer_ids):
+   invalidate(customer_version_key(pk) for pk in set(customer_ids) if pk is not None)
+
+def _count(key):
+   cache = get_cache()
+   try:
+      cache.incr(key)
+   except ValueError:
+      cache.add(key, 0, None)
+      cache.incr(key)
+
+def stats():
+   counters = get_cache().get_many([HITS_KEY, MISSES_KEY])
+   hits = counters.get(HITS_KEY, 0)
+   misses = counters.get(MISSES_KEY, 0)
+   total = hits + misses
+   return {
+      'hits': hits,
+      'misses': misses,
+      'hit_ratio': hits / total if total else 0.0,
+   }
+
+def reset_stats():
+   get_cache().delete_many([HITS_KEY, MISSES_KEY])
+
+def response_key(namespace, request, versions):
+   params = sorted((key, value) for key in request.query_params for value in request.query_params.getlist(key))
+   digest = hashlib.md5(repr((request.get_host(), params)).encode()).hexdigest()
+   return ':'.join(['store:response', namespace, *map(str, versions), digest])
+
+class CachedResponseMixin:
+   """
+   Serves list and retrieve responses from the cache. The key is made of the
+   query string (filters, search, ordering, page) plus the current value of
+   the version keys returned by the viewset, so invalidating a version makes
+   every response built on it unreachable.
+   """
+   cache_namespace = None
+
+   def get_list_version_keys(self):
+      raise NotImplementedError
+
+   def get_detail_version_keys(self):
+      raise NotImplementedError
+
+   def list(self, request, *args, **kwargs):
+      return self.cached_response(f'{self.cache_namespace}:list', self.get_list_version_keys(), super().list, request, *args, **kwargs)
+
+   def retrieve(self, request, *args, **kwargs):
+      return self.cached_response(f'{self.cache_namespace}:detail', self.get_detail_version_keys(), super().retrieve, request, *args, **kwargs)
+
+   def cached_response(self, namespace, version_keys, view, request, *args, **kwargs):
+      if not is_enabled():
+         return view(request, *args, **kwargs)
+
+      cache = get_cache()
+      versions = get_versions(version_keys)
+      key = response_key(namespace, request, versions)
+      data = cache.get(key)
+      if data is not None:
+         _count(HITS_KEY)
+         response = Response(data)
+         response['X-Cache'] = 'HIT'
+         return response
+
+      _count(MISSES_KEY)
+      response = view(request, *args, **kwargs)
+      #A version this young was reset by a change the replica may not have yet
+      lagging = reads_from_replica() and time.time_ns() - max(versions) < settings.DATABASE_REPLICA_LAG * 10**9
+      if response.status_code == 200 and not lagging:
+         cache.set(key, response.data, getattr(settings, 'STORE_CACHE_TIMEOUT', 300))
+      response['X-Cache'] = 'MISS'
+      return response
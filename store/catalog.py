@@ -0,0 +1,206 @@
+import csv
+import io
+import json
+import time
+from itertools import islice
+from django.db import transaction
+from django.utils import timezone
+from django.utils.text import slugify
+from rest_framework import serializers
+
+from . import cache, pricing
+from .models import Collection, Product, Promotion
+
+FORMATS = ['csv', 'ndjson']
+FIELDS = ['id', 'title', 'slug', 'description', 'price', 'inventory', 'collection', 'promotions']
+PRODUCT_FIELDS = ['title', 'slug', 'description', 'price', 'inventory', 'collection_id', 'last_update']
+
+class ProductImportSerializer(serializers.Serializer):
+   id = serializers.IntegerField(required=False, min_value=1)
+   title = serializers.CharField(max_length=255)
+   slug = serializers.SlugField(required=False, allow_blank=True)
+   description = serializers.CharField(required=False, allow_null=True, allow_blank=True)
+   price = serializers.DecimalField(max_digits=6, decimal_places=2, min_value=1)
+   inventory = serializers.IntegerField(min_value=0)
+   collection = serializers.CharField(max_length=255)
+   promotions = serializers.ListField(child=serializers.IntegerField(), required=False)
+
+def format_for(filename, default='ndjson'):
+   extension = filename.rsplit('.', 1)[-1].lower() if '.' in filename else ''
+   return extension if extension in FORMATS else default
+
+def read_rows(lines, format):
+   """Parses an iterable of byte or text lines into row dicts, lazily."""
+   lines = (line.decode('utf-8-sig') if isinstance(line, bytes) else line for line in lines)
+   if format == 'csv':
+      for row in csv.DictReader(lines):
+         row = {key: value for key, value in row.items() if key and value not in ('', None)}
+         if 'promotions' in row:
+            row['promotions'] = [value for value in row['promotions'].split(';') if value]
+         yield row
+   else:
+      for line in lines:
+         if line.strip():
+            yield json.loads(line)
+
+def chunked(iterable, size):
+   iterator = iter(iterable)
+   while chunk := list(islice(iterator, size)):
+      yield chunk
+
+class CatalogImporter:
+   """
+   Imports product rows (with their collection title and promotion ids) chunk
+   by chunk: each chunk is validated in one go, resolves its collections and
+   promotions with one query each, and is written with bulk_create/bulk_update
+   in its own transaction. Rows with an id that exists are updated, the rest
+   are created. Invalid rows are reported and skipped. Only the current chunk
+   is held in memory.
+   """
+   def __init__(self, chunk_size=5000, progress=None, max_errors=100):
+      self.chunk_size = chunk_size
+      self.progress = progress
+      self.max_errors = max_errors
+      self.collections = {}
+      self.totals = {'rows': 0, 'created': 0, 'updated': 0, 'invalid': 0, 'chunks': 0, 'seconds': 0.0}
+      self.errors = []
+
+   def run(self, rows):
+      started = time.perf_counter()
+      for number, chunk in enumerate(chunked(rows, self.chunk_size), start=1):
+         chunk_started = time.perf_counter()
+         report = self.import_chunk(chunk, first_row=self.totals['rows'] + 1)
+         report['chunk'] = number
+         report['seconds'] = time.perf_counter() - chunk_started
+         report['rows_per_second'] = len(chunk) / report['seconds'] if report['seconds'] else 0
+         for key in ['created', 'updated', 'invalid']:
+            self.totals[key] += report[key]
+         self.totals['rows'] += len(chunk)
+         self.totals['chunks'] = number
+         if self.progress:
+            self.progress(report)
+      self.totals['seconds'] = time.perf_counter() - started
+      return self.totals
+
+   def import_chunk(self, chunk, first_row):
+      #One serializer validates the whole chunk; unlike many=True it keeps the
+      #valid rows when some of them fail
+      serializer = ProductImportSerializer()
+      valid = []
+      for row_number, row in enumerate(chunk, start=first_row):
+         try:
+            valid.append((row_number, serializer.run_validation(row)))
+         except serializers.ValidationError as exc:
+            self.add_error(row_number, exc.detail)
+      valid = self.check_promotions(self.check_repeated_ids(valid))
+
+      with transaction.atomic():
+         collection_ids = self.resolve_collections({row['collection'] for _, row in valid})
+         now = timezone.now()
+         products = []
+         for _, row in valid:
+            product = Product(
+               title=row['title'],
+               slug=row.get('slug') or slugify(row['title']),
+               description=row.get('description'),
+               price=row['price'],
+               inventory=row['inventory'],
+               collection_id=collection_ids[row['collection']],
+               last_update=now,
+            )
+            product.id = row.get('id')
+            products.append(product)
+
+         #Moved products leave their old collection's cached lists stale too
+         existing = dict(Product.objects.filter(id__in=[product.id for product in products if product.id]).values_list('id', 'collection_id'))
+         to_update = [product for product in products if product.id in existing]
+         to_create = [product for product in products if product.id not in existing]
+         Product.objects.bulk_create(to_create, batch_size=1000)
+         Product.objects.bulk_update(to_update, PRODUCT_FIELDS, batch_size=1000)
+         self.link_promotions([(product, row) for product, (_, row) in zip(products, valid)])
+         #bulk writes skip Product.save, so discounts are applied here
+         pricing.reprice(product.id for product in products)
+
+      cache.invalidate_products([product.id for product in to_update], [*collection_ids.values(), *existing.values()])
+      return {'rows': len(chunk), 'created': len(to_create), 'updated': len(to_update), 'invalid': len(chunk) - len(valid)}
+
+   def add_error(self, row_number, errors):
+      if len(self.errors) < self.max_errors:
+         self.errors.append({'row': row_number, 'errors': errors})
+
+   def check_repeated_ids(self, valid):
+      #A chunk is written in one bulk_create, so the first row with an id wins
+      seen = {}
+      checked = []
+      for row_number, row in valid:
+         id = row.get('id')
+         if id in seen:
+            self.add_error(row_number, {'id': [f'Repeats the id of row {seen[id]}.']})
+            continue
+         if id is not None:
+            seen[id] = row_number
+         checked.append((row_number, row))
+      return checked
+
+   def check_promotions(self, valid):
+      wanted = {promotion for _, row in valid for promotion in row.get('promotions', [])}
+      known = set(Promotion.objects.filter(id__in=wanted).values_list('id', flat=True)) if wanted else set()
+      checked = []
+      for row_number, row in valid:
+         unknown = set(row.get('promotions', [])) - known
+         if unknown:
+            self.add_error(row_number, {'promotions': [f'No promotion with the given ID was found: {id}.' for id in sorted(unknown)]})
+         else:
+            checked.append((row_number, row))
+      return checked
+
+   def resolve_collections(self, titles):
+      missing = [title for title in titles if title not in self.collections]
+      if missing:
+         for id, title in Collection.objects.filter(title__in=missing).order_by('-id').values_list('id', 'title'):
+            self.collections[title] = id
+         new = [Collection(title=title) for title in missing if title not in self.collections]
+         for collection in Collection.objects.bulk_create(new):
+            self.collections[collection.title] = collection.id
+      return {title: self.collections[title] for title in titles}
+
+   def link_promotions(self, pairs):
+      #Rows that carry a promotions column replace the product's links
+      pairs = [(product, row['promotions']) for product, row in pairs if 'promotions' in row]
+      if not pairs:
+         return
+      Link = Product.promotions.through
+      Link.objects.filter(product_id__in=[product.id for product, _ in pairs]).delete()
+      Link.objects.bulk_create(
+         [Link(product_id=product.id, promotion_id=promotion_id) for product, promotions in pairs for promotion_id in set(promotions)],
+         batch_size=1000,
+      )
+
+def export_rows(queryset=None, format='ndjson', chunk_size=5000):
+   """Yields the catalog as CSV or NDJSON text, one keyset-paged chunk at a time."""
+   queryset = (queryset if queryset is not None else Product.objects.all()).order_by('id')
+   columns = ['id', 'title', 'slug', 'description', 'price', 'inventory', 'collection__title']
+   if format == 'csv':
+      yield ','.join(FIELDS) + '\r\n'
+   last_id = 0
+   while True:
+      rows = list(queryset.filter(id__gt=last_id).values_list(*columns)[:chunk_size])
+      if not rows:
+         return
+      last_id = rows[-1][0]
+      promotions = {}
+      for product_id, promotion_id in Product.promotions.through.objects.filter(product_id__in=[row[0] for row in rows]).values_list('product_id', 'promotion_id'):
+         promotions.setdefault(product_id, []).append(promotion_id)
+
+      buffer = io.StringIO()
+      writer = csv.writer(buffer) if format == 'csv' else None
+      for id, title, slug, description, price, inventory, collection in rows:
+         linked = sorted(promotions.get(id, []))
+         if writer:
+            writer.writerow([id, title, slug, description or '', price, inventory, collection, ';'.join(map(str, linked))])
+         else:
+            buffer.write(json.dumps({
+               'id': id, 'title': title, 'slug': slug, 'description': description, 'price': str(price),
+               'inventory': inventory, 'collection': collection, 'promotions': linked,
+            }) + '\n')
+      yield buffer.getvalue()
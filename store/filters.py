@@ -1,11 +1,75 @@
-from django_filters.rest_framework import FilterSet
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+from django.db.models import Exists, F, Func, OuterRef
+from django_filters.rest_framework import CharFilter, FilterSet, NumberFilter
+from tags.models import TagCount, TaggedItem
 from .models import Product
 
+class Unindexed(Func):
+   #Unary plus leaves the value alone but keeps the column's index out of the plan
+   template = '+%(expressions)s'
+
+class SortedRangeFilter(NumberFilter):
+   """
+   An index can serve a range or an ordering, not both. When the list is
+   sorted by another column, the range is checked row by row while walking
+   that column's index, so a page ends after page_size matches instead of
+   sorting every match first.
+   """
+   def filter(self, qs, value):
+      if value is None or self.lookup_expr not in ['gt', 'gte', 'lt', 'lte'] or self.field_name == self.parent.sorted_by():
+         return super().filter(qs, value)
+      field = Product._meta.get_field(self.field_name)
+      column = Unindexed(F(self.field_name), output_field=field)
+      return qs.filter(field.get_lookup(self.lookup_expr)(column, value))
+
 class ProductFilter(FilterSet):
+   #A plain number rather than a model choice, which would load the collection
+   #to validate it: an unknown collection is an empty list
+   collection_id = NumberFilter()
+   tag = CharFilter(method='filter_tags', label='Tag labels; comma separated matches any, repeated parameters must all match')
+   max_sorted_tag_matches = 10000
+
    class Meta:
       model = Product
       fields = {
-         'collection_id': ['exact'],
          'price': ['gt', 'lt'],
+         'effective_price': ['gt', 'lt'],
          'inventory': ['gt', 'lt'],
-      }
\ No newline at end of file
+         'reviews_count': ['gt', 'lt'],
+         'average_rating': ['gt', 'lt'],
+      }
+      filter_overrides = {
+         field: {'filter_class': SortedRangeFilter}
+         for field in [models.DecimalField, models.IntegerField, models.PositiveIntegerField, models.FloatField]
+      }
+
+   def sorted_by(self):
+      #The first ?ordering= term, as OrderingFilter will apply it, or the model's default
+      terms = [term.strip().lstrip('-') for term in self.data.get('ordering', '').split(',') if term.strip()]
+      return terms[0] if terms else Product._meta.ordering[0]
+
+   def filter_tags(self, queryset, name, value):
+      #?tag=red,blue&tag=sale is (red or blue) and sale. If the rarest parameter
+      #has few products, they are read off the (content_type, tag, object_id)
+      #index, probed there for the other parameters and sorted. Past
+      #max_sorted_tag_matches, like SortedRangeFilter, each product met while
+      #walking the sort's index is probed for every parameter instead.
+      groups = self.data.getlist(name) if hasattr(self.data, 'getlist') else [value]
+      groups = [labels for labels in ([label.strip() for label in group.split(',') if label.strip()] for group in groups) if labels]
+      if not groups:
+         return queryset
+      content_type = ContentType.objects.get_for_model(Product)
+      #The labels' tag ids and product counts, one query per parameter
+      counts = TagCount.objects.filter(content_type=content_type)
+      groups = sorted((dict(counts.filter(tag__label__in=labels).values_list('tag_id', 'total')) for labels in groups), key=lambda group: sum(group.values()))
+      matches = sum(groups[0].values())
+      if not matches:
+         return queryset.none()
+      for position, tag_ids in enumerate(groups):
+         tagged = TaggedItem.objects.filter(content_type=content_type, tag_id__in=tag_ids)
+         if position == 0 and matches <= self.max_sorted_tag_matches:
+            queryset = queryset.filter(id__in=tagged.values('object_id'))
+         else:
+            queryset = queryset.filter(Exists(tagged.filter(object_id=OuterRef('id'))))
+      return queryset
@@ -0,0 +1,105 @@
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import MONEY_TOTAL, Cart, CartItem, Customer, Order, Watermark
+
+MEMBERSHIP_WATERMARK = 'memberships'
+
+def stale_carts(ttl_days=None):
+   ttl_days = settings.STORE_CART_TTL_DAYS if ttl_days is None else ttl_days
+   return Cart.objects.filter(created_at__lt=timezone.now() - timedelta(days=ttl_days))
+
+def reap_stale_carts(ttl_days=None, batch_size=500, pause=0, log=None):
+   """
+   Deletes carts older than the TTL (and their items) in batches of
+   batch_size carts, each in its own short transaction so SQLite's write lock
+   is released between batches. Run by the reap_carts command, which cron,
+   a task queue beat or the run_jobs command (see STORE_JOBS) schedules.
+   Returns the totals.
+   """
+   carts = stale_carts(ttl_days)
+   totals = {'carts': 0, 'items': 0, 'seconds': 0.0}
+   started = time.perf_counter()
+   while True:
+      batch_started = time.perf_counter()
+      ids = list(carts.order_by('created_at').values_list('id', flat=True)[:batch_size])
+      if not ids:
+         break
+      with transaction.atomic():
+         _, deleted = Cart.objects.filter(id__in=ids).delete()
+      elapsed = time.perf_counter() - batch_started
+      totals['carts'] += deleted.get(Cart._meta.label, 0)
+      totals['items'] += deleted.get(CartItem._meta.label, 0)
+      if log:
+         rows = deleted.get(Cart._meta.label, 0) + deleted.get(CartItem._meta.label, 0)
+         log(f'deleted {rows} rows in {elapsed * 1000:.1f} ms ({rows / elapsed:,.0f} rows/s)')
+      if len(ids) < batch_size:
+         break
+      if pause:
+         time.sleep(pause)
+   totals['seconds'] = time.perf_counter() - started
+   return totals
+
+def membership_for(spend):
+   if spend >= settings.STORE_MEMBERSHIP_GOLD_SPEND:
+      return Customer.MEMBERSHIP_GOLD
+   if spend >= settings.STORE_MEMBERSHIP_SILVER_SPEND:
+      return Customer.MEMBERSHIP_SILVER
+   return Customer.MEMBERSHIP_BRONZE
+
+def recompute_memberships(batch_size=5000, restart=False, log=None):
+   """
+   Sets each customer's membership from their completed-order spend over the
+   last 12 months, batch_size customers at a time in id order. A batch costs
+   one query for the customers, one aggregate for their spend and one UPDATE
+   per tier that customers moved into, touching only them. The last id done is
+   kept in a Watermark in the same transaction, so an interrupted run resumes
+   where it stopped (unless restart); a finished run resets it. Returns the
+   totals.
+   """
+   since = timezone.now() - timedelta(days=365)
+   line_total = F('items__quantity') * F('items__unit_price')
+   totals = {'customers': 0, 'changed': 0, 'batches': 0, 'seconds': 0.0}
+   started = time.perf_counter()
+   watermark, _ = Watermark.objects.get_or_create(name=MEMBERSHIP_WATERMARK)
+   position = 0 if restart else watermark.position
+   while True:
+      batch_started = time.perf_counter()
+      customers = list(Customer.objects.filter(id__gt=position).order_by('id').values_list('id', 'membership')[:batch_size])
+      if not customers:
+         break
+      first, last = customers[0][0], customers[-1][0]
+      spend = dict(
+         Order.objects.filter(customer_id__gte=first, customer_id__lte=last, payment_status=Order.COMPLETE, placed_at__gte=since)
+         .values_list('customer_id')
+         .annotate(spend=Sum(line_total, output_field=MONEY_TOTAL))
+         .order_by()
+      )
+      moves = {}
+      for id, membership in customers:
+         tier = membership_for(spend.get(id) or 0)
+         if tier != membership:
+            moves.setdefault(tier, []).append(id)
+      changed = [id for ids in moves.values() for id in ids]
+      with transaction.atomic():
+         #One UPDATE per tier: a bulk_update CASE over every moved row costs
+         #more to build than to run
+         for tier, ids in moves.items():
+            Customer.objects.filter(id__in=ids).update(membership=tier)
+         Watermark.objects.filter(name=MEMBERSHIP_WATERMARK).update(position=last, updated_at=timezone.now())
+      position = last
+      elapsed = time.perf_counter() - batch_started
+      totals['customers'] += len(customers)
+      totals['changed'] += len(changed)
+      totals['batches'] += 1
+      if log:
+         log(f'checked {len(customers)} customers, {len(changed)} changed tier, in {elapsed * 1000:.1f} ms ({len(customers) / elapsed:,.0f} customers/s)')
+      if len(customers) < batch_size:
+         break
+   Watermark.objects.filter(name=MEMBERSHIP_WATERMARK).update(position=0, updated_at=timezone.now())
+   totals['seconds'] = time.perf_counter() - started
+   return totals
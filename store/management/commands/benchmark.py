@@ -0,0 +1,42 @@
+import json
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from store import benchmarks
+
+class Command(BaseCommand):
+   help = 'Runs store benchmarks against a separate, seeded SQLite database.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('scenarios', nargs='*', help=f"Scenarios to run: {', '.join(benchmarks.SCENARIOS)}. Defaults to all.")
+      parser.add_argument('--database-file', default=str(settings.BASE_DIR / 'benchmark.sqlite3'), help='SQLite file holding the benchmark data. Seeded data is reused between runs.')
+      parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE', help='Override a scenario parameter, e.g. --set products=100000 or --set dataset=medium.')
+      parser.add_argument('--output', help='Write the results as JSON to this file.')
+
+   def handle(self, *args, **options):
+      names = options['scenarios'] or list(benchmarks.SCENARIOS)
+      unknown = set(names) - set(benchmarks.SCENARIOS)
+      if unknown:
+         raise CommandError(f"Unknown scenario(s): {', '.join(sorted(unknown))}")
+      try:
+         overrides = dict(item.split('=', 1) for item in options['set'])
+      except ValueError:
+         raise CommandError('--set expects NAME=VALUE')
+      #Integers unless they don't parse as one
+      overrides = {name: int(value) if value.lstrip('-').isdigit() else value for name, value in overrides.items()}
+
+      connection.close()
+      connection.settings_dict['NAME'] = options['database_file']
+      call_command('migrate', verbosity=0)
+
+      results = {}
+      for name in names:
+         self.stdout.write(f'Running {name}...')
+         results[name] = benchmarks.run(name, self.stdout, **overrides)
+         self.stdout.write(json.dumps(results[name], indent=2))
+
+      if options['output']:
+         with open(options['output'], 'w') as file:
+            json.dump(results, file, indent=2)
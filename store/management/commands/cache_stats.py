@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store import cache
+
+class Command(BaseCommand):
+   help = 'Shows hit and miss counters of the product response cache.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('--reset', action='store_true', help='Reset the counters after printing them.')
+
+   def handle(self, *args, **options):
+      stats = cache.stats()
+      self.stdout.write(f"hits: {stats['hits']}")
+      self.stdout.write(f"misses: {stats['misses']}")
+      self.stdout.write(f"hit ratio: {stats['hit_ratio']:.2%}")
+      if options['reset']:
+         cache.reset_stats()
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from store import catalog
+
+class Command(BaseCommand):
+   help = 'Streams the product catalog to a CSV or NDJSON file.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('path', nargs='?', default='-', help="Destination file, or '-' for standard output.")
+      parser.add_argument('--format', choices=catalog.FORMATS, help='Defaults to the file extension, or ndjson.')
+      parser.add_argument('--chunk-size', type=int, default=5000)
+
+   def handle(self, *args, **options):
+      file_format = options['format'] or catalog.format_for(options['path'])
+      chunks = catalog.export_rows(format=file_format, chunk_size=options['chunk_size'])
+      if options['path'] == '-':
+         for text in chunks:
+            self.stdout.write(text, ending='')
+         return
+      with open(options['path'], 'w', newline='') as file:
+         file.writelines(chunks)
@@ -0,0 +1,39 @@
+import sys
+from contextlib import nullcontext
+from django.core.management.base import BaseCommand, CommandError
+
+from store import catalog
+
+class Command(BaseCommand):
+   help = 'Imports products, their collections and promotion links from a CSV or NDJSON file, in chunks.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('path', help="File to import, or '-' for standard input.")
+      parser.add_argument('--format', choices=catalog.FORMATS, help='Defaults to the file extension, or ndjson.')
+      parser.add_argument('--chunk-size', type=int, default=5000)
+
+   def handle(self, *args, **options):
+      file_format = options['format'] or catalog.format_for(options['path'])
+      importer = catalog.CatalogImporter(chunk_size=options['chunk_size'], progress=self.report)
+      try:
+         file = nullcontext(sys.stdin.buffer) if options['path'] == '-' else open(options['path'], 'rb')
+      except OSError as exc:
+         raise CommandError(exc)
+      with file as lines:
+         try:
+            totals = importer.run(catalog.read_rows(lines, file_format))
+         except (ValueError, UnicodeDecodeError) as exc:
+            raise CommandError(f'The file could not be parsed: {exc}')
+
+      for error in importer.errors:
+         self.stderr.write(f"row {error['row']}: {error['errors']}")
+      self.stdout.write(self.style.SUCCESS(
+         f"Imported {totals['rows']} rows in {totals['seconds']:.1f} s: {totals['created']} created, "
+         f"{totals['updated']} updated, {totals['invalid']} invalid."
+      ))
+
+   def report(self, chunk):
+      self.stdout.write(
+         f"chunk {chunk['chunk']}: {chunk['rows']} rows, {chunk['created']} created, {chunk['updated']} updated, "
+         f"{chunk['invalid']} invalid ({chunk['rows_per_second']:,.0f} rows/s)"
+      )
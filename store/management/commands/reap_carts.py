@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from store.jobs import reap_stale_carts, stale_carts
+from store.models import CartItem
+
+class Command(BaseCommand):
+   help = 'Deletes anonymous carts (and their items) older than STORE_CART_TTL_DAYS, in batches.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('--ttl-days', type=int, default=settings.STORE_CART_TTL_DAYS, help='Delete carts created more than this many days ago.')
+      parser.add_argument('--batch-size', type=int, default=500, help='Carts deleted per transaction.')
+      parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between batches.')
+      parser.add_argument('--dry-run', action='store_true', help='Only print what would be removed.')
+
+   def handle(self, *args, **options):
+      carts = stale_carts(options['ttl_days'])
+      if options['dry_run']:
+         summary = carts.order_by('created_at').values_list('created_at', flat=True)
+         count = carts.count()
+         self.stdout.write(f'Would delete {count} carts and {CartItem.objects.filter(cart__in=carts).count()} cart items.')
+         if count:
+            self.stdout.write(f'Oldest cart created at {summary.first()}, newest at {summary.last()}.')
+         return
+
+      log = self.stdout.write if options['verbosity'] > 1 else None
+      totals = reap_stale_carts(options['ttl_days'], options['batch_size'], options['pause'], log=log)
+      rows = totals['carts'] + totals['items']
+      rate = rows / totals['seconds'] if totals['seconds'] else 0
+      self.stdout.write(self.style.SUCCESS(
+         f"Deleted {totals['carts']} carts and {totals['items']} cart items in {totals['seconds']:.2f} s ({rate:,.0f} rows/s)."
+      ))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from store.jobs import recompute_memberships
+
+class Command(BaseCommand):
+   help = 'Recomputes customer membership tiers from completed-order spend over the last 12 months, in batches.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('--batch-size', type=int, default=5000, help='Customers checked per transaction.')
+      parser.add_argument('--restart', action='store_true', help='Start from the first customer instead of resuming an interrupted run.')
+
+   def handle(self, *args, **options):
+      #Long runs report every batch unless -v0
+      log = self.stdout.write if options['verbosity'] > 0 else None
+      totals = recompute_memberships(options['batch_size'], options['restart'], log=log)
+      rate = totals['customers'] / totals['seconds'] if totals['seconds'] else 0
+      self.stdout.write(self.style.SUCCESS(
+         f"Checked {totals['customers']} customers in {totals['batches']} batches, {totals['changed']} changed tier, {totals['seconds']:.2f} s ({rate:,.0f} customers/s)."
+      ))
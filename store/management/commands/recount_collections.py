@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from store.models import Collection, Product
+
+class Command(BaseCommand):
+   help = 'Recomputes Collection.products_count from the product table and repairs any drift.'
+
+   def handle(self, *args, **options):
+      with transaction.atomic():
+         counts = dict(Product.objects.order_by().values_list('collection_id').annotate(count=Count('id')))
+         drifted = []
+         for collection in Collection.objects.only('id', 'products_count'):
+            actual = counts.get(collection.id, 0)
+            if collection.products_count != actual:
+               self.stdout.write(f'Collection {collection.id}: {collection.products_count} -> {actual}')
+               collection.products_count = actual
+               drifted.append(collection)
+         Collection.objects.bulk_update(drifted, ['products_count'], batch_size=500)
+      self.stdout.write(self.style.SUCCESS(f'Repaired {len(drifted)} collections.'))
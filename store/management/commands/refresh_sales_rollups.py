@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from store.analytics import refresh_sales_rollups
+
+class Command(BaseCommand):
+   help = 'Folds order items placed since the last run into the daily sales rollups.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('--batch-size', type=int, default=100_000, help='Order items folded in per transaction.')
+
+   def handle(self, *args, **options):
+      log = self.stdout.write if options['verbosity'] > 1 else None
+      totals = refresh_sales_rollups(options['batch_size'], log=log)
+      rate = totals['items'] / totals['seconds'] if totals['seconds'] else 0
+      self.stdout.write(self.style.SUCCESS(
+         f"Folded {totals['items']} order items in {totals['batches']} batches, {totals['seconds']:.2f} s ({rate:,.0f} items/s)."
+      ))
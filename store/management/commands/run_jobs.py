@@ -0,0 +1,28 @@
+import time
+import traceback
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+
+class Command(BaseCommand):
+   help = 'Runs the commands in STORE_JOBS, each every so many seconds, for deployments without cron or a task queue beat.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('--once', action='store_true', help='Run every job once and exit.')
+
+   def handle(self, *args, **options):
+      jobs = settings.STORE_JOBS
+      due = dict.fromkeys(jobs, time.monotonic())
+      while True:
+         for name, interval in jobs.items():
+            if due[name] > time.monotonic():
+               continue
+            #A failing job is reported and retried on its next turn, the others keep running
+            try:
+               call_command(name, verbosity=options['verbosity'], stdout=self.stdout, stderr=self.stderr)
+            except Exception:
+               self.stderr.write(f'{name} failed:\n{traceback.format_exc()}')
+            due[name] = time.monotonic() + interval
+         if options['once']:
+            return
+         time.sleep(max(min(due.values()) - time.monotonic(), 0))
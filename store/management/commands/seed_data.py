@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from store import seeding
+
+class Command(BaseCommand):
+   help = 'Adds a synthetic catalog, customers, orders, carts, reviews, tags and likes, generated and bulk inserted by parallel worker processes.'
+
+   def add_arguments(self, parser):
+      parser.add_argument('--dataset', choices=list(seeding.DATASETS), default='small', help='Row counts to start from.')
+      for table in seeding.TABLES:
+         parser.add_argument(f'--{table}', type=int, help=f'Number of {table} to add instead of the dataset\'s.')
+      parser.add_argument('--workers', type=int, default=4, help='Worker processes generating and inserting rows; 1 runs in this process.')
+      parser.add_argument('--batch-size', type=int, default=5000, help='Rows per chunk, each inserted in its own transaction.')
+      parser.add_argument('--seed', type=int, default=0, help='Random seed; the same seed and counts give the same rows.')
+
+   def handle(self, *args, **options):
+      counts = {table: options[table] if options[table] is not None else count for table, count in seeding.DATASETS[options['dataset']].items()}
+      log = self.stdout.write if options['verbosity'] > 0 else None
+      try:
+         totals = seeding.seed(counts, options['workers'], options['batch_size'], options['seed'], log=log)
+      except ValueError as exc:
+         raise CommandError(exc)
+      added = sum(totals['rows'].values())
+      self.stdout.write(self.style.SUCCESS(f"Added {added} rows in {totals['seconds']:.2f} s ({added / totals['seconds']:,.0f} rows/s)."))
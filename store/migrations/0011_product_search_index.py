@@ -0,0 +1,119 @@
+# Generated by Django 4.1.6 on 2026-10-18 07:50
+
+from django.db import migrations, models
+import django.db.models.deletion
+import store.search
+
+
+PRODUCT_CONTENT_TYPE = "(SELECT id FROM django_content_type WHERE app_label = 'store' AND model = 'product')"
+
+def tag_labels(object_id):
+    return f"""
+        coalesce((SELECT group_concat(tags_tag.label, ' ')
+                  FROM tags_taggeditem JOIN tags_tag ON tags_tag.id = tags_taggeditem.tag_id
+                  WHERE tags_taggeditem.object_id = {object_id}
+                    AND tags_taggeditem.content_type_id = {PRODUCT_CONTENT_TYPE}), '')
+    """
+
+CREATE_SEARCH_INDEX = [
+    """
+    CREATE VIRTUAL TABLE store_product_fts USING fts5(
+        title, description, tags, prefix = '2 3', tokenize = 'unicode61 remove_diacritics 2'
+    )
+    """,
+    f"""
+    INSERT INTO store_product_fts (rowid, title, description, tags)
+    SELECT id, title, coalesce(description, ''), {tag_labels('store_product.id')} FROM store_product
+    """,
+    """
+    CREATE TRIGGER store_product_fts_insert AFTER INSERT ON store_product BEGIN
+        INSERT INTO store_product_fts (rowid, title, description, tags)
+        VALUES (new.id, new.title, coalesce(new.description, ''), '');
+    END
+    """,
+    """
+    CREATE TRIGGER store_product_fts_update AFTER UPDATE OF title, description ON store_product BEGIN
+        UPDATE store_product_fts SET title = new.title, description = coalesce(new.description, '')
+        WHERE rowid = new.id;
+    END
+    """,
+    """
+    CREATE TRIGGER store_product_fts_delete AFTER DELETE ON store_product BEGIN
+        DELETE FROM store_product_fts WHERE rowid = old.id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER tags_taggeditem_fts_insert AFTER INSERT ON tags_taggeditem
+    WHEN new.content_type_id = {PRODUCT_CONTENT_TYPE} BEGIN
+        UPDATE store_product_fts SET tags = {tag_labels('new.object_id')} WHERE rowid = new.object_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER tags_taggeditem_fts_delete AFTER DELETE ON tags_taggeditem
+    WHEN old.content_type_id = {PRODUCT_CONTENT_TYPE} BEGIN
+        UPDATE store_product_fts SET tags = {tag_labels('old.object_id')} WHERE rowid = old.object_id;
+    END
+    """,
+    f"""
+    CREATE TRIGGER tags_taggeditem_fts_update AFTER UPDATE ON tags_taggeditem BEGIN
+        UPDATE store_product_fts SET tags = {tag_labels('old.object_id')}
+        WHERE rowid = old.object_id AND old.content_type_id = {PRODUCT_CONTENT_TYPE};
+        UPDATE store_product_fts SET tags = {tag_labels('new.object_id')}
+        WHERE rowid = new.object_id AND new.content_type_id = {PRODUCT_CONTENT_TYPE};
+    END
+    """,
+    f"""
+    CREATE TRIGGER tags_tag_fts_update AFTER UPDATE OF label ON tags_tag BEGIN
+        UPDATE store_product_fts SET tags = {tag_labels('store_product_fts.rowid')}
+        WHERE rowid IN (SELECT object_id FROM tags_taggeditem
+                        WHERE tag_id = new.id AND content_type_id = {PRODUCT_CONTENT_TYPE});
+    END
+    """,
+]
+
+DROP_SEARCH_INDEX = [
+    'DROP TRIGGER tags_tag_fts_update',
+    'DROP TRIGGER tags_taggeditem_fts_update',
+    'DROP TRIGGER tags_taggeditem_fts_delete',
+    'DROP TRIGGER tags_taggeditem_fts_insert',
+    'DROP TRIGGER store_product_fts_delete',
+    'DROP TRIGGER store_product_fts_update',
+    'DROP TRIGGER store_product_fts_insert',
+    'DROP TABLE store_product_fts',
+]
+
+def run_on_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('tags', '0001_initial'),
+        ('store', '0010_product_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductSearchIndex',
+            fields=[
+                ('product', models.OneToOneField(db_column='rowid', on_delete=django.db.models.deletion.DO_NOTHING, primary_key=True, related_name='search_index', serialize=False, to='store.product')),
+                ('title', models.TextField()),
+                ('description', models.TextField()),
+                ('tags', models.TextField()),
+                ('document', store.search.SearchDocumentField(db_column='store_product_fts')),
+                ('rank', models.FloatField()),
+            ],
+            options={
+                'db_table': 'store_product_fts',
+                'managed': False,
+            },
+        ),
+        migrations.RunPython(run_on_sqlite(CREATE_SEARCH_INDEX), run_on_sqlite(DROP_SEARCH_INDEX)),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 4.1.6 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+CREATE_COUNTER_TRIGGERS = [
+    """
+    CREATE TRIGGER store_collection_products_count_insert AFTER INSERT ON store_product BEGIN
+        UPDATE store_collection SET products_count = products_count + 1 WHERE id = new.collection_id;
+    END
+    """,
+    """
+    CREATE TRIGGER store_collection_products_count_delete AFTER DELETE ON store_product BEGIN
+        UPDATE store_collection SET products_count = products_count - 1 WHERE id = old.collection_id;
+    END
+    """,
+    """
+    CREATE TRIGGER store_collection_products_count_update AFTER UPDATE OF collection_id ON store_product
+    WHEN old.collection_id IS NOT new.collection_id BEGIN
+        UPDATE store_collection SET products_count = products_count - 1 WHERE id = old.collection_id;
+        UPDATE store_collection SET products_count = products_count + 1 WHERE id = new.collection_id;
+    END
+    """,
+]
+
+DROP_COUNTER_TRIGGERS = [
+    'DROP TRIGGER store_collection_products_count_update',
+    'DROP TRIGGER store_collection_products_count_delete',
+    'DROP TRIGGER store_collection_products_count_insert',
+]
+
+COUNT_PRODUCTS = """
+    UPDATE store_collection SET products_count = (
+        SELECT COUNT(*) FROM store_product WHERE store_product.collection_id = store_collection.id
+    )
+"""
+
+def create_counter(apps, schema_editor):
+    schema_editor.execute(COUNT_PRODUCTS)
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_COUNTER_TRIGGERS:
+            schema_editor.execute(statement)
+
+def drop_counter(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_COUNTER_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0012_cart_created_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='products_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(create_counter, drop_counter),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 4.1.6 on 2026-10-18 09:06
+
+from decimal import Decimal, ROUND_HALF_UP
+
+import django.core.validators
+from django.db import migrations, models
+from django.db.models import Max, Q
+
+
+#Adding effective_price makes SQLite copy store_product into a new table,
+#dropping its triggers; store.triggers restores them once the migrate ends
+def fill_effective_prices(apps, schema_editor):
+    Product = apps.get_model('store', 'Product')
+    schema_editor.execute('UPDATE store_product SET effective_price = price')
+    promoted = (
+        Product.objects.filter(promotions__isnull=False).order_by()
+        .values_list('id', 'price')
+        .annotate(discount=Max('promotions__discount', filter=Q(promotions__is_active=True)))
+    )
+    for id, price, discount in promoted:
+        if discount:
+            discount = min(max(Decimal(str(discount)), Decimal(0)), Decimal(1))
+            Product.objects.filter(id=id).update(effective_price=(price * (1 - discount)).quantize(Decimal('0.01'), ROUND_HALF_UP))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0016_order_customer_placed_at_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='effective_price',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=6),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='promotion',
+            name='is_active',
+            field=models.BooleanField(default=True),
+        ),
+        migrations.AlterField(
+            model_name='promotion',
+            name='discount',
+            field=models.FloatField(validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(1)]),
+        ),
+        migrations.RunPython(fill_effective_prices, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['effective_price', 'id'], name='store_produ_effecti_707a96_idx'),
+        ),
+    ]
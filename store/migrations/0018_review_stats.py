@@ -0,0 +1,131 @@
+# Generated by Django 4.1.6 on 2026-10-18 09:17
+
+import django.core.validators
+from django.db import migrations, models
+
+
+def add_review(row):
+    return f"""
+        UPDATE store_product SET
+            reviews_count = reviews_count + 1,
+            ratings_count = ratings_count + ({row}.rating IS NOT NULL),
+            ratings_total = ratings_total + coalesce({row}.rating, 0),
+            average_rating = CASE WHEN ratings_count + ({row}.rating IS NOT NULL) > 0
+                THEN (ratings_total + coalesce({row}.rating, 0)) * 1.0 / (ratings_count + ({row}.rating IS NOT NULL)) ELSE 0 END,
+            last_reviewed_on = (SELECT max(date) FROM store_review WHERE product_id = {row}.product_id)
+        WHERE id = {row}.product_id;
+    """
+
+def remove_review(row):
+    return f"""
+        UPDATE store_product SET
+            reviews_count = reviews_count - 1,
+            ratings_count = ratings_count - ({row}.rating IS NOT NULL),
+            ratings_total = ratings_total - coalesce({row}.rating, 0),
+            average_rating = CASE WHEN ratings_count - ({row}.rating IS NOT NULL) > 0
+                THEN (ratings_total - coalesce({row}.rating, 0)) * 1.0 / (ratings_count - ({row}.rating IS NOT NULL)) ELSE 0 END,
+            last_reviewed_on = (SELECT max(date) FROM store_review WHERE product_id = {row}.product_id)
+        WHERE id = {row}.product_id;
+    """
+
+#SET expressions see the row as it was before the UPDATE, so the average is
+#computed from the old totals plus or minus the review. The latest date is a
+#single seek on the (product_id, date) index.
+CREATE_REVIEW_TRIGGERS = [
+    f"""
+    CREATE TRIGGER store_review_stats_insert AFTER INSERT ON store_review BEGIN
+        {add_review('new')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER store_review_stats_delete AFTER DELETE ON store_review BEGIN
+        {remove_review('old')}
+    END
+    """,
+    f"""
+    CREATE TRIGGER store_review_stats_update AFTER UPDATE OF product_id, rating, date ON store_review BEGIN
+        {remove_review('old')}
+        {add_review('new')}
+    END
+    """,
+]
+
+DROP_REVIEW_TRIGGERS = [
+    'DROP TRIGGER store_review_stats_update',
+    'DROP TRIGGER store_review_stats_delete',
+    'DROP TRIGGER store_review_stats_insert',
+]
+
+COUNT_REVIEWS = """
+    UPDATE store_product SET
+        reviews_count = (SELECT count(*) FROM store_review WHERE product_id = store_product.id),
+        ratings_count = (SELECT count(rating) FROM store_review WHERE product_id = store_product.id),
+        ratings_total = (SELECT coalesce(sum(rating), 0) FROM store_review WHERE product_id = store_product.id),
+        average_rating = (SELECT coalesce(avg(rating), 0) FROM store_review WHERE product_id = store_product.id),
+        last_reviewed_on = (SELECT max(date) FROM store_review WHERE product_id = store_product.id)
+    WHERE id IN (SELECT product_id FROM store_review)
+"""
+
+def create_review_stats(apps, schema_editor):
+    schema_editor.execute(COUNT_REVIEWS)
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_REVIEW_TRIGGERS:
+            schema_editor.execute(statement)
+
+def drop_review_stats(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_REVIEW_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_promotion_pricing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='average_rating',
+            field=models.FloatField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='last_reviewed_on',
+            field=models.DateField(editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='ratings_total',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='reviews_count',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='review',
+            name='rating',
+            field=models.PositiveSmallIntegerField(blank=True, null=True, validators=[django.core.validators.MinValueValidator(1), django.core.validators.MaxValueValidator(5)]),
+        ),
+        migrations.RunPython(create_review_stats, drop_review_stats),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['reviews_count', 'id'], name='store_produ_reviews_72a64d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['average_rating', 'id'], name='store_produ_average_45004d_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['product', 'date'], name='store_revie_product_a44095_idx'),
+        ),
+    ]
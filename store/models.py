@@ -1,36 +1,120 @@
-from django.core.validators import MinValueValidator
-from django.db import models
+from django.core.validators import MaxValueValidator, MinValueValidator
+from django.db import connections, models
+from django.db.models import F, Sum, Value
+from django.db.models.functions import Coalesce
 from uuid import uuid4
 
+from .search import SearchDocumentField
+
+MONEY_TOTAL = models.DecimalField(max_digits=12, decimal_places=2)
+
 class Promotion(models.Model):
    description = models.CharField(max_length=255)
-   discount = models.FloatField()
+   discount = models.FloatField(validators=[MinValueValidator(0), MaxValueValidator(1)]) #fraction of the price, 0.15 is 15% off
+   is_active = models.BooleanField(default=True)
 
 class Collection(models.Model):
    title = models.CharField(max_length=255)
    featured_product = models.ForeignKey('Product', on_delete=models.SET_NULL, null=True, related_name='+')
+   products_count = models.PositiveIntegerField(default=0, editable=False) #maintained by triggers on store_product, see migration 0013
 
    def __str__(self):
       return self.title
+
+   def save(self, *args, **kwargs):
+      #Never write back a products_count read before the triggers last changed it
+      if not self._state.adding and kwargs.get('update_fields') is None:
+         kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name != 'products_count']
+      super().save(*args, **kwargs)
    
    class Meta:
       ordering = ['title']
 
+class ProductQuerySet(models.QuerySet):
+   def bulk_create(self, objs, *args, **kwargs):
+      #New products have no promotion links yet, so they sell at their price
+      objs = list(objs)
+      for product in objs:
+         if product.effective_price is None:
+            product.effective_price = product.price
+      return super().bulk_create(objs, *args, **kwargs)
+
+   def take_inventory(self, items):
+      """
+      Decrements inventory by (product_id, quantity) pairs in one executemany.
+      A product without enough inventory is left alone, so stock never goes
+      negative; returns how many products were decremented.
+      """
+      with connections[self.db].cursor() as cursor:
+         cursor.executemany(
+            'UPDATE store_product SET inventory = inventory - %s WHERE id = %s AND inventory >= %s',
+            [(quantity, product_id, quantity) for product_id, quantity in items],
+         )
+         return cursor.rowcount
+
 class Product(models.Model):
    title = models.CharField(max_length=255)
    slug = models.SlugField()
    description = models.TextField(null=True, blank=True)
    price = models.DecimalField(max_digits=6, decimal_places=2, validators=[MinValueValidator(1)])
+   effective_price = models.DecimalField(max_digits=6, decimal_places=2, editable=False) #price after the best active promotion, kept by store.pricing
    inventory = models.IntegerField(validators=[MinValueValidator(1)])
    last_update = models.DateTimeField(auto_now=True) #data e horário; add só uma vez
    collection = models.ForeignKey(Collection, on_delete=models.PROTECT, related_name='products')
    promotions = models.ManyToManyField(Promotion, blank=True)
+   #Review statistics, maintained by triggers on store_review (see migration 0018)
+   REVIEW_STATS = ['reviews_count', 'last_reviewed_on', 'ratings_count', 'ratings_total', 'average_rating']
+   reviews_count = models.PositiveIntegerField(default=0, editable=False)
+   last_reviewed_on = models.DateField(null=True, editable=False)
+   ratings_count = models.PositiveIntegerField(default=0, editable=False)
+   ratings_total = models.PositiveIntegerField(default=0, editable=False)
+   average_rating = models.FloatField(default=0, editable=False) #0 until the product has a rating, so it sorts and pages like any column
+
+   objects = ProductQuerySet.as_manager()
 
    def __str__(self):
       return self.title
+
+   def save(self, *args, **kwargs):
+      #Never write back review statistics read before the triggers last changed them
+      if not self._state.adding and kwargs.get('update_fields') is None:
+         kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key and field.name not in self.REVIEW_STATS]
+      #A new product has no promotions yet; edits to the price are repriced by
+      #the paths that make them, see store.pricing
+      if self.effective_price is None:
+         self.effective_price = self.price
+      super().save(*args, **kwargs)
    
    class Meta:
       ordering = ['title']
+      indexes = [
+         models.Index(fields=['title', 'id']),
+         models.Index(fields=['price', 'id']),
+         models.Index(fields=['effective_price', 'id']),
+         models.Index(fields=['last_update', 'id']),
+         models.Index(fields=['reviews_count', 'id']),
+         models.Index(fields=['average_rating', 'id']),
+         #?collection_id= with each sort order
+         models.Index(fields=['collection', 'title', 'id']),
+         models.Index(fields=['collection', 'price', 'id']),
+         models.Index(fields=['collection', 'effective_price', 'id']),
+         models.Index(fields=['collection', 'last_update', 'id']),
+         models.Index(fields=['collection', 'reviews_count', 'id']),
+         models.Index(fields=['collection', 'average_rating', 'id']),
+      ]
+
+#SQLite FTS5 table kept in sync with Product (and its tags) by triggers; see migration 0011
+class ProductSearchIndex(models.Model):
+   product = models.OneToOneField(Product, on_delete=models.DO_NOTHING, primary_key=True, db_column='rowid', related_name='search_index')
+   title = models.TextField()
+   description = models.TextField()
+   tags = models.TextField()
+   document = SearchDocumentField(db_column='store_product_fts')
+   rank = models.FloatField()
+
+   class Meta:
+      managed = False
+      db_table = 'store_product_fts'
 
 class Customer(models.Model):
    MEMBERSHIP_BRONZE = 'B'
@@ -53,9 +137,29 @@ class Customer(models.Model):
    def __str__(self):
       return f'{self.first_name} {self.last_name}'
 
+   def order_summary(self):
+      #Lifetime spend only counts paid orders
+      line_total = models.ExpressionWrapper(F('items__quantity') * F('items__unit_price'), output_field=MONEY_TOTAL)
+      return self.order_set.aggregate(
+         orders_count=models.Count('id', distinct=True),
+         lifetime_spend=Coalesce(Sum(line_total, filter=models.Q(payment_status=Order.COMPLETE)), Value(0), output_field=MONEY_TOTAL),
+      )
+
    class Meta:
       ordering = ['first_name', 'last_name']
 
+class OrderQuerySet(models.QuerySet):
+   def with_total_price(self):
+      #A subquery rather than a join and GROUP BY, which would sort every
+      #matching order before a page could be sliced off
+      totals = (
+         OrderItem.objects.filter(order=models.OuterRef('pk'))
+         .values('order')
+         .annotate(total=Sum(F('quantity') * F('unit_price'), output_field=MONEY_TOTAL))
+         .values('total')
+      )
+      return self.annotate(total_price=Coalesce(models.Subquery(totals), Value(0), output_field=MONEY_TOTAL))
+
 class Order(models.Model):
    PENDING = 'P'
    COMPLETE = 'C'
@@ -71,12 +175,69 @@ class Order(models.Model):
    payment_status = models.CharField(max_length=1, choices=PAYMENT_STATUS, default=PENDING)
    customer = models.ForeignKey('Customer', on_delete=models.PROTECT)
 
+   objects = OrderQuerySet.as_manager()
+
+   class Meta:
+      indexes = [
+         models.Index(fields=['placed_at']),
+         models.Index(fields=['customer', 'placed_at']), #a customer's order history, newest first
+      ]
+
 class OrderItem(models.Model):
-   order = models.ForeignKey(Order, on_delete=models.PROTECT)
+   order = models.ForeignKey(Order, on_delete=models.PROTECT, related_name='items')
    product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name='orderitems')
    quantity = models.PositiveSmallIntegerField()
    unit_price = models.DecimalField(max_digits=6, decimal_places=2)
 
+#Daily sales rollups, refreshed from OrderItem by store.analytics
+class DailyProductSales(models.Model):
+   day = models.DateField()
+   product = models.ForeignKey(Product, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+   units = models.PositiveIntegerField()
+   revenue = MONEY_TOTAL.clone()
+
+   class Meta:
+      constraints = [
+         models.UniqueConstraint(fields=['day', 'product'], name='unique_daily_product_sales'),
+      ]
+      indexes = [
+         models.Index(fields=['product', 'day']),
+      ]
+
+class DailyCollectionSales(models.Model):
+   day = models.DateField()
+   collection = models.ForeignKey(Collection, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+   units = models.PositiveIntegerField()
+   revenue = MONEY_TOTAL.clone()
+
+   class Meta:
+      constraints = [
+         models.UniqueConstraint(fields=['day', 'collection'], name='unique_daily_collection_sales'),
+      ]
+      indexes = [
+         models.Index(fields=['collection', 'day']),
+      ]
+
+#Top sellers of the trailing windows in store.analytics.LEADERBOARD_WINDOWS, as of end_day
+class SalesLeaderboard(models.Model):
+   window_days = models.PositiveSmallIntegerField()
+   end_day = models.DateField()
+   by = models.CharField(max_length=10)
+   key_id = models.IntegerField()
+   units = models.PositiveIntegerField()
+   revenue = MONEY_TOTAL.clone()
+
+   class Meta:
+      indexes = [
+         models.Index(fields=['window_days', 'by', 'end_day']),
+      ]
+
+#How far an incremental job has got, e.g. the last OrderItem id folded into the rollups
+class Watermark(models.Model):
+   name = models.CharField(max_length=100, primary_key=True)
+   position = models.BigIntegerField(default=0)
+   updated_at = models.DateTimeField(auto_now=True)
+
 #Part 1 - Cap 3 - video 7
 class Address(models.Model):
    zip = models.CharField(max_length=10)
@@ -84,15 +245,60 @@ class Address(models.Model):
    city = models.CharField(max_length=255)
    customer = models.OneToOneField(Customer, on_delete=models.CASCADE, primary_key=True)
 
+class CartQuerySet(models.QuerySet):
+   def with_total_price(self):
+      line_total = models.ExpressionWrapper(F('items__quantity') * F('items__product__effective_price'), output_field=MONEY_TOTAL)
+      return self.annotate(total_price=Coalesce(Sum(line_total), Value(0), output_field=MONEY_TOTAL))
+
 class Cart(models.Model):
    id = models.UUIDField(primary_key=True, default=uuid4)
    created_at = models.DateTimeField(auto_now_add=True)
 
+   objects = CartQuerySet.as_manager()
+
+   class Meta:
+      indexes = [
+         models.Index(fields=['created_at']),
+      ]
+
+class CartItemQuerySet(models.QuerySet):
+   def with_total_price(self):
+      return self.annotate(total_price=models.ExpressionWrapper(F('quantity') * F('product__effective_price'), output_field=MONEY_TOTAL))
+
+   def add_items(self, cart_id, items):
+      """
+      Adds (product_id, quantity) pairs to a cart in one statement, summing
+      quantities into existing lines. Pairs whose cart or product doesn't exist
+      are skipped; returns the CartItem rows that were inserted or updated.
+      """
+      if not items:
+         return []
+      connection = connections[self.db]
+      values = ', '.join(['(%s, %s)'] * len(items))
+      sql = f'''
+         INSERT INTO store_cartitem (cart_id, product_id, quantity)
+         SELECT store_cart.id, store_product.id, requested.column2
+         FROM (VALUES {values}) AS requested
+         JOIN store_product ON store_product.id = requested.column1
+         JOIN store_cart ON store_cart.id = %s
+         WHERE true
+         ON CONFLICT (cart_id, product_id) DO UPDATE SET quantity = store_cartitem.quantity + excluded.quantity
+         RETURNING id, product_id, quantity
+      '''
+      params = [value for item in items for value in item]
+      params.append(self.model._meta.get_field('cart').get_db_prep_value(cart_id, connection))
+      with connection.cursor() as cursor:
+         cursor.execute(sql, params)
+         rows = cursor.fetchall()
+      return [self.model(id=id, cart_id=cart_id, product_id=product_id, quantity=quantity) for id, product_id, quantity in rows]
+
 class CartItem(models.Model):
    cart = models.ForeignKey(Cart, on_delete=models.CASCADE, related_name='items')
    product = models.ForeignKey(Product, on_delete=models.CASCADE)
    quantity = models.PositiveSmallIntegerField(validators=[MinValueValidator(1)])
 
+   objects = CartItemQuerySet.as_manager()
+
    class Meta:
       unique_together = [['cart', 'product']]
 
@@ -100,4 +306,10 @@ class Review(models.Model):
    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reviews')
    name = models.CharField(max_length=255)
    description = models.TextField()
-   date = models.DateField(auto_now_add=True)
\ No newline at end of file
+   date = models.DateField(auto_now_add=True)
+   rating = models.PositiveSmallIntegerField(null=True, blank=True, validators=[MinValueValidator(1), MaxValueValidator(5)])
+
+   class Meta:
+      indexes = [
+         models.Index(fields=['product', 'date']),
+      ]
\ No newline at end of file
@@ -0,0 +1,159 @@
+import base64
+import binascii
+import json
+from django.core.exceptions import FieldDoesNotExist, ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+class KeysetPagination(BasePagination):
+   """
+   Cursor pagination over whatever ordering the filter backends left on the
+   queryset (falling back to the model's Meta.ordering), with the primary key
+   appended as a tiebreaker. Each page is fetched with a WHERE clause on the
+   last row seen instead of an OFFSET, so deep pages cost the same as the first.
+   """
+   page_size = 10
+   page_size_query_param = 'page_size'
+   max_page_size = 1000
+   cursor_query_param = 'cursor'
+   invalid_cursor_message = 'Invalid cursor.'
+
+   def paginate_queryset(self, queryset, request, view=None):
+      return self.set_page(list(self.page_queryset(queryset, request)))
+
+   async def apaginate_queryset(self, queryset, request, view=None):
+      #The same page read through the async ORM, for async views
+      return self.set_page([row async for row in self.page_queryset(queryset, request)])
+
+   def page_queryset(self, queryset, request):
+      #The page's rows plus one, to tell whether another page follows
+      self.request = request
+      self.base_url = request.build_absolute_uri()
+      self.page_size = self.get_page_size(request)
+      self.model = queryset.model
+      self.ordering = self.get_ordering(queryset)
+      self.position, self.reverse = self.decode_cursor(request)
+
+      ordering = [self.flip(field) for field in self.ordering] if self.reverse else self.ordering
+      queryset = queryset.order_by(*ordering)
+      if self.position is not None:
+         queryset = queryset.filter(self.keyset_filter(ordering, self.position))
+      return queryset[:self.page_size + 1]
+
+   def set_page(self, rows):
+      has_more = len(rows) > self.page_size
+      rows = rows[:self.page_size]
+      if self.reverse:
+         rows.reverse()
+         self.has_next, self.has_previous = self.position is not None, has_more
+      else:
+         self.has_next, self.has_previous = has_more, self.position is not None
+      self.page = rows
+      return rows
+
+   def get_paginated_response(self, data):
+      return Response({
+         'next': self.get_next_link(),
+         'previous': self.get_previous_link(),
+         'results': data,
+      })
+
+   def get_paginated_response_schema(self, schema):
+      return {
+         'type': 'object',
+         'properties': {
+            'next': {'type': 'string', 'nullable': True},
+            'previous': {'type': 'string', 'nullable': True},
+            'results': schema,
+         },
+      }
+
+   def get_page_size(self, request):
+      try:
+         page_size = int(request.query_params[self.page_size_query_param])
+      except (KeyError, ValueError):
+         return self.page_size
+      if page_size <= 0:
+         return self.page_size
+      return min(page_size, self.max_page_size)
+
+   def get_ordering(self, queryset):
+      ordering = list(queryset.query.order_by or queryset.model._meta.ordering)
+      ordering = ['-id' if field == '-pk' else 'id' if field == 'pk' else field for field in ordering]
+      if not ordering or not self.is_unique(queryset, ordering[-1].lstrip('-')):
+         descending = bool(ordering) and ordering[-1].startswith('-')
+         ordering.append('-id' if descending else 'id')
+      return ordering
+
+   def is_unique(self, queryset, name):
+      expression = queryset.query.annotations.get(name)
+      try:
+         field = expression.target if expression is not None else queryset.model._meta.get_field(name)
+      except (AttributeError, FieldDoesNotExist):
+         return False
+      return field.unique
+
+   def get_next_link(self):
+      if not self.has_next:
+         return None
+      return self.link_to(self.page[-1], reverse=False)
+
+   def get_previous_link(self):
+      if not self.has_previous:
+         return None
+      return self.link_to(self.page[0], reverse=True)
+
+   def link_to(self, row, reverse):
+      position = [self.to_json(getattr(row, field.lstrip('-'))) for field in self.ordering]
+      return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(position, reverse))
+
+   def encode_cursor(self, position, reverse=False):
+      payload = json.dumps({'p': position, 'r': int(reverse)}, separators=(',', ':'))
+      return base64.urlsafe_b64encode(payload.encode()).decode()
+
+   def decode_cursor(self, request):
+      encoded = request.query_params.get(self.cursor_query_param)
+      if not encoded:
+         return None, False
+      try:
+         payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+         position, reverse = payload['p'], bool(payload['r'])
+         if len(position) != len(self.ordering):
+            raise ValueError
+         position = [self.to_python(field.lstrip('-'), value) for field, value in zip(self.ordering, position)]
+      except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+         raise NotFound(self.invalid_cursor_message)
+      return position, reverse
+
+   def keyset_filter(self, ordering, position, index=0):
+      #Written as f >= v AND (f > v OR ...) rather than a flat OR so the
+      #outermost comparison can still drive an index range scan.
+      field = ordering[index]
+      name = field.lstrip('-')
+      value = position[index]
+      strict, inclusive = ('lt', 'lte') if field.startswith('-') else ('gt', 'gte')
+      if index == len(ordering) - 1:
+         return Q(**{f'{name}__{strict}': value})
+      return Q(**{f'{name}__{inclusive}': value}) & (
+         Q(**{f'{name}__{strict}': value}) | self.keyset_filter(ordering, position, index + 1)
+      )
+
+   def to_python(self, name, value):
+      try:
+         return self.model._meta.get_field(name).to_python(value)
+      except FieldDoesNotExist:
+         return value
+
+   def to_json(self, value):
+      if value is None or isinstance(value, (bool, int, float, str)):
+         return value
+      if hasattr(value, 'isoformat'):
+         return value.isoformat()
+      return str(value)
+
+   @staticmethod
+   def flip(field):
+      return field[1:] if field.startswith('-') else f'-{field}'
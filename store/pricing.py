@@ -0,0 +1,64 @@
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import connections, transaction
+from django.db.models import Max, Q
+
+from . import cache
+from .models import Product
+
+CENT = Decimal('0.01')
+
+def discounted(price, discount):
+   """The price after a fractional discount (0.15 is 15% off), in whole cents."""
+   if not discount:
+      return Decimal(price).quantize(CENT)
+   discount = min(max(Decimal(str(discount)), Decimal(0)), Decimal(1))
+   return (Decimal(price) * (1 - discount)).quantize(CENT, ROUND_HALF_UP)
+
+def best_discount():
+   #Promotions don't stack: a product gets its single largest active discount
+   return Max('promotions__discount', filter=Q(promotions__is_active=True))
+
+def reprice_edited(product):
+   """
+   Reprices a saved product after an edit changed its price. Product.save
+   doesn't look up promotions, so the admin and API write paths call this.
+   """
+   changed = reprice([product.pk])
+   if changed:
+      product.refresh_from_db(fields=['effective_price'])
+      cache.invalidate_products([id for id, _ in changed], [collection_id for _, collection_id in changed])
+
+def reprice(product_ids, chunk_size=5000):
+   """
+   Recomputes effective_price for the given products, chunk_size at a time:
+   one aggregate read and one executemany per chunk, writing only the rows
+   whose price moved. Returns the (id, collection_id) pairs that changed so
+   their cached responses can be dropped.
+   """
+   product_ids = sorted(set(product_ids))
+   changed = []
+   for start in range(0, len(product_ids), chunk_size):
+      changed += reprice_chunk(product_ids[start:start + chunk_size])
+   return changed
+
+def reprice_chunk(product_ids):
+   changed, values = [], []
+   rows = (
+      Product.objects.filter(id__in=product_ids).order_by()
+      .values_list('id', 'collection_id', 'price', 'effective_price')
+      .annotate(discount=best_discount())
+   )
+   for id, collection_id, price, current, discount in rows:
+      price = discounted(price, discount)
+      if price != current:
+         changed.append((id, collection_id))
+         values.append((price, id))
+   if values:
+      connection = connections[Product.objects.db]
+      #One transaction per chunk: in autocommit every UPDATE would be its own commit
+      with transaction.atomic(using=Product.objects.db), connection.cursor() as cursor:
+         cursor.executemany(
+            'UPDATE store_product SET effective_price = %s WHERE id = %s',
+            [(connection.ops.adapt_decimalfield_value(price), id) for price, id in values],
+         )
+   return changed
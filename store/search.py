@@ -0,0 +1,58 @@
+from django.db import connections, models
+from rest_framework.filters import SearchFilter
+
+class SearchDocumentField(models.TextField):
+   """The hidden column of an FTS5 table that has the same name as the table."""
+
+@SearchDocumentField.register_lookup
+class Match(models.Lookup):
+   lookup_name = 'match'
+
+   def as_sql(self, compiler, connection):
+      lhs, lhs_params = self.process_lhs(compiler, connection)
+      rhs, rhs_params = self.process_rhs(compiler, connection)
+      return f'{lhs} MATCH {rhs}', lhs_params + rhs_params
+
+def match_expression(terms, columns=None):
+   #Every term is quoted, so user input can't inject FTS5 syntax, and starred
+   #for prefix matching; terms are ANDed like SearchFilter does.
+   phrases = ' AND '.join('"{}"*'.format(term.replace('"', '""')) for term in terms)
+   if columns:
+      return '{%s} : (%s)' % (' '.join(columns), phrases)
+   return phrases
+
+class FullTextSearchFilter(SearchFilter):
+   """
+   Drop-in replacement for SearchFilter backed by the store_product_fts index.
+   Results are ranked by bm25 unless an explicit ?ordering is given, terms match
+   as prefixes, and ?search_tags=true also matches the labels of the product's
+   tags. Falls back to SearchFilter on databases without FTS5.
+
+   bm25 has to score every match before the first row comes back, so searches
+   matching more than max_ranked_matches products are returned in index order
+   instead, which FTS5 can stream.
+   """
+   search_tags_param = 'search_tags'
+   search_columns = ['title', 'description']
+   max_ranked_matches = 10000
+
+   def filter_queryset(self, request, queryset, view):
+      terms = [term for term in self.get_search_terms(request) if any(char.isalnum() for char in term)]
+      if connections[queryset.db].vendor != 'sqlite':
+         return super().filter_queryset(request, queryset, view)
+      if not terms:
+         return queryset
+
+      columns = None if self.include_tags(request) else self.search_columns
+      expression = match_expression(terms, columns)
+      queryset = queryset.filter(search_index__document__match=expression)
+      if self.count_matches(queryset.db, expression) > self.max_ranked_matches:
+         return queryset.annotate(search_position=models.F('search_index__pk')).order_by('search_position')
+      return queryset.annotate(search_rank=models.F('search_index__rank')).order_by('search_rank')
+
+   def count_matches(self, using, expression):
+      from .models import ProductSearchIndex
+      return ProductSearchIndex.objects.using(using).filter(document__match=expression)[:self.max_ranked_matches + 1].count()
+
+   def include_tags(self, request):
+      return request.query_params.get(self.search_tags_param, '').lower() in ('1', 'true', 'yes')
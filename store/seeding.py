@@ -0,0 +1,303 @@
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from datetime import timedelta
+from decimal import Decimal
+from uuid import UUID
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from core.models import User
+from likes.models import LikeCount, LikedItem
+from tags.models import Tag, TaggedItem
+from . import analytics, jobs
+from .models import Cart, CartItem, Collection, Customer, Order, OrderItem, Product, Promotion, Review
+from .pricing import discounted
+
+ADJECTIVES = ['red', 'blue', 'green', 'wooden', 'steel', 'vintage', 'modern', 'compact', 'organic', 'premium', 'rustic', 'waterproof']
+NOUNS = ['chair', 'table', 'lamp', 'mug', 'shirt', 'backpack', 'speaker', 'notebook', 'blender', 'pillow', 'kettle', 'jacket']
+FIRST_NAMES = ['Ana', 'Bruno', 'Carla', 'Diego', 'Elena', 'Felipe', 'Gabriela', 'Hugo', 'Isabel', 'João', 'Karen', 'Lucas', 'Marina', 'Nuno', 'Olivia', 'Pedro']
+LAST_NAMES = ['Silva', 'Santos', 'Oliveira', 'Souza', 'Lima', 'Pereira', 'Costa', 'Almeida', 'Ferreira', 'Rocha', 'Gomes', 'Martins']
+
+#Row counts of the fixed datasets the benchmarks run at. Order items, cart
+#items, promotion links and tagged items follow from these (a few per order,
+#cart or product)
+DATASETS = {
+   'small': {
+      'collections': 20, 'products': 10_000, 'promotions': 20, 'tags': 50, 'users': 1_000, 'customers': 2_000,
+      'orders': 10_000, 'carts': 1_000, 'reviews': 20_000, 'likes': 20_000,
+   },
+   'medium': {
+      'collections': 100, 'products': 100_000, 'promotions': 100, 'tags': 200, 'users': 10_000, 'customers': 20_000,
+      'orders': 100_000, 'carts': 10_000, 'reviews': 200_000, 'likes': 200_000,
+   },
+   'large': {
+      'collections': 500, 'products': 1_000_000, 'promotions': 500, 'tags': 1_000, 'users': 100_000, 'customers': 200_000,
+      'orders': 1_000_000, 'carts': 100_000, 'reviews': 2_000_000, 'likes': 2_000_000,
+   },
+}
+TABLES = list(DATASETS['small'])
+
+#Tables in the order they are seeded: each stage only refers to the ones before it
+STAGES = [
+   ['collections', 'promotions', 'tags', 'users', 'customers'],
+   ['products'],
+   ['orders', 'carts', 'reviews', 'likes'],
+]
+
+#Tables whose rows refer to rows of other tables
+REFERS_TO = {'products': ['collections'], 'orders': ['customers', 'products'], 'carts': ['products'], 'reviews': ['products'], 'likes': ['users', 'products']}
+
+#The models whose ids each table's rows take, from the first free one
+MODELS = {
+   'collections': Collection, 'promotions': Promotion, 'tags': Tag, 'users': User, 'customers': Customer,
+   'products': Product, 'orders': Order, 'reviews': Review,
+}
+
+def skewed(rng, count, exponent):
+   """An index below count, the lower ones more likely: 1 is uniform, 3 gives about half the picks to the first tenth."""
+   return int(count * rng.random() ** exponent)
+
+def pick_distinct(rng, count, picks, exponent):
+   #Repeats are dropped, so popular rows don't crowd out the picks
+   return {skewed(rng, count, exponent) for _ in range(min(picks, count))}
+
+def ago(rng, now, days, exponent=1):
+   """A moment in the last `days` days; an exponent above 1 favours recent ones."""
+   return now - timedelta(seconds=int(days * 86400 * rng.random() ** exponent))
+
+def backdate(objects, field, values):
+   """Sets the auto_now_add `field` of bulk_created objects, which bulk_create stamped with the current time, to `values`."""
+   for instance, value in zip(objects, values):
+      setattr(instance, field, value)
+   if objects:
+      type(objects[0]).objects.bulk_update(objects, [field], batch_size=1000)
+
+#Shared by the workers on SQLite, which takes one writer at a time: they
+#queue for it here instead of failing in SQLite's busy handler
+write_lock = None
+
+def share_write_lock(lock):
+   """Worker initializer, see write_lock."""
+   global write_lock
+   write_lock = lock
+
+@contextmanager
+def writing():
+   """One chunk's transaction, see write_lock."""
+   with write_lock or nullcontext(), transaction.atomic():
+      yield
+
+def seed_collections(rng, ids, plan):
+   with writing():
+      Collection.objects.bulk_create(Collection(id=id, title=f'{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS)}s {id}') for id in ids)
+   return len(ids)
+
+def seed_promotions(rng, ids, plan):
+   promotions = []
+   for id in ids:
+      discount = rng.choice([0.05, 0.1, 0.1, 0.15, 0.2, 0.25, 0.3, 0.5])
+      promotions.append(Promotion(id=id, description=f'{discount:.0%} off {rng.choice(NOUNS)}s', discount=discount, is_active=rng.random() < 0.8))
+   with writing():
+      Promotion.objects.bulk_create(promotions)
+   return len(ids)
+
+def seed_tags(rng, ids, plan):
+   words = ADJECTIVES + NOUNS + ['sale', 'new', 'gift', 'eco', 'bestseller', 'clearance']
+   with writing():
+      Tag.objects.bulk_create(Tag(id=id, label=f'{words[id % len(words)]}-{id}') for id in ids)
+   return len(ids)
+
+def seed_users(rng, ids, plan):
+   #'!' is an unusable password: these users only like things
+   users = [User(id=id, username=f'user{id}', email=f'user{id}@example.com', password='!', first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES)) for id in ids]
+   with writing():
+      User.objects.bulk_create(users)
+   return len(ids)
+
+def seed_customers(rng, ids, plan):
+   now = timezone.now()
+   customers = [
+      Customer(
+         id=id, first_name=rng.choice(FIRST_NAMES), last_name=rng.choice(LAST_NAMES), email=f'customer{id}@example.com',
+         phone=f'+55 11 9{rng.randrange(10**8):08}', birth_date=(now - timedelta(days=rng.randint(18 * 365, 80 * 365))).date() if rng.random() < 0.7 else None,
+      )
+      for id in ids
+   ]
+   with writing():
+      Customer.objects.bulk_create(customers)
+   return len(ids)
+
+def seed_products(rng, ids, plan):
+   """Products with log-normal prices, a few big collections, some promotions and up to four tags each."""
+   discounts = dict(Promotion.objects.filter(id__gte=plan['first']['promotions'], is_active=True).values_list('id', 'discount'))
+   products, links, tagged = [], [], []
+   for id in ids:
+      price = Decimal(min(9999.99, max(1, round(rng.lognormvariate(3.2, 0.9), 2)))).quantize(Decimal('0.01'))
+      promotions = {plan['first']['promotions'] + index for index in pick_distinct(rng, plan['promotions'], rng.choice([1, 1, 2]), 1)} if rng.random() < 0.08 else set()
+      products.append(Product(
+         id=id,
+         title=f'{rng.choice(ADJECTIVES).title()} {rng.choice(NOUNS)} {id}',
+         slug=f'product-{id}',
+         description=' '.join(rng.choices(ADJECTIVES + NOUNS, k=rng.randint(5, 30))),
+         price=price,
+         effective_price=discounted(price, max((discounts.get(promotion, 0) for promotion in promotions), default=None)),
+         #One product in twenty is (nearly) out of stock
+         inventory=rng.randint(0, 9) if rng.random() < 0.05 else rng.randint(10, 500),
+         collection_id=plan['first']['collections'] + skewed(rng, plan['collections'], 2),
+      ))
+      links += [Product.promotions.through(product_id=id, promotion_id=promotion) for promotion in promotions]
+      tags = pick_distinct(rng, plan['tags'], rng.choices([0, 1, 2, 3, 4], [30, 30, 20, 12, 8])[0], 2)
+      tagged += [TaggedItem(tag_id=plan['first']['tags'] + tag, content_type_id=plan['product_type'], object_id=id) for tag in tags]
+   with writing():
+      Product.objects.bulk_create(products)
+      Product.promotions.through.objects.bulk_create(links)
+      TaggedItem.objects.bulk_create(tagged)
+   return len(ids)
+
+def product_prices(product_ids):
+   prices = {}
+   product_ids = list(product_ids)
+   for start in range(0, len(product_ids), 10_000):
+      prices.update(Product.objects.filter(id__in=product_ids[start:start + 10_000]).values_list('id', 'effective_price'))
+   return prices
+
+def seed_orders(rng, ids, plan):
+   """Orders over the last year, more of them recent, from customers of whom a few order a lot, with one to six items each."""
+   now = timezone.now()
+   orders, placed_at, lines = [], [], []
+   for id in ids:
+      status = rng.choices([Order.COMPLETE, Order.PENDING, Order.FAILED], [90, 7, 3])[0]
+      orders.append(Order(id=id, payment_status=status, customer_id=plan['first']['customers'] + skewed(rng, plan['customers'], 2)))
+      placed_at.append(ago(rng, now, 365, 1.3))
+      for product in pick_distinct(rng, plan['products'], rng.choices([1, 2, 3, 4, 5, 6], [35, 25, 17, 10, 8, 5])[0], 3):
+         lines.append((id, plan['first']['products'] + product, rng.choices([1, 2, 3, 4], [70, 20, 7, 3])[0]))
+   prices = product_prices({product_id for _, product_id, _ in lines})
+   with writing():
+      Order.objects.bulk_create(orders)
+      backdate(orders, 'placed_at', placed_at)
+      OrderItem.objects.bulk_create(OrderItem(order_id=order_id, product_id=product_id, quantity=quantity, unit_price=prices[product_id]) for order_id, product_id, quantity in lines)
+   return len(ids)
+
+def seed_carts(rng, ids, plan):
+   #Carts take no integer ids; `ids` only numbers them. A tenth are older than the reaper's TTL
+   now = timezone.now()
+   carts, created_at, items = [], [], []
+   for _ in ids:
+      cart = Cart(id=UUID(int=rng.getrandbits(128), version=4))
+      carts.append(cart)
+      created_at.append(ago(rng, now, 60, 1.5))
+      for product in pick_distinct(rng, plan['products'], rng.randint(1, 5), 3):
+         items.append(CartItem(cart_id=cart.id, product_id=plan['first']['products'] + product, quantity=rng.choices([1, 2, 3], [80, 15, 5])[0]))
+   with writing():
+      Cart.objects.bulk_create(carts)
+      backdate(carts, 'created_at', created_at)
+      CartItem.objects.bulk_create(items)
+   return len(ids)
+
+def seed_reviews(rng, ids, plan):
+   """Reviews of mostly popular products, ratings J-shaped (lots of fives, some ones), one in twenty without a rating."""
+   now = timezone.now()
+   reviews, dates = [], []
+   for id in ids:
+      reviews.append(Review(
+         id=id,
+         product_id=plan['first']['products'] + skewed(rng, plan['products'], 3),
+         name=rng.choice(FIRST_NAMES),
+         description=' '.join(rng.choices(ADJECTIVES + NOUNS, k=rng.randint(3, 40))),
+         rating=None if rng.random() < 0.05 else rng.choices([5, 4, 3, 2, 1], [45, 25, 10, 7, 13])[0],
+      ))
+      dates.append(ago(rng, now, 730, 1.5).date())
+   with writing():
+      Review.objects.bulk_create(reviews)
+      backdate(reviews, 'date', dates)
+   return len(ids)
+
+def seed_likes(rng, ids, plan):
+   #`ids` are user numbers: all of a user's likes are made in one chunk, so they never repeat across chunks
+   per_user, extra = divmod(plan['likes'], plan['users'])
+   likes = []
+   for user in ids:
+      for product in pick_distinct(rng, plan['products'], per_user + (user < extra), 3):
+         likes.append(LikedItem(user_id=plan['first']['users'] + user, content_type_id=plan['product_type'], object_id=plan['first']['products'] + product))
+   with writing():
+      LikedItem.objects.bulk_create(likes)
+   return len(likes)
+
+SEEDERS = {
+   'collections': seed_collections, 'promotions': seed_promotions, 'tags': seed_tags, 'users': seed_users, 'customers': seed_customers,
+   'products': seed_products, 'orders': seed_orders, 'carts': seed_carts, 'reviews': seed_reviews, 'likes': seed_likes,
+}
+
+def seed_chunk(task):
+   table, start, stop, plan = task
+   rng = random.Random(f"{plan['seed']}:{table}:{start}")
+   first = plan['first'].get(table, 0)
+   #Likes are chunked by user and carts have no integer ids
+   ids = range(start, stop) if table in ('likes', 'carts') else range(first + start, first + stop)
+   return table, SEEDERS[table](rng, ids, plan)
+
+def chunks(plan, tables, batch_size):
+   for table in tables:
+      #Like the other tables, chunks of likes hold about batch_size rows
+      count = plan['users'] if table == 'likes' else plan[table]
+      step = max(1, batch_size * plan['users'] // max(plan['likes'], 1)) if table == 'likes' else batch_size
+      for start in range(0, count, step):
+         yield table, start, min(start + step, count), plan
+
+def seed(counts, workers=4, batch_size=5000, seed=0, log=None):
+   """
+   Adds `counts` rows (see DATASETS) to each table after the existing ones,
+   with repeatable random data: the same counts and seed give the same rows.
+   Each stage's chunks of batch_size rows are generated and bulk_created in
+   parallel worker processes where they can be forked (see
+   analytics.fork_context), each chunk in its own transaction. On SQLite
+   the workers' writes still take turns; generating the rows is what they
+   share out. Then the totals that bulk writes skip are brought up to date:
+   like counts, sales rollups and membership tiers. Returns the rows added
+   per table and the seconds taken.
+   """
+   plan = {table: counts.get(table, 0) for table in TABLES}
+   for table, referred in REFERS_TO.items():
+      missing = [other for other in referred if plan[table] and not plan[other]]
+      if missing:
+         raise ValueError(f"Seeding {table} needs {' and '.join(missing)} too.")
+   plan['seed'] = seed
+   plan['product_type'] = ContentType.objects.get_for_model(Product).id
+   plan['first'] = {table: (model.objects.aggregate(last=Max('id'))['last'] or 0) + 1 for table, model in MODELS.items()}
+
+   started = time.perf_counter()
+   rows = dict.fromkeys(TABLES, 0)
+   context = analytics.fork_context()
+   if workers > 1 and context:
+      lock = context.Lock() if connections[Product.objects.db].vendor == 'sqlite' else None
+      #Forked workers must not share this process's database connections
+      connections.close_all()
+      executor = ProcessPoolExecutor(workers, mp_context=context, initializer=share_write_lock, initargs=(lock,))
+   else:
+      executor = None
+   try:
+      for tables in STAGES:
+         stage_started = time.perf_counter()
+         tasks = list(chunks(plan, [table for table in tables if plan[table]], batch_size))
+         for table, added in (executor.map(seed_chunk, tasks) if executor else map(seed_chunk, tasks)):
+            rows[table] += added
+         if log and tasks:
+            elapsed = time.perf_counter() - stage_started
+            log(f"seeded {', '.join(f'{rows[table]} {table}' for table in tables if plan[table])} in {elapsed:.1f} s")
+   finally:
+      if executor:
+         executor.shutdown()
+
+   derived_started = time.perf_counter()
+   if plan['likes']:
+      LikeCount.objects.recount()
+   if plan['orders']:
+      analytics.rebuild_sales_rollups(workers=workers)
+      jobs.recompute_memberships(restart=True)
+   if log:
+      log(f'updated like counts, sales rollups and memberships in {time.perf_counter() - derived_started:.1f} s')
+   return {'rows': rows, 'seconds': time.perf_counter() - started}
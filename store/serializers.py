@@ -1,6 +1,30 @@
-from decimal import Decimal
+from datetime import timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.utils import timezone
 from rest_framework import serializers
-from .models import Product, Collection, Review, Cart, CartItem
+from rest_framework.exceptions import NotFound
+from likes.models import LikedItem
+from tags.models import TaggedItem
+from . import cache, pricing
+from .models import Product, Collection, Review, Cart, CartItem, Customer, Order, OrderItem
+
+TAX_RATE = Decimal('1.1')
+CENT = Decimal('0.01')
+
+class PrefixedHyperlinkedRelatedField(serializers.HyperlinkedRelatedField):
+   #Reverses the URL once per serializer instead of once per row: with many=True
+   #the same field instance renders every row of the page.
+   placeholder = '__pk__'
+
+   def get_url(self, obj, view_name, request, format):
+      if format or self.lookup_field != 'pk':
+         return super().get_url(obj, view_name, request, format)
+      template = getattr(self, '_url_template', None)
+      if template is None:
+         template = self._url_template = self.reverse(view_name, kwargs={self.lookup_url_kwarg: self.placeholder}, request=request)
+      head, _, tail = template.rpartition(self.placeholder)
+      return f'{head}{obj.pk}{tail}'
 
 class CollectionSerializer(serializers.ModelSerializer):
    class Meta:
@@ -9,41 +33,103 @@ class CollectionSerializer(serializers.ModelSerializer):
 
    products_count = serializers.IntegerField(read_only=True)
 
+class ProductListSerializer(serializers.ListSerializer):
+   def to_representation(self, data):
+      #The ?include= extras of the whole page are loaded before any row is rendered
+      products = list(data.all() if hasattr(data, 'all') else data)
+      self.child.load_includes(products)
+      return super().to_representation(products)
+
 class ProductSerializer(serializers.ModelSerializer):
    class Meta:
       model = Product
-      fields = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'price_with_tax', 'collection']
+      fields = ['id', 'title', 'description', 'slug', 'inventory', 'unit_price', 'effective_price', 'price_with_tax', 'collection', 'reviews_count', 'ratings_count', 'average_rating', 'last_reviewed_on', 'tags', 'likes_count']
+      list_serializer_class = ProductListSerializer
+
+   #Optional fields, rendered only when named in ?include=, and how to load them for many products at once
+   INCLUDES = {
+      'tags': TaggedItem.objects.labels_for,
+      'likes_count': LikedItem.objects.counts_for,
+   }
+
+   def __init__(self, *args, **kwargs):
+      super().__init__(*args, **kwargs)
+      request = self.context.get('request')
+      include = request.query_params.get('include', '').split(',') if request else []
+      for name in self.INCLUDES:
+         if name not in include:
+            self.fields.pop(name)
+      self.included = {}
   
    unit_price = serializers.DecimalField(max_digits=6, decimal_places=2, source='price')
+   effective_price = serializers.DecimalField(max_digits=6, decimal_places=2, read_only=True)
+   average_rating = serializers.SerializerMethodField()
+   tags = serializers.SerializerMethodField()
+   likes_count = serializers.SerializerMethodField()
    price_with_tax = serializers.SerializerMethodField(method_name='calculate_tax')
-   collection = serializers.HyperlinkedRelatedField(
+   collection = PrefixedHyperlinkedRelatedField(
       queryset = Collection.objects.all(),
-      view_name = 'collection-detail'
+      view_name = 'collection-detail',
+      style = {'base_template': 'input.html'} #don't load every collection to render the browsable API form
    )
 
    def calculate_tax(self, product: Product):
-      return product.price * Decimal(1.1)
+      #On the price customers are charged, promotions included
+      return (product.effective_price * TAX_RATE).quantize(CENT, ROUND_HALF_UP)
+
+   def update(self, product, validated_data):
+      edited_price = 'price' in validated_data and validated_data['price'] != product.price
+      product = super().update(product, validated_data)
+      if edited_price:
+         pricing.reprice_edited(product)
+      return product
+
+   def get_average_rating(self, product: Product):
+      return round(product.average_rating, 2) if product.ratings_count else None
+
+   def load_includes(self, products):
+      for name, load in self.INCLUDES.items():
+         if name in self.fields:
+            self.included[name] = load(products)
+
+   def get_included(self, name, product):
+      if product not in self.included.get(name, {}):
+         self.load_includes([product])
+      return self.included[name][product]
+
+   def get_tags(self, product: Product):
+      return self.get_included('tags', product)
+
+   def get_likes_count(self, product: Product):
+      return self.get_included('likes_count', product)
 
 class ReviewSerializer(serializers.ModelSerializer):
    class Meta:
       model = Review
-      fields = ['id', 'date', 'name', 'description', 'product']
+      fields = ['id', 'date', 'name', 'description', 'rating', 'product']
    
    def create(self, validated_data):
       product_id = self.context['product_id']
       return Review.objects.create(product_id=product_id, **validated_data)
 
+class TagSerializer(serializers.Serializer):
+   id = serializers.IntegerField(source='tag_id')
+   label = serializers.CharField()
+   products_count = serializers.IntegerField()
+
 class SimpleProductSerializer(serializers.ModelSerializer):
    class Meta:
       model = Product
-      fields = ['id', 'title', 'price']
+      fields = ['id', 'title', 'price', 'effective_price']
 
 class CartItemSerializer(serializers.ModelSerializer):
    product = SimpleProductSerializer()
    total_price = serializers.SerializerMethodField()
 
    def get_total_price(self, cart_item:CartItem):
-      return cart_item.quantity * cart_item.product.price
+      if hasattr(cart_item, 'total_price'):
+         return cart_item.total_price
+      return cart_item.quantity * cart_item.product.effective_price
 
    class Meta:
       model = CartItem
@@ -55,45 +141,145 @@ class CartSerializer(serializers.ModelSerializer):
    total_price = serializers.SerializerMethodField()
 
    def get_total_price(self, cart):
-      return sum([item.quantity * item.product.unit_price for item in cart.items.all()])
+      #Carts coming from CartViewSet are annotated; a freshly created one isn't
+      if not hasattr(cart, 'total_price'):
+         cart = Cart.objects.with_total_price().get(pk=cart.pk)
+      return cart.total_price
 
    class Meta:
       model = Cart
       fields = ['id', 'items', 'total_price']
 
+def add_cart_items(cart_id, items):
+   quantities = {}
+   for item in items:
+      quantities[item['product_id']] = quantities.get(item['product_id'], 0) + item['quantity']
+   with transaction.atomic():
+      cart_items = CartItem.objects.add_items(cart_id, list(quantities.items()))
+      if not cart_items and not Cart.objects.filter(pk=cart_id).exists():
+         raise NotFound('No cart with the given ID was found.')
+      missing = quantities.keys() - {cart_item.product_id for cart_item in cart_items}
+      if missing:
+         raise serializers.ValidationError({'product_id': [f'No product with the given ID was found: {product_id}.' for product_id in sorted(missing)]})
+   position = {product_id: index for index, product_id in enumerate(quantities)}
+   return sorted(cart_items, key=lambda cart_item: position[cart_item.product_id])
+
+class AddCartItemListSerializer(serializers.ListSerializer):
+   def save(self, **kwargs):
+      self.instance = add_cart_items(self.context['cart_id'], self.validated_data)
+      return self.instance
+
 class AddCartItemSerializer(serializers.ModelSerializer):
    product_id = serializers.IntegerField()
 
-   def validate_product_id(self, value):
-      if not Product.objects.filter(pk=value).exists():
-         raise serializers.ValidationError('No product with the given ID was found.')
-      return value
-
    def save(self, **kwargs):
-      cart_id = self.context['cart_id']
-      product_id = self._validated_data['product_id']
-      quantity = self.validated_data['quantity']
-
-      try:
-         #Update an existing item
-         cart_item = CartItem.objects.get(cart_id=cart_id, product_id=product_id)
-         cart_item.quantity += quantity
-         cart_item.save()
-         self.instance = cart_item
-      except CartItem.DoesNotExist:
-         #Create a new item
-         self.instance = CartItem.objects.create(cart_id=cart_id, **self.validated_data)
+      #Single upsert: no existence check, no read-modify-write race on quantity
+      self.instance = add_cart_items(self.context['cart_id'], [self.validated_data])[0]
       return self.instance
 
    class Meta:
       model = CartItem
       fields = ['id', 'product_id', 'quantity']
+      list_serializer_class = AddCartItemListSerializer
 
 class UpdateCartItemSerializer(serializers.ModelSerializer):
    class Meta:
       model = CartItem
       fields = ['quantity']
 
+class OrderItemSerializer(serializers.ModelSerializer):
+   product = SimpleProductSerializer()
+
+   class Meta:
+      model = OrderItem
+      fields = ['id', 'product', 'quantity', 'unit_price']
+
+class OrderSerializer(serializers.ModelSerializer):
+   items = OrderItemSerializer(many=True, read_only=True)
+   total_price = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+
+   class Meta:
+      model = Order
+      fields = ['id', 'customer', 'placed_at', 'payment_status', 'total_price', 'items']
+
+class CustomerSerializer(serializers.ModelSerializer):
+   summary = serializers.SerializerMethodField()
+
+   class Meta:
+      model = Customer
+      fields = ['id', 'first_name', 'last_name', 'email', 'phone', 'birth_date', 'membership', 'summary']
+
+   def get_summary(self, customer: Customer):
+      return cache.get_customer_summary(customer.pk, customer.order_summary)
+
+def place_order(cart_id, customer_id):
+   with transaction.atomic():
+      #Writing first takes SQLite's write lock up front, so the cart, prices and
+      #stock read below can't change before the order commits
+      order = Order.objects.create(customer_id=customer_id)
+      cart_items = list(CartItem.objects.filter(cart_id=cart_id).values_list(
+         'product_id', 'quantity', 'product__effective_price', 'product__inventory', 'product__collection_id'
+      ))
+      if not cart_items:
+         raise serializers.ValidationError({'cart_id': ['The cart is empty.']})
+      out_of_stock = [product_id for product_id, quantity, _, inventory, _ in cart_items if inventory < quantity]
+      if out_of_stock:
+         raise serializers.ValidationError({'items': [f'Not enough inventory for product: {product_id}.' for product_id in out_of_stock]})
+
+      #Conditional decrements: the inventory guard is what stops an oversell on
+      #databases that don't serialize writers like SQLite does
+      product_ids = [item[0] for item in cart_items]
+      if Product.objects.take_inventory([(product_id, quantity) for product_id, quantity, _, _, _ in cart_items]) != len(cart_items):
+         raise serializers.ValidationError({'items': ['Not enough inventory.']})
+
+      OrderItem.objects.bulk_create(
+         OrderItem(order=order, product_id=product_id, quantity=quantity, unit_price=price)
+         for product_id, quantity, price, _, _ in cart_items
+      )
+      Cart.objects.filter(pk=cart_id).delete()
+   #Inventory changed in SQL, which sends no signals
+   cache.invalidate_products(product_ids, {item[4] for item in cart_items})
+   return order
+
+class CreateOrderSerializer(serializers.Serializer):
+   cart_id = serializers.UUIDField()
+   customer_id = serializers.IntegerField()
+
+   def validate_cart_id(self, cart_id):
+      if not Cart.objects.filter(pk=cart_id).exists():
+         raise serializers.ValidationError('No cart with the given ID was found.')
+      return cart_id
+
+   def validate_customer_id(self, customer_id):
+      customers = Customer.objects.filter(pk=customer_id)
+      user = self.context['request'].user
+      if not user.is_staff:
+         customers = customers.filter(email=user.email)
+      if not customers.exists():
+         raise serializers.ValidationError('No customer with the given ID was found.')
+      return customer_id
+
+   def save(self, **kwargs):
+      self.instance = place_order(**self.validated_data)
+      return self.instance
+
+class SalesPeriodSerializer(serializers.Serializer):
+   #Query parameters of the analytics endpoints; the period defaults to the last 30 days
+   start = serializers.DateField(required=False)
+   end = serializers.DateField(required=False)
 
+   def validate(self, data):
+      data.setdefault('end', timezone.localdate())
+      data.setdefault('start', data['end'] - timedelta(days=29))
+      if data['start'] > data['end']:
+         raise serializers.ValidationError({'start': ['Must not be after end.']})
+      return data
 
+class TopSellersQuerySerializer(SalesPeriodSerializer):
+   by = serializers.ChoiceField(['product', 'collection'], default='product')
+   metric = serializers.ChoiceField(['revenue', 'units'], default='revenue')
+   limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
 
+class SalesSeriesQuerySerializer(SalesPeriodSerializer):
+   product_id = serializers.IntegerField(required=False)
+   collection_id = serializers.IntegerField(required=False)
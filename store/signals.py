@@ -0,0 +1,124 @@
+from django.apps import apps as global_apps
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_migrate, pre_delete, pre_save, post_save, post_delete
+from django.dispatch import receiver
+
+from likes.counters import counts_flushed
+from tags.models import Tag, TaggedItem
+from . import analytics, cache, pricing, triggers
+from .models import Product, Collection, Order, OrderItem, Promotion, Review
+
+@receiver(pre_save, sender=Product)
+def remember_previous_collection(sender, instance, **kwargs):
+   instance._previous_collection_id = None
+   if instance.pk is not None:
+      instance._previous_collection_id = Product.objects.filter(pk=instance.pk).values_list('collection_id', flat=True).first()
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product(sender, instance, **kwargs):
+   cache.invalidate_products([instance.pk], [instance.collection_id, getattr(instance, '_previous_collection_id', None)])
+
+@receiver(post_save, sender=Collection)
+@receiver(post_delete, sender=Collection)
+def invalidate_collection(sender, instance, **kwargs):
+   cache.invalidate_collections([instance.pk])
+
+#The triggers on store_review change the product's review statistics without a
+#Product save
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_reviewed_product(sender, instance, **kwargs):
+   invalidate_product_ids([instance.product_id])
+
+#Product responses rendered with ?include=tags,likes_count embed these. Like
+#counts change once per flush of the like counter, not once per like.
+@receiver(post_save, sender=TaggedItem)
+@receiver(post_delete, sender=TaggedItem)
+def invalidate_tagged_product(sender, instance, **kwargs):
+   if instance.content_type_id == ContentType.objects.get_for_model(Product).id:
+      invalidate_product_ids([instance.object_id])
+
+@receiver(post_save, sender=Tag)
+def invalidate_relabeled_tag_products(sender, instance, created, **kwargs):
+   if not created:
+      tagged = TaggedItem.objects.filter(tag=instance, content_type=ContentType.objects.get_for_model(Product))
+      invalidate_product_ids(list(tagged.values_list('object_id', flat=True)))
+
+@receiver(counts_flushed)
+def invalidate_liked_products(sender, objects, **kwargs):
+   content_type_id = ContentType.objects.get_for_model(Product).id
+   invalidate_product_ids([object_id for object_content_type_id, object_id in objects if object_content_type_id == content_type_id])
+
+def invalidate_product_ids(product_ids):
+   if product_ids:
+      cache.invalidate_products(product_ids, Product.objects.filter(pk__in=product_ids).values_list('collection_id', flat=True))
+
+#Summaries are dropped once the change commits, so a read racing the transaction
+#can't cache the old totals again. Orders and items written with update() or
+#bulk_create() send no signals and have to invalidate themselves.
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_customer_summary(sender, instance, created=False, update_fields=None, **kwargs):
+   if update_fields is not None and not created and 'payment_status' not in update_fields:
+      return
+   transaction.on_commit(lambda: cache.invalidate_customers([instance.customer_id]))
+
+#The sales rollups only count orders whose payment is complete
+@receiver(pre_save, sender=Order)
+def remember_previous_payment_status(sender, instance, update_fields=None, **kwargs):
+   instance._previous_payment_status = None
+   if instance.pk is not None and (update_fields is None or 'payment_status' in update_fields):
+      instance._previous_payment_status = Order.objects.filter(pk=instance.pk).values_list('payment_status', flat=True).first()
+
+@receiver(post_save, sender=Order)
+def recount_order_sales(sender, instance, **kwargs):
+   previous = getattr(instance, '_previous_payment_status', None)
+   if previous is not None and (previous == Order.COMPLETE) != (instance.payment_status == Order.COMPLETE):
+      analytics.apply_payment_change(instance.pk, 1 if instance.payment_status == Order.COMPLETE else -1)
+
+@receiver(post_save, sender=OrderItem)
+@receiver(post_delete, sender=OrderItem)
+def invalidate_order_customer_summary(sender, instance, **kwargs):
+   customer_id = Order.objects.filter(pk=instance.order_id).values_list('customer_id', flat=True).first()
+   transaction.on_commit(lambda: cache.invalidate_customers([customer_id]))
+
+#effective_price changes behind the products' backs when their promotion links,
+#or the promotions themselves, change
+@receiver(m2m_changed, sender=Product.promotions.through)
+def reprice_linked_products(sender, instance, action, reverse, pk_set, **kwargs):
+   if action == 'pre_clear' and reverse:
+      instance._cleared_product_ids = list(instance.product_set.values_list('id', flat=True))
+   if action not in ('post_add', 'post_remove', 'post_clear'):
+      return
+   if not reverse:
+      product_ids = [instance.pk]
+   elif action == 'post_clear':
+      product_ids = getattr(instance, '_cleared_product_ids', [])
+   else:
+      product_ids = pk_set
+   reprice(product_ids)
+
+@receiver(post_save, sender=Promotion)
+def reprice_promotion_products(sender, instance, created, **kwargs):
+   if not created:
+      reprice(instance.product_set.values_list('id', flat=True))
+
+@receiver(pre_delete, sender=Promotion)
+def remember_promotion_products(sender, instance, **kwargs):
+   instance._product_ids = list(instance.product_set.values_list('id', flat=True))
+
+@receiver(post_delete, sender=Promotion)
+def reprice_deleted_promotion_products(sender, instance, **kwargs):
+   reprice(getattr(instance, '_product_ids', []))
+
+def reprice(product_ids):
+   changed = pricing.reprice(product_ids)
+   if changed:
+      cache.invalidate_products([id for id, _ in changed], [collection_id for _, collection_id in changed])
+
+@receiver(post_migrate)
+def restore_product_triggers(sender, using, apps=global_apps, **kwargs):
+   if sender.name == 'store':
+      triggers.restore_product_triggers(apps, connections[using])
@@ -0,0 +1,46 @@
+from itertools import islice
+from django.http import StreamingHttpResponse
+from rest_framework.utils import encoders
+
+TRUE_VALUES = {'1', 'true', 'yes', 'on'}
+
+def wants_stream(params, name='stream'):
+   return params.get(name, '').lower() in TRUE_VALUES
+
+def stream_json_list(rows, to_representation, chunk_size=2000):
+   """
+   Yields a JSON array of `rows` one chunk at a time. A queryset is read with
+   .iterator(chunk_size) so neither the model instances nor the serialized
+   rows of the whole list are held in memory at once. to_representation is
+   given a chunk of rows and returns their representations, so a list
+   serializer can load whatever the chunk needs in one go.
+   """
+   if hasattr(rows, 'iterator'):
+      rows = rows.iterator(chunk_size=chunk_size)
+   encoder = encoders.JSONEncoder(ensure_ascii=False, separators=(',', ':'))
+   rows = iter(rows)
+   text = None
+   while chunk := list(islice(rows, chunk_size)):
+      if text is not None:
+         yield text
+      text = ('[' if text is None else ',') + ','.join(encoder.encode(row) for row in to_representation(chunk))
+   yield (text or '[') + ']'
+
+class StreamingListMixin:
+   """
+   Adds ?stream=true to a list endpoint: the filtered queryset is serialized
+   row by row into a StreamingHttpResponse instead of being paginated (or
+   rendered whole). The response is never cached.
+   """
+   stream_query_param = 'stream'
+   stream_chunk_size = 2000
+
+   def list(self, request, *args, **kwargs):
+      if not wants_stream(request.query_params, self.stream_query_param):
+         return super().list(request, *args, **kwargs)
+      queryset = self.filter_queryset(self.get_queryset())
+      serializer = self.get_serializer(many=True)
+      return StreamingHttpResponse(
+         stream_json_list(queryset, serializer.to_representation, self.stream_chunk_size),
+         content_type='application/json',
+      )
@@ -1,3 +1,1502 @@
-from django.test import TestCase
+import json
+import random
+import re
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+from urllib.parse import parse_qsl, urlsplit
+from uuid import uuid4
+from django.contrib.admin.sites import site
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import IntegrityError, connection
+from django.db.models import Sum
+from django.test import AsyncClient, Client, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
 
-# Create your tests here.
+from core.models import User
+from core.routers import routing
+from likes.models import LikeCount, LikedItem
+from tags.models import Tag, TaggedItem
+from . import analytics, cache, jobs, seeding
+from .catalog import CatalogImporter, export_rows, read_rows
+from .models import Cart, CartItem, Collection, Customer, DailyCollectionSales, DailyProductSales, Order, OrderItem, Product, Promotion, Review, SalesLeaderboard, Watermark
+from .filters import ProductFilter
+from .search import FullTextSearchFilter
+
+def create_product(collection, **kwargs):
+   values = {'title': 'Product', 'slug': 'product', 'price': 10, 'inventory': 20, 'collection': collection}
+   values.update(kwargs)
+   return Product.objects.create(**values)
+
+class ProductCacheTests(TestCase):
+   def setUp(self):
+      cache.get_cache().clear()
+      self.client = APIClient()
+      self.collection = Collection.objects.create(title='Beauty')
+      self.product = create_product(self.collection)
+
+   def test_list_is_served_from_cache(self):
+      first = self.client.get('/store/products/')
+      second = self.client.get('/store/products/')
+
+      self.assertEqual(first['X-Cache'], 'MISS')
+      self.assertEqual(second['X-Cache'], 'HIT')
+      self.assertEqual(first.json(), second.json())
+      self.assertEqual(cache.stats()['hits'], 1)
+      self.assertEqual(cache.stats()['misses'], 1)
+
+   def test_query_parameters_are_part_of_the_key(self):
+      self.client.get('/store/products/')
+      response = self.client.get('/store/products/', {'ordering': 'price'})
+
+      self.assertEqual(response['X-Cache'], 'MISS')
+
+   def test_saving_a_product_invalidates_list_and_detail(self):
+      self.client.get('/store/products/')
+      self.client.get(f'/store/products/{self.product.id}/')
+
+      self.product.title = 'Renamed'
+      self.product.save()
+
+      list_response = self.client.get('/store/products/')
+      detail_response = self.client.get(f'/store/products/{self.product.id}/')
+      self.assertEqual(list_response['X-Cache'], 'MISS')
+      self.assertEqual(detail_response['X-Cache'], 'MISS')
+      self.assertEqual(detail_response.json()['title'], 'Renamed')
+
+   def test_moving_a_product_invalidates_both_collections(self):
+      other = Collection.objects.create(title='Toys')
+      self.client.get('/store/products/', {'collection_id': self.collection.id})
+
+      self.product.collection = other
+      self.product.save()
+
+      response = self.client.get('/store/products/', {'collection_id': self.collection.id})
+      self.assertEqual(response['X-Cache'], 'MISS')
+      self.assertEqual(response.json()['results'], [])
+
+   def test_importing_a_move_invalidates_both_collections(self):
+      self.client.get('/store/products/', {'collection_id': self.collection.id})
+
+      row = {'id': self.product.id, 'title': 'Moved', 'price': '10', 'inventory': 1, 'collection': 'Toys'}
+      CatalogImporter().run(read_rows([json.dumps(row)], 'ndjson'))
+
+      response = self.client.get('/store/products/', {'collection_id': self.collection.id})
+      self.assertEqual(response['X-Cache'], 'MISS')
+      self.assertEqual(response.json()['results'], [])
+
+   def test_clear_inventory_invalidates_updated_products(self):
+      self.client.get(f'/store/products/{self.product.id}/')
+
+      model_admin = site._registry[Product]
+      with mock.patch.object(model_admin, 'message_user'):
+         model_admin.clear_inventory(None, Product.objects.filter(pk=self.product.pk))
+
+      response = self.client.get(f'/store/products/{self.product.id}/')
+      self.assertEqual(response['X-Cache'], 'MISS')
+      self.assertEqual(response.json()['inventory'], 0)
+
+   @override_settings(STORE_CACHE_ENABLED=False)
+   def test_cache_can_be_disabled(self):
+      self.client.get('/store/products/')
+      response = self.client.get('/store/products/')
+
+      self.assertNotIn('X-Cache', response)
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': tempfile.mkdtemp()}})
+class FileBasedProductCacheTests(ProductCacheTests):
+   pass
+
+class KeysetPaginationTests(TestCase):
+   def setUp(self):
+      cache.get_cache().clear()
+      self.client = APIClient()
+      self.collection = Collection.objects.create(title='Beauty')
+      for i in range(25):
+         create_product(self.collection, title=f'Product {i:02}', price=10 + i % 4)
+
+   def walk(self, params):
+      ids, url, pages = [], '/store/products/', 0
+      response = self.client.get(url, params)
+      while True:
+         body = response.json()
+         ids += [product['id'] for product in body['results']]
+         pages += 1
+         if body['next'] is None:
+            return ids, pages, body
+         response = self.client.get(body['next'])
+
+   def test_pages_follow_ordering_with_id_tiebreaker(self):
+      ids, pages, _ = self.walk({'ordering': 'price', 'page_size': 4})
+
+      expected = list(Product.objects.order_by('price', 'id').values_list('id', flat=True))
+      self.assertEqual(ids, expected)
+      self.assertEqual(pages, 7)
+
+   def test_descending_ordering(self):
+      ids, _, _ = self.walk({'ordering': '-price', 'page_size': 6})
+
+      expected = list(Product.objects.order_by('-price', '-id').values_list('id', flat=True))
+      self.assertEqual(ids, expected)
+
+   def test_default_ordering_is_model_ordering(self):
+      ids, _, _ = self.walk({})
+
+      expected = list(Product.objects.order_by('title', 'id').values_list('id', flat=True))
+      self.assertEqual(ids, expected)
+
+   def test_previous_link_returns_the_previous_page(self):
+      first = self.client.get('/store/products/', {'ordering': 'last_update', 'page_size': 5}).json()
+      second = self.client.get(first['next']).json()
+      back = self.client.get(second['previous']).json()
+
+      self.assertIsNone(first['previous'])
+      self.assertEqual(back['results'], first['results'])
+
+   def test_invalid_cursor(self):
+      response = self.client.get('/store/products/', {'cursor': 'garbage'})
+
+      self.assertEqual(response.status_code, 404)
+
+   def test_reviews_and_cart_items_are_paginated(self):
+      product = Product.objects.first()
+      for i in range(12):
+         Review.objects.create(product=product, name=f'Reviewer {i}', description='Nice')
+      cart = Cart.objects.create()
+      for item_product in Product.objects.all()[:11]:
+         CartItem.objects.create(cart=cart, product=item_product, quantity=1)
+
+      reviews = self.client.get(f'/store/products/{product.id}/reviews/').json()
+      items = self.client.get(f'/store/carts/{cart.id}/items/').json()
+
+      self.assertEqual(len(reviews['results']), 10)
+      self.assertIsNotNone(reviews['next'])
+      self.assertEqual(len(items['results']), 10)
+      self.assertIsNotNone(items['next'])
+
+@override_settings(STORE_CACHE_ENABLED=False)
+class QueryPlanTests(TestCase):
+   """
+   Runs EXPLAIN QUERY PLAN on every query the list endpoints issue, first
+   page and next page, for each supported filter and ordering. A full scan
+   of a large table, or a temp B-tree to sort it, fails the test: either is
+   fine on a test database and seconds long on a real catalog.
+   """
+   SMALL_TABLES = {'store_collection', 'store_promotion'}
+   ORDERINGS = [None, 'title', '-title', 'price', '-price', 'effective_price', '-effective_price', 'last_update', '-last_update', 'reviews_count', '-reviews_count', 'average_rating', '-average_rating']
+
+   def setUp(self):
+      self.client = APIClient()
+      self.collection = Collection.objects.create(title='Kitchen')
+      tags = [Tag.objects.create(label=label) for label in ['sale', 'red', 'blue', 'green']]
+      for i in range(6):
+         product = create_product(self.collection, title=f'Product {i}', price=5 + i, inventory=i)
+         Review.objects.create(product=product, name='Ana', description='Fine', rating=1 + i % 5)
+         TaggedItem.objects.create(tag=tags[0], content_object=product)
+         TaggedItem.objects.create(tag=tags[1 + i % 3], content_object=product)
+
+   def plan_problems(self, path, params, bounded_sort=False):
+      with CaptureQueriesContext(connection) as queries:
+         response = self.client.get(path, {**params, 'page_size': 2})
+         self.assertEqual(response.status_code, 200, response.content)
+         self.assertIsNotNone(response.json()['next'])
+         self.client.get(response.json()['next'])
+      problems = []
+      with connection.cursor() as cursor:
+         for query in queries:
+            if not query['sql'].startswith('SELECT'):
+               continue
+            for *_, detail in cursor.execute(f"EXPLAIN QUERY PLAN {query['sql']}").fetchall():
+               scanned = re.fullmatch(r'SCAN (\w+)', detail)
+               if ('TEMP B-TREE' in detail and not bounded_sort) or (scanned and scanned[1] not in self.SMALL_TABLES):
+                  problems.append((detail, query['sql']))
+      return problems
+
+   def test_product_list(self):
+      filters = [
+         {}, {'collection_id': self.collection.id}, {'price__gt': 6}, {'price__lt': 9},
+         {'effective_price__lt': 9}, {'inventory__gt': 1}, {'inventory__lt': 5},
+         {'reviews_count__gt': 0}, {'average_rating__gt': 1},
+         {'tag': 'sale'}, {'tag': 'red,blue'}, {'tag': ['sale', 'red,blue']},
+      ]
+      #As if every tag was too popular to sort its products
+      self.enterContext(mock.patch.object(ProductFilter, 'max_sorted_tag_matches', 0))
+      for filter in filters:
+         for ordering in self.ORDERINGS:
+            params = {**filter, 'ordering': ordering} if ordering else filter
+            with self.subTest(**params):
+               self.assertEqual(self.plan_problems('/store/products/', params), [])
+
+   def test_range_off_the_sort_column_still_filters(self):
+      response = self.client.get('/store/products/', {'price__gt': 7, 'inventory__lt': 5, 'ordering': '-last_update'})
+      self.assertEqual(sorted(product['title'] for product in response.json()['results']), ['Product 3', 'Product 4'])
+
+   def test_rare_tags_sort_only_their_products(self):
+      for params in [{'tag': 'red,blue'}, {'tag': ['sale', 'red,blue'], 'ordering': '-price'}]:
+         with self.subTest(**params):
+            self.assertEqual(self.plan_problems('/store/products/', params, bounded_sort=True), [])
+
+   def test_tags(self):
+      for ordering in ['products_count', '-products_count']:
+         with self.subTest(ordering=ordering):
+            self.assertEqual(self.plan_problems('/tags/', {'ordering': ordering}), [])
+      #Sorts the tag vocabulary, never the tagged items
+      self.assertEqual(self.plan_problems('/tags/', {'ordering': 'label'}, bounded_sort=True), [])
+
+   def test_reviews(self):
+      product = Product.objects.first()
+      for i in range(4):
+         Review.objects.create(product=product, name='Ana', description='Fine')
+      self.assertEqual(self.plan_problems(f'/store/products/{product.id}/reviews/', {}), [])
+
+   def test_customer_orders(self):
+      self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+      customer = Customer.objects.create(first_name='Ana', last_name='Lima', email='ana@example.com', phone='1')
+      product = Product.objects.first()
+      for _ in range(3):
+         order = Order.objects.create(customer=customer)
+         OrderItem.objects.create(order=order, product=product, quantity=1, unit_price=1)
+      self.assertEqual(self.plan_problems(f'/store/customers/{customer.id}/orders/', {}), [])
+
+class FullTextSearchTests(TestCase):
+   def setUp(self):
+      cache.get_cache().clear()
+      self.client = APIClient()
+      collection = Collection.objects.create(title='Furniture')
+      self.chair = create_product(collection, title='Wooden chair', description='A sturdy chair')
+      self.table = create_product(collection, title='Oak table', description='Pairs with any chair')
+      self.lamp = create_product(collection, title='Desk lamp', description=None)
+
+   def search(self, **params):
+      return [product['id'] for product in self.client.get('/store/products/', params).json()['results']]
+
+   def test_results_are_ranked(self):
+      self.assertEqual(self.search(search='chair'), [self.chair.id, self.table.id])
+
+   def test_prefix_matching(self):
+      self.assertEqual(self.search(search='woo cha'), [self.chair.id])
+
+   def test_explicit_ordering_overrides_rank(self):
+      self.chair.price = 50
+      self.chair.save()
+
+      self.assertEqual(self.search(search='chair', ordering='price'), [self.table.id, self.chair.id])
+
+   def test_index_follows_updates_and_deletes(self):
+      self.lamp.title = 'Floor lamp'
+      self.lamp.save()
+      self.table.delete()
+
+      self.assertEqual(self.search(search='floor'), [self.lamp.id])
+      self.assertEqual(self.search(search='oak'), [])
+
+   def test_tag_labels_are_matched_on_request(self):
+      tag = Tag.objects.create(label='Outdoor')
+      TaggedItem.objects.create(tag=tag, content_type=ContentType.objects.get_for_model(Product), object_id=self.lamp.id)
+
+      self.assertEqual(self.search(search='outdoor'), [])
+      self.assertEqual(self.search(search='outdoor', search_tags='true'), [self.lamp.id])
+
+   def test_ranked_results_are_paginated(self):
+      for i in range(5):
+         create_product(self.chair.collection, title=f'Chair {i}')
+
+      first = self.client.get('/store/products/', {'search': 'chair', 'page_size': 4}).json()
+      second = self.client.get(first['next']).json()
+
+      ids = [product['id'] for product in first['results'] + second['results']]
+      self.assertEqual(len(ids), 7)
+      self.assertEqual(len(set(ids)), 7)
+      self.assertIsNone(second['next'])
+
+   def test_broad_searches_are_returned_in_index_order(self):
+      for i in range(5):
+         create_product(self.chair.collection, title=f'Chair {i}')
+
+      with mock.patch.object(FullTextSearchFilter, 'max_ranked_matches', 3):
+         first = self.client.get('/store/products/', {'search': 'chair', 'page_size': 4}).json()
+         second = self.client.get(first['next']).json()
+
+      ids = [product['id'] for product in first['results'] + second['results']]
+      self.assertEqual(ids, sorted(ids))
+      self.assertEqual(len(ids), 7)
+
+   def test_search_syntax_is_not_interpreted(self):
+      response = self.client.get('/store/products/', {'search': 'chair" OR "lamp'})
+
+      self.assertEqual(response.status_code, 200)
+
+@override_settings(STORE_CACHE_ENABLED=False)
+class ProductSerializationTests(TestCase):
+   @classmethod
+   def setUpTestData(cls):
+      cls.collection = Collection.objects.create(title='Bulk')
+      Product.objects.bulk_create(
+         Product(title=f'Product {i}', slug=f'product-{i}', price='12.35', inventory=5, collection=cls.collection)
+         for i in range(1000)
+      )
+
+   def test_a_page_of_1000_products_takes_one_query(self):
+      client = APIClient()
+
+      with self.assertNumQueries(1):
+         response = client.get('/store/products/', {'page_size': 1000})
+
+      self.assertEqual(len(response.json()['results']), 1000)
+
+   def test_collection_url_and_tax(self):
+      product = APIClient().get('/store/products/', {'page_size': 1}).json()['results'][0]
+
+      self.assertEqual(product['collection'], f'http://testserver/store/collections/{self.collection.id}/')
+      self.assertEqual(product['price_with_tax'], 13.59)
+
+@override_settings(STORE_CACHE_ENABLED=False)
+class ProductIncludeTests(TestCase):
+   def setUp(self):
+      self.client = APIClient()
+      collection = Collection.objects.create(title='Kitchen')
+      self.products = [create_product(collection, title=f'Product {i}') for i in range(5)]
+      content_type = ContentType.objects.get_for_model(Product)
+      sale, steel = Tag.objects.create(label='sale'), Tag.objects.create(label='steel')
+      TaggedItem.objects.bulk_create([
+         TaggedItem(tag=steel, content_type=content_type, object_id=self.products[0].id),
+         TaggedItem(tag=sale, content_type=content_type, object_id=self.products[0].id),
+         TaggedItem(tag=sale, content_type=content_type, object_id=self.products[1].id),
+      ])
+      users = [User.objects.create_user(f'user{i}', f'user{i}@example.com', 'secret') for i in range(2)]
+      LikedItem.objects.bulk_create(LikedItem(user=user, content_type=content_type, object_id=self.products[0].id) for user in users)
+      LikeCount.objects.recount()
+
+   def test_fields_are_left_out_unless_included(self):
+      product = self.client.get('/store/products/').json()['results'][0]
+      self.assertNotIn('tags', product)
+      self.assertNotIn('likes_count', product)
+
+   def test_included_fields(self):
+      results = self.client.get('/store/products/', {'include': 'tags,likes_count'}).json()['results']
+      self.assertEqual([(product['tags'], product['likes_count']) for product in results], [
+         (['sale', 'steel'], 2), (['sale'], 0), ([], 0), ([], 0), ([], 0),
+      ])
+      product = self.client.get(f'/store/products/{self.products[0].id}/', {'include': 'tags'}).json()
+      self.assertEqual(product['tags'], ['sale', 'steel'])
+      self.assertNotIn('likes_count', product)
+
+   def test_one_query_per_include_whatever_the_page_size(self):
+      for page_size in [1, 5]:
+         with self.assertNumQueries(3):
+            self.client.get('/store/products/', {'include': 'tags,likes_count', 'page_size': page_size})
+
+   def test_streamed_rows_load_includes_per_chunk(self):
+      with self.assertNumQueries(3):
+         response = self.client.get('/store/products/', {'include': 'tags,likes_count', 'stream': 'true'})
+         rows = json.loads(b''.join(response.streaming_content))
+      self.assertEqual(rows[0]['tags'], ['sale', 'steel'])
+      self.assertEqual(rows[0]['likes_count'], 2)
+
+   @override_settings(STORE_CACHE_ENABLED=True, LIKES_FLUSH_INTERVAL=0)
+   def test_flushed_likes_invalidate_the_product_responses(self):
+      cache.get_cache().clear()
+      product = self.products[1]
+      self.client.get(f'/store/products/{product.id}/', {'include': 'likes_count'})
+      with self.captureOnCommitCallbacks(execute=True):
+         LikedItem.objects.like(User.objects.get(username='user0'), product)
+      response = self.client.get(f'/store/products/{product.id}/', {'include': 'likes_count'})
+      self.assertEqual(response['X-Cache'], 'MISS')
+      self.assertEqual(response.json()['likes_count'], 1)
+
+@override_settings(STORE_CACHE_ENABLED=False, LIKES_FLUSH_INTERVAL=0)
+class ProductLikeTests(TestCase):
+   def setUp(self):
+      self.client = APIClient()
+      self.user = User.objects.create_user('ana', 'ana@example.com', 'secret')
+      self.product = create_product(Collection.objects.create(title='Kitchen'))
+      self.url = f'/store/products/{self.product.id}/like/'
+
+   def likes_count(self):
+      return self.client.get(f'/store/products/{self.product.id}/', {'include': 'likes_count'}).json()['likes_count']
+
+   def test_like_and_unlike(self):
+      self.client.force_authenticate(self.user)
+      with self.captureOnCommitCallbacks(execute=True):
+         self.assertEqual(self.client.post(self.url).status_code, 201)
+      self.assertEqual(self.likes_count(), 1)
+
+      with self.captureOnCommitCallbacks(execute=True):
+         self.assertEqual(self.client.delete(self.url).status_code, 204)
+      self.assertEqual(self.likes_count(), 0)
+      self.assertFalse(LikedItem.objects.exists())
+
+   def test_liking_twice_counts_once(self):
+      self.client.force_authenticate(self.user)
+      with self.captureOnCommitCallbacks(execute=True):
+         self.client.post(self.url)
+         response = self.client.post(self.url)
+
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(LikedItem.objects.count(), 1)
+      self.assertEqual(self.likes_count(), 1)
+
+   def test_anonymous_users_cannot_like(self):
+      self.assertEqual(self.client.post(self.url).status_code, 403)
+
+@override_settings(STORE_CACHE_ENABLED=False)
+class ProductTagTests(TestCase):
+   def setUp(self):
+      self.client = APIClient()
+      collection = Collection.objects.create(title='Kitchen')
+      self.products = [create_product(collection, title=f'Product {i}') for i in range(4)]
+      self.tags = {label: Tag.objects.create(label=label) for label in ['red', 'blue', 'sale']}
+      for product, labels in zip(self.products, [['red', 'sale'], ['blue', 'sale'], ['red'], []]):
+         for label in labels:
+            TaggedItem.objects.create(tag=self.tags[label], content_object=product)
+
+   def titles(self, tags):
+      response = self.client.get('/store/products/', {'tag': tags})
+      return [product['title'] for product in response.json()['results']]
+
+   def test_tag_filters(self):
+      self.assertEqual(self.titles('sale'), ['Product 0', 'Product 1'])
+      self.assertEqual(self.titles('red,blue'), ['Product 0', 'Product 1', 'Product 2'])
+      self.assertEqual(self.titles(['red,blue', 'sale']), ['Product 0', 'Product 1'])
+      self.assertEqual(self.titles(['red', 'sale']), ['Product 0'])
+      self.assertEqual(self.titles('green'), [])
+
+   def test_popular_tags_filter_the_same(self):
+      with mock.patch.object(ProductFilter, 'max_sorted_tag_matches', 0):
+         self.assertEqual(self.titles(['red,blue', 'sale']), ['Product 0', 'Product 1'])
+
+   def test_tag_counts(self):
+      TaggedItem.objects.filter(tag=self.tags['red'], object_id=self.products[2].id).delete()
+      TaggedItem.objects.create(tag=self.tags['blue'], content_object=self.products[3])
+      TaggedItem.objects.create(tag=Tag.objects.create(label='staff'), content_object=User.objects.create_user('ana', 'ana@example.com', 'secret'))
+
+      response = self.client.get('/tags/', {'ordering': 'label'})
+
+      self.assertEqual(response.json()['results'], [
+         {'id': self.tags['blue'].id, 'label': 'blue', 'products_count': 2},
+         {'id': self.tags['red'].id, 'label': 'red', 'products_count': 1},
+         {'id': self.tags['sale'].id, 'label': 'sale', 'products_count': 2},
+      ])
+
+   def test_an_object_is_tagged_once_per_tag(self):
+      with self.assertRaises(IntegrityError):
+         TaggedItem.objects.create(tag=self.tags['red'], content_object=self.products[0])
+
+@override_settings(STORE_CACHE_ENABLED=False, DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TestCase):
+   #The replica is a second test database holding only the rows a test copies
+   #into it; anything missing there is replication lag
+   databases = {'default', 'replica'}
+
+   def setUp(self):
+      self.client = APIClient()
+      self.collection = Collection.objects.create(title='Kitchen')
+      self.product = create_product(self.collection, title='Mug')
+
+   def replicate(self, *objects):
+      for obj in objects:
+         type(obj).objects.using('replica').bulk_create([obj])
+
+   def titles(self, path, client=None):
+      return [row.get('title') or row.get('name') for row in (client or self.client).get(path).json()['results']]
+
+   def test_catalog_reads_go_to_the_replica(self):
+      self.assertEqual(self.titles('/store/products/'), [])
+      self.replicate(self.collection, self.product)
+      self.assertEqual(self.titles('/store/products/'), ['Mug'])
+      self.assertEqual(self.client.get(f'/store/collections/{self.collection.id}/').status_code, 200)
+
+   def test_other_views_read_the_primary(self):
+      cart = Cart.objects.create()
+      self.assertEqual(self.client.get(f'/store/carts/{cart.id}/').status_code, 200)
+
+   @override_settings(DATABASE_REPLICAS=[])
+   def test_without_replicas_everything_reads_the_primary(self):
+      self.assertEqual(self.titles('/store/products/'), ['Mug'])
+
+   def test_a_client_reads_its_writes(self):
+      self.replicate(self.collection, self.product)
+      path = f'/store/products/{self.product.id}/reviews/'
+      response = self.client.post(path, {'name': 'Ana', 'description': 'Good', 'product': self.product.id})
+      self.assertEqual(response.status_code, 201)
+      self.assertIn('primary_pin', response.cookies)
+
+      self.assertEqual(self.titles(path), ['Ana'])
+      self.assertEqual(self.titles(path, APIClient()), [])
+
+   def test_reads_after_a_write_in_the_same_request_use_the_primary(self):
+      token = routing.set({'database': 'replica', 'wrote': False})
+      self.addCleanup(routing.reset, token)
+      self.assertFalse(Product.objects.exists())
+      Review.objects.create(product=self.product, name='Ana', description='Good')
+      self.assertTrue(Product.objects.exists())
+
+   @override_settings(STORE_CACHE_ENABLED=True)
+   def test_responses_read_from_a_lagging_replica_are_not_cached(self):
+      cache.get_cache().clear()
+      self.replicate(self.collection, self.product)
+      self.assertEqual([self.client.get('/store/products/')['X-Cache'] for _ in range(2)], ['MISS', 'MISS'])
+      with override_settings(DATABASE_REPLICA_LAG=0):
+         self.assertEqual([self.client.get('/store/products/')['X-Cache'] for _ in range(2)], ['MISS', 'HIT'])
+
+@override_settings(STORE_CACHE_ENABLED=False)
+class AsyncViewTests(TestCase):
+   def setUp(self):
+      self.client = APIClient()
+      collection = Collection.objects.create(title='Kitchen')
+      self.other = Collection.objects.create(title='Toys')
+      self.products = [create_product(collection, title=f'{name} mug', slug=f'mug-{price}', price=price) for name, price in [('Red', 5), ('Blue', 7), ('Green', 3)]]
+      TaggedItem.objects.create(tag=Tag.objects.create(label='sale'), content_object=self.products[0])
+      self.cart = Cart.objects.create()
+      CartItem.objects.create(cart=self.cart, product=self.products[1], quantity=2)
+
+   def assertSameAsSync(self, path, params=None):
+      expected = self.client.get(f'/store/{path}', params)
+      response = self.client.get(f'/store/async/{path}', params)
+      self.assertEqual(response.status_code, expected.status_code)
+      self.assertEqual(json.loads(response.content.decode().replace('/store/async/', '/store/')), expected.json())
+      return response
+
+   def test_product_list(self):
+      first = self.assertSameAsSync('products/', {'page_size': 2, 'ordering': '-price'})
+      self.assertSameAsSync('products/', dict(parse_qsl(urlsplit(first.json()['next']).query)))
+      for params in [{'collection_id': self.other.id}, {'price__lt': 6}, {'tag': 'sale'}, {'search': 'blue'}, {'include': 'tags,likes_count'}, {'price__gt': 'abc'}]:
+         with self.subTest(params):
+            self.assertSameAsSync('products/', params)
+
+   def test_product_and_cart_details(self):
+      self.assertSameAsSync(f'products/{self.products[0].id}/')
+      self.assertSameAsSync(f'products/{self.products[0].id}/', {'include': 'tags'})
+      self.assertSameAsSync('products/0/')
+      self.assertSameAsSync(f'carts/{self.cart.id}/')
+      self.assertSameAsSync(f'carts/{uuid4()}/')
+
+   def test_only_reads(self):
+      self.assertEqual(self.client.post(f'/store/async/products/{self.products[0].id}/').status_code, 405)
+
+   async def test_runs_on_the_event_loop(self):
+      #Synchronous queries from the event loop would raise SynchronousOnlyOperation
+      response = await AsyncClient().get('/store/async/products/', {'ordering': 'price'})
+      self.assertEqual([product['title'] for product in response.json()['results']], ['Green mug', 'Red mug', 'Blue mug'])
+      response = await AsyncClient().get(f'/store/async/carts/{self.cart.id}/')
+      self.assertEqual(response.json()['total_price'], 14)
+
+class CartTotalTests(TestCase):
+   def setUp(self):
+      self.client = APIClient()
+      collection = Collection.objects.create(title='Kitchen')
+      self.mug = create_product(collection, title='Mug', price='4.10')
+      self.kettle = create_product(collection, title='Kettle', price='25.99')
+      self.cart = Cart.objects.create()
+      CartItem.objects.create(cart=self.cart, product=self.mug, quantity=3)
+      CartItem.objects.create(cart=self.cart, product=self.kettle, quantity=1)
+
+   def test_cart_and_line_totals(self):
+      with self.assertNumQueries(2):
+         cart = self.client.get(f'/store/carts/{self.cart.id}/').json()
+
+      self.assertEqual(cart['total_price'], 38.29)
+      self.assertEqual(sorted(item['total_price'] for item in cart['items']), [12.3, 25.99])
+
+   def test_cart_item_totals(self):
+      items = self.client.get(f'/store/carts/{self.cart.id}/items/').json()['results']
+
+      self.assertEqual(sorted(item['total_price'] for item in items), [12.3, 25.99])
+
+   def test_new_cart_total_is_zero(self):
+      cart = self.client.post('/store/carts/').json()
+
+      self.assertEqual(cart['total_price'], 0)
+
+class AddCartItemTests(TestCase):
+   def setUp(self):
+      self.client = APIClient()
+      collection = Collection.objects.create(title='Kitchen')
+      self.mug = create_product(collection, title='Mug')
+      self.kettle = create_product(collection, title='Kettle')
+      self.cart = Cart.objects.create()
+      self.url = f'/store/carts/{self.cart.id}/items/'
+
+   def test_adding_twice_sums_quantities(self):
+      first = self.client.post(self.url, {'product_id': self.mug.id, 'quantity': 2}, format='json')
+      second = self.client.post(self.url, {'product_id': self.mug.id, 'quantity': 3}, format='json')
+
+      self.assertEqual(first.status_code, 201)
+      self.assertEqual(second.json(), {'id': first.json()['id'], 'product_id': self.mug.id, 'quantity': 5})
+      self.assertEqual(CartItem.objects.get().quantity, 5)
+
+   def test_list_of_items(self):
+      response = self.client.post(self.url, [
+         {'product_id': self.mug.id, 'quantity': 1},
+         {'product_id': self.kettle.id, 'quantity': 2},
+         {'product_id': self.mug.id, 'quantity': 4},
+      ], format='json')
+
+      self.assertEqual(response.status_code, 201)
+      self.assertEqual([(item['product_id'], item['quantity']) for item in response.json()], [(self.mug.id, 5), (self.kettle.id, 2)])
+
+   def test_unknown_product_rejects_the_whole_request(self):
+      response = self.client.post(self.url, [
+         {'product_id': self.mug.id, 'quantity': 1},
+         {'product_id': 0, 'quantity': 1},
+      ], format='json')
+
+      self.assertEqual(response.status_code, 400)
+      self.assertFalse(CartItem.objects.exists())
+
+   def test_unknown_cart(self):
+      response = self.client.post(f'/store/carts/{uuid4()}/items/', {'product_id': self.mug.id, 'quantity': 1}, format='json')
+
+      self.assertEqual(response.status_code, 404)
+
+class ConcurrentAddCartItemTests(TransactionTestCase):
+   def test_concurrent_adds_to_one_cart(self):
+      collection = Collection.objects.create(title='Kitchen')
+      products = [create_product(collection, title=f'Product {i}').id for i in range(4)]
+      cart = Cart.objects.create()
+
+      def add(n):
+         try:
+            response = APIClient().post(f'/store/carts/{cart.id}/items/', {'product_id': products[n % 4], 'quantity': 1}, format='json')
+            return response.status_code
+         finally:
+            connection.close()
+
+      with ThreadPoolExecutor(max_workers=8) as executor:
+         statuses = list(executor.map(add, range(200)))
+
+      self.assertEqual(statuses, [201] * 200)
+      self.assertEqual(sorted(CartItem.objects.filter(cart=cart).values_list('quantity', flat=True)), [50] * 4)
+
+class CheckoutTests(TestCase):
+   def setUp(self):
+      collection = Collection.objects.create(title='Kitchen')
+      self.mug = create_product(collection, title='Mug', price=10, inventory=5)
+      self.kettle = create_product(collection, title='Kettle', price='25.50', inventory=1)
+      self.customer = Customer.objects.create(first_name='Ana', last_name='Lima', email='ana@example.com', phone='1')
+      self.cart = Cart.objects.create()
+      CartItem.objects.create(cart=self.cart, product=self.mug, quantity=2)
+      CartItem.objects.create(cart=self.cart, product=self.kettle, quantity=1)
+      self.client = APIClient()
+      self.client.force_authenticate(User.objects.create_user('ana', 'ana@example.com'))
+
+   def checkout(self, cart_id=None, customer_id=None):
+      return self.client.post('/store/orders/', {'cart_id': str(cart_id or self.cart.id), 'customer_id': customer_id or self.customer.id}, format='json')
+
+   def test_checkout_converts_the_cart(self):
+      response = self.checkout()
+
+      self.assertEqual(response.status_code, 201)
+      items = {item['product']['id']: item for item in response.json()['items']}
+      self.assertEqual((items[self.mug.id]['quantity'], items[self.mug.id]['unit_price']), (2, 10))
+      self.assertEqual(items[self.kettle.id]['unit_price'], 25.5)
+      self.assertFalse(Cart.objects.filter(pk=self.cart.id).exists())
+      self.mug.refresh_from_db()
+      self.kettle.refresh_from_db()
+      self.assertEqual((self.mug.inventory, self.kettle.inventory), (3, 0))
+
+   def test_unit_price_is_a_snapshot(self):
+      order_id = self.checkout().json()['id']
+      Product.objects.filter(pk=self.mug.pk).update(price=99)
+
+      response = self.client.get(f'/store/orders/{order_id}/')
+
+      self.assertEqual(response.json()['items'][0]['unit_price'], 10)
+
+   def test_orders_belong_to_their_customer(self):
+      other = Customer.objects.create(first_name='Bia', last_name='Lima', email='bia@example.com', phone='2')
+      self.assertEqual(APIClient().post('/store/orders/', {'cart_id': str(self.cart.id), 'customer_id': self.customer.id}, format='json').status_code, 403)
+      self.assertEqual(self.checkout(customer_id=other.id).status_code, 400)
+      order_id = self.checkout().json()['id']
+
+      self.assertEqual(APIClient().get(f'/store/orders/{order_id}/').status_code, 403)
+      stranger = APIClient()
+      stranger.force_authenticate(User.objects.create_user('bia', 'bia@example.com'))
+      self.assertEqual(stranger.get(f'/store/orders/{order_id}/').status_code, 404)
+      staff = APIClient()
+      staff.force_authenticate(User.objects.create_user('staff', 'staff@example.com', is_staff=True))
+      self.assertEqual(staff.get(f'/store/orders/{order_id}/').status_code, 200)
+
+   def test_insufficient_inventory_rolls_back(self):
+      CartItem.objects.filter(product=self.kettle).update(quantity=2)
+
+      response = self.checkout()
+
+      self.assertEqual(response.status_code, 400)
+      self.assertIn('items', response.json())
+      self.assertFalse(Order.objects.exists())
+      self.assertTrue(Cart.objects.filter(pk=self.cart.id).exists())
+      self.mug.refresh_from_db()
+      self.assertEqual(self.mug.inventory, 5)
+
+   def test_empty_and_unknown_carts_are_rejected(self):
+      empty = Cart.objects.create()
+
+      self.assertEqual(self.checkout(empty.id).status_code, 400)
+      self.assertEqual(self.checkout(uuid4()).status_code, 400)
+      self.assertFalse(Order.objects.exists())
+
+   def test_checkout_query_count(self):
+      with self.assertNumQueries(13):
+         self.checkout()
+
+class ConcurrentCheckoutTests(TransactionTestCase):
+   def test_concurrent_checkouts_never_oversell(self):
+      product = create_product(Collection.objects.create(title='Kitchen'), inventory=10)
+      customer = Customer.objects.create(first_name='Ana', last_name='Lima', email='ana@example.com', phone='1')
+      user = User.objects.create_user('ana', 'ana@example.com')
+      carts = [Cart.objects.create() for _ in range(30)]
+      CartItem.objects.bulk_create(CartItem(cart=cart, product=product, quantity=1) for cart in carts)
+
+      def checkout(cart):
+         client = APIClient()
+         client.force_authenticate(user)
+         try:
+            return client.post('/store/orders/', {'cart_id': str(cart.id), 'customer_id': customer.id}, format='json').status_code
+         finally:
+            connection.close()
+
+      with ThreadPoolExecutor(max_workers=8) as executor:
+         statuses = list(executor.map(checkout, carts))
+
+      self.assertEqual(statuses.count(201), 10)
+      self.assertEqual(statuses.count(400), 20)
+      product.refresh_from_db()
+      self.assertEqual(product.inventory, 0)
+      self.assertEqual(OrderItem.objects.count(), 10)
+
+class ReapCartsTests(TestCase):
+   def setUp(self):
+      product = create_product(Collection.objects.create(title='Kitchen'))
+      self.fresh = Cart.objects.create()
+      self.stale = []
+      for days in [31, 45, 90]:
+         cart = Cart.objects.create()
+         Cart.objects.filter(pk=cart.pk).update(created_at=timezone.now() - timedelta(days=days))
+         CartItem.objects.create(cart=cart, product=product, quantity=1)
+         self.stale.append(cart)
+
+   def test_deletes_stale_carts_in_batches(self):
+      out = StringIO()
+      call_command('reap_carts', '--ttl-days=30', '--batch-size=2', verbosity=2, stdout=out)
+
+      self.assertEqual(list(Cart.objects.all()), [self.fresh])
+      self.assertFalse(CartItem.objects.exists())
+      self.assertEqual(out.getvalue().count('rows/s'), 3)
+      self.assertIn('Deleted 3 carts and 3 cart items', out.getvalue())
+
+   def test_dry_run_deletes_nothing(self):
+      out = StringIO()
+      call_command('reap_carts', '--ttl-days=30', '--dry-run', stdout=out)
+
+      self.assertEqual(Cart.objects.count(), 4)
+      self.assertIn('Would delete 3 carts and 3 cart items.', out.getvalue())
+
+   @override_settings(STORE_CART_TTL_DAYS=60)
+   def test_ttl_defaults_to_the_setting(self):
+      call_command('reap_carts', stdout=StringIO())
+
+      self.assertEqual(Cart.objects.count(), 3)
+
+   @override_settings(STORE_JOBS={'reap_carts': 3600, 'recount_collections': 60})
+   def test_scheduled_by_run_jobs(self):
+      out, err = StringIO(), StringIO()
+      with mock.patch('store.management.commands.recount_collections.Command.handle', side_effect=RuntimeError('down')):
+         call_command('run_jobs', '--once', stdout=out, stderr=err)
+
+      self.assertEqual(list(Cart.objects.all()), [self.fresh])
+      self.assertIn('Deleted 3 carts and 3 cart items', out.getvalue())
+      self.assertIn('recount_collections failed', err.getvalue())
+
+@override_settings(STORE_MEMBERSHIP_SILVER_SPEND=100, STORE_MEMBERSHIP_GOLD_SPEND=1000)
+class RecomputeMembershipsTests(TestCase):
+   def setUp(self):
+      self.product = create_product(Collection.objects.create(title='Kitchen'))
+      self.customers = [
+         Customer.objects.create(first_name='Customer', last_name=str(i), email=f'customer{i}@example.com', phone='1', membership=membership)
+         for i, membership in enumerate(['G', 'B', 'B', 'S', 'B'])
+      ]
+
+   def spend(self, customer, amount, days_ago=10, status=Order.COMPLETE):
+      order = Order.objects.create(customer=customer, payment_status=status)
+      Order.objects.filter(pk=order.pk).update(placed_at=timezone.now() - timedelta(days=days_ago))
+      OrderItem.objects.create(order=order, product=self.product, quantity=2, unit_price=Decimal(amount) / 2)
+
+   def memberships(self):
+      return list(Customer.objects.order_by('id').values_list('membership', flat=True))
+
+   def test_tiers_follow_trailing_year_spend(self):
+      gold, silver, _, lapsed, pending = self.customers
+      self.spend(gold, 1200)
+      self.spend(silver, 60)
+      self.spend(silver, 60)
+      self.spend(lapsed, 5000, days_ago=400)
+      self.spend(pending, 5000, status=Order.PENDING)
+
+      out = StringIO()
+      call_command('recompute_memberships', '--batch-size=2', stdout=out)
+
+      self.assertEqual(self.memberships(), ['G', 'S', 'B', 'B', 'B'])
+      self.assertEqual(out.getvalue().count('customers/s'), 4)
+      self.assertIn('Checked 5 customers in 3 batches, 2 changed tier', out.getvalue())
+
+   def test_batches_cost_a_fixed_number_of_queries(self):
+      self.spend(self.customers[0], 1200)
+      #Watermark get_or_create; then per batch the customers, their spend and a
+      #transaction with the tier update and the watermark; then the empty last
+      #batch and the watermark reset
+      with self.assertNumQueries(4 + 6 + 2):
+         jobs.recompute_memberships(batch_size=5)
+
+   def test_resumes_after_an_interrupted_run(self):
+      def interrupt(message):
+         raise KeyboardInterrupt
+      with self.assertRaises(KeyboardInterrupt):
+         jobs.recompute_memberships(batch_size=2, log=interrupt)
+      self.assertEqual(self.memberships(), ['B', 'B', 'B', 'S', 'B'])
+
+      totals = jobs.recompute_memberships(batch_size=2)
+
+      self.assertEqual(totals['customers'], 3)
+      self.assertEqual(self.memberships(), ['B'] * 5)
+      self.assertEqual(Watermark.objects.get(name=jobs.MEMBERSHIP_WATERMARK).position, 0)
+
+class PromotionPricingTests(TestCase):
+   def setUp(self):
+      cache.get_cache().clear()
+      self.collection = Collection.objects.create(title='Kitchen')
+      self.mug = create_product(self.collection, title='Mug', price=100)
+      self.kettle = create_product(self.collection, title='Kettle', price=50)
+      self.sale = Promotion.objects.create(description='Sale', discount=0.2)
+      self.clearance = Promotion.objects.create(description='Clearance', discount=0.25)
+
+   def prices(self):
+      return list(Product.objects.order_by('title').values_list('effective_price', flat=True))
+
+   def test_best_active_promotion_applies(self):
+      self.assertEqual(self.prices(), [50, 100])
+      self.mug.promotions.add(self.sale)
+      self.assertEqual(self.prices(), [50, 80])
+      self.clearance.product_set.add(self.mug, self.kettle)
+      self.assertEqual(self.prices(), [Decimal('37.50'), 75])
+
+      self.clearance.is_active = False
+      self.clearance.save()
+      self.assertEqual(self.prices(), [50, 80])
+
+      self.sale.delete()
+      self.assertEqual(self.prices(), [50, 100])
+
+   def test_unlinking_restores_the_price(self):
+      self.sale.product_set.add(self.mug, self.kettle)
+      self.sale.product_set.clear()
+      self.assertEqual(self.prices(), [50, 100])
+
+   def test_price_edit_keeps_the_discount(self):
+      self.mug.promotions.add(self.sale)
+      client = APIClient()
+      client.get(f'/store/products/{self.mug.id}/')
+
+      response = client.patch(f'/store/products/{self.mug.id}/', {'unit_price': 10}, format='json')
+
+      self.assertEqual(response.json()['effective_price'], 8)
+      self.assertEqual(client.get(f'/store/products/{self.mug.id}/').json()['effective_price'], 8)
+
+   def test_admin_price_edit_keeps_the_discount(self):
+      self.mug.promotions.add(self.sale)
+      self.mug.price = 10
+      form = mock.Mock(changed_data=['price'])
+
+      site._registry[Product].save_model(None, self.mug, form, True)
+
+      self.assertEqual(self.prices(), [50, 8])
+
+   def test_saving_a_product_reads_no_promotions(self):
+      self.mug.price = 90
+      with CaptureQueriesContext(connection) as queries:
+         self.mug.save()
+
+      self.assertFalse([query for query in queries if 'promotion' in query['sql']])
+
+   def test_list_filters_and_orders_on_effective_price(self):
+      self.mug.promotions.add(self.clearance)
+      cheap = create_product(self.collection, title='Spoon', price=60)
+
+      response = APIClient().get('/store/products/', {'ordering': 'effective_price', 'effective_price__lt': 80})
+
+      self.assertEqual([(row['id'], row['effective_price']) for row in response.json()['results']], [(self.kettle.id, 50), (cheap.id, 60), (self.mug.id, 75)])
+
+   def test_tax_applies_to_the_effective_price(self):
+      self.mug.promotions.add(self.sale)
+
+      product = APIClient().get(f'/store/products/{self.mug.id}/').json()
+
+      self.assertEqual((product['effective_price'], product['price_with_tax']), (80, 88))
+
+   def test_promotion_change_invalidates_cached_products(self):
+      client = APIClient()
+      self.sale.product_set.add(self.mug)
+      client.get(f'/store/products/{self.mug.id}/')
+
+      self.sale.discount = 0.5
+      self.sale.save()
+
+      response = client.get(f'/store/products/{self.mug.id}/')
+      self.assertEqual(response['X-Cache'], 'MISS')
+      self.assertEqual(response.json()['effective_price'], 50)
+
+   def test_import_applies_promotions(self):
+      CatalogImporter().run([
+         {'id': self.kettle.id, 'title': 'Kettle', 'price': '40.00', 'inventory': 3, 'collection': 'Kitchen', 'promotions': [self.sale.id]},
+         {'title': 'Pan', 'price': '20.00', 'inventory': 3, 'collection': 'Kitchen', 'promotions': [self.clearance.id]},
+      ])
+
+      self.assertEqual(dict(Product.objects.values_list('title', 'effective_price')), {'Mug': 100, 'Kettle': 32, 'Pan': 15})
+
+   def test_checkout_charges_the_effective_price(self):
+      self.mug.promotions.add(self.sale)
+      customer = Customer.objects.create(first_name='Ana', last_name='Lima', email='ana@example.com', phone='1')
+      cart = Cart.objects.create()
+      CartItem.objects.create(cart=cart, product=self.mug, quantity=2)
+
+      self.assertEqual(APIClient().get(f'/store/carts/{cart.id}/').json()['total_price'], 160)
+      client = APIClient()
+      client.force_authenticate(User.objects.create_user('ana', 'ana@example.com'))
+      response = client.post('/store/orders/', {'cart_id': str(cart.id), 'customer_id': customer.id}, format='json')
+
+      self.assertEqual(response.json()['items'][0]['unit_price'], 80)
+
+class ReviewStatsTests(TestCase):
+   def setUp(self):
+      cache.get_cache().clear()
+      collection = Collection.objects.create(title='Kitchen')
+      self.mug = create_product(collection, title='Mug')
+      self.kettle = create_product(collection, title='Kettle')
+
+   def stats(self, product):
+      product.refresh_from_db()
+      return product.reviews_count, product.ratings_count, product.average_rating, product.last_reviewed_on
+
+   def review(self, product, rating=None):
+      data = {'name': 'Ana', 'description': 'Fine', 'product': product.id}
+      if rating is not None:
+         data['rating'] = rating
+      response = APIClient().post(f'/store/products/{product.id}/reviews/', data)
+      self.assertEqual(response.status_code, 201)
+      return response.json()['id']
+
+   def test_stats_follow_reviews(self):
+      first = self.review(self.mug, 5)
+      self.review(self.mug, 2)
+      unrated = self.review(self.mug)
+      self.assertEqual(self.stats(self.mug), (3, 2, 3.5, timezone.localdate()))
+
+      Review.objects.get(pk=first).delete()
+      self.assertEqual(self.stats(self.mug)[:3], (2, 1, 2.0))
+
+      Review.objects.filter(pk=unrated).update(rating=4)
+      self.assertEqual(self.stats(self.mug)[:3], (2, 2, 3.0))
+
+      Review.objects.filter(product=self.mug).delete()
+      self.assertEqual(self.stats(self.mug), (0, 0, 0, None))
+
+   def test_moving_a_review_moves_its_stats(self):
+      review = self.review(self.mug, 4)
+      Review.objects.filter(pk=review).update(product=self.kettle)
+      self.assertEqual(self.stats(self.mug)[:3], (0, 0, 0))
+      self.assertEqual(self.stats(self.kettle)[:3], (1, 1, 4.0))
+
+   def test_saving_a_stale_product_keeps_the_stats(self):
+      mug = Product.objects.get(pk=self.mug.pk)
+      self.review(self.mug, 5)
+      mug.title = 'Big mug'
+      mug.save()
+      self.assertEqual(self.stats(self.mug)[:2], (1, 1))
+
+   def test_reviews_invalidate_cached_product(self):
+      url = f'/store/products/{self.mug.id}/'
+      self.assertEqual(APIClient().get(url)['X-Cache'], 'MISS')
+      self.assertEqual(APIClient().get(url)['X-Cache'], 'HIT')
+      review = self.review(self.mug, 4)
+
+      response = APIClient().get(url)
+      self.assertEqual(response['X-Cache'], 'MISS')
+      self.assertEqual((response.json()['reviews_count'], response.json()['average_rating']), (1, 4.0))
+      APIClient().get(url)
+      Review.objects.get(pk=review).delete()
+      self.assertEqual(APIClient().get(url).json()['reviews_count'], 0)
+
+   @override_settings(STORE_CACHE_ENABLED=False)
+   def test_list_sorts_and_filters_in_one_query(self):
+      self.review(self.kettle, 5)
+      self.review(self.mug, 3)
+      self.review(self.mug, 4)
+      create_product(self.mug.collection, title='Unreviewed')
+
+      with self.assertNumQueries(1):
+         response = APIClient().get('/store/products/', {'ordering': '-average_rating', 'reviews_count__gt': 0})
+
+      rows = [(row['title'], row['reviews_count'], row['average_rating']) for row in response.json()['results']]
+      self.assertEqual(rows, [('Kettle', 1, 5.0), ('Mug', 2, 3.5)])
+      unreviewed = APIClient().get('/store/products/', {'reviews_count__lt': 1}).json()['results']
+      self.assertEqual([(row['title'], row['average_rating']) for row in unreviewed], [('Unreviewed', None)])
+
+class CollectionProductsCountTests(TestCase):
+   def setUp(self):
+      self.beauty = Collection.objects.create(title='Beauty')
+      self.toys = Collection.objects.create(title='Toys')
+
+   def count(self, collection):
+      collection.refresh_from_db()
+      return collection.products_count
+
+   def test_counter_follows_inserts_moves_and_deletes(self):
+      product = create_product(self.beauty)
+      create_product(self.beauty)
+      Product.objects.bulk_create([Product(title='Bulk', slug='bulk', price=1, inventory=1, collection=self.toys)])
+      self.assertEqual((self.count(self.beauty), self.count(self.toys)), (2, 1))
+
+      product.collection = self.toys
+      product.save()
+      self.assertEqual((self.count(self.beauty), self.count(self.toys)), (1, 2))
+
+      Product.objects.filter(collection=self.toys).delete()
+      self.assertEqual((self.count(self.beauty), self.count(self.toys)), (1, 0))
+
+   def test_saving_a_stale_collection_keeps_the_counter(self):
+      stale = Collection.objects.get(pk=self.beauty.pk)
+      create_product(self.beauty)
+
+      stale.title = 'Cosmetics'
+      stale.save()
+
+      self.assertEqual(self.count(self.beauty), 1)
+
+   def test_api_reads_the_counter(self):
+      create_product(self.toys)
+
+      with self.assertNumQueries(1):
+         collection = APIClient().get(f'/store/collections/{self.toys.id}/').json()
+
+      self.assertEqual(collection['products_count'], 1)
+
+   def test_recount_repairs_drift(self):
+      create_product(self.beauty)
+      Collection.objects.filter(pk=self.beauty.pk).update(products_count=7)
+
+      out = StringIO()
+      call_command('recount_collections', stdout=out)
+
+      self.assertEqual(self.count(self.beauty), 1)
+      self.assertIn('Repaired 1 collections.', out.getvalue())
+
+   def product_triggers(self):
+      with connection.cursor() as cursor:
+         cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'store_product' ORDER BY name")
+         return [name for name, in cursor.fetchall()]
+
+   def test_triggers_exist_after_migrate(self):
+      triggers = [
+         'store_collection_products_count_delete', 'store_collection_products_count_insert', 'store_collection_products_count_update',
+         'store_product_fts_delete', 'store_product_fts_insert', 'store_product_fts_update',
+      ]
+      self.assertEqual(self.product_triggers(), triggers)
+
+      #As a migration that rebuilds store_product would
+      with connection.cursor() as cursor:
+         cursor.execute('DROP TRIGGER store_collection_products_count_insert')
+         cursor.execute('DROP TRIGGER store_product_fts_update')
+      emit_post_migrate_signal(0, False, 'default')
+
+      self.assertEqual(self.product_triggers(), triggers)
+
+class CatalogImportExportTests(TestCase):
+   def setUp(self):
+      self.promotion = Promotion.objects.create(description='Sale', discount=10)
+      self.admin = User.objects.create_superuser('admin', 'admin@example.com', 'secret')
+      self.client = APIClient()
+      self.client.force_authenticate(self.admin)
+
+   def import_ndjson(self, rows, chunk_size=2):
+      lines = [json.dumps(row).encode() + b'\n' for row in rows]
+      importer = CatalogImporter(chunk_size=chunk_size)
+      return importer, importer.run(read_rows(lines, 'ndjson'))
+
+   def test_import_creates_updates_and_links(self):
+      existing = create_product(Collection.objects.create(title='Toys'), title='Old')
+      importer, totals = self.import_ndjson([
+         {'title': 'Ball', 'price': '5.00', 'inventory': 3, 'collection': 'Toys', 'promotions': [self.promotion.id]},
+         {'id': existing.id, 'title': 'Kite', 'price': '8.50', 'inventory': 1, 'collection': 'Outdoor'},
+         {'title': 'Bad', 'price': '0', 'inventory': 1, 'collection': 'Toys'},
+      ])
+
+      self.assertEqual((totals['created'], totals['updated'], totals['invalid'], totals['chunks']), (1, 1, 1, 2))
+      self.assertEqual(importer.errors[0]['row'], 3)
+      ball = Product.objects.get(title='Ball')
+      self.assertEqual(ball.slug, 'ball')
+      self.assertEqual(list(ball.promotions.all()), [self.promotion])
+      existing.refresh_from_db()
+      self.assertEqual((existing.title, existing.collection.title), ('Kite', 'Outdoor'))
+      self.assertEqual(Collection.objects.get(title='Toys').products_count, 1)
+
+   def test_unknown_promotion_rejects_the_row(self):
+      importer, totals = self.import_ndjson([{'title': 'Ball', 'price': '5', 'inventory': 3, 'collection': 'Toys', 'promotions': [999]}])
+
+      self.assertEqual(totals['invalid'], 1)
+      self.assertIn('promotions', importer.errors[0]['errors'])
+
+   def test_repeated_id_in_a_chunk_rejects_the_row(self):
+      importer, totals = self.import_ndjson([
+         {'id': 900, 'title': 'Ball', 'price': '5', 'inventory': 3, 'collection': 'Toys'},
+         {'id': 900, 'title': 'Kite', 'price': '8', 'inventory': 1, 'collection': 'Toys'},
+      ])
+
+      self.assertEqual((totals['created'], totals['invalid']), (1, 1))
+      self.assertEqual(importer.errors, [{'row': 2, 'errors': {'id': ['Repeats the id of row 1.']}}])
+      self.assertEqual(Product.objects.get(pk=900).title, 'Ball')
+
+   def test_csv_round_trip(self):
+      self.import_ndjson([
+         {'title': 'Ball', 'price': '5.00', 'inventory': 3, 'collection': 'Toys', 'promotions': [self.promotion.id]},
+         {'title': 'Kite, red', 'description': 'Flies', 'price': '8.50', 'inventory': 1, 'collection': 'Outdoor'},
+      ])
+      exported = ''.join(export_rows(format='csv', chunk_size=1))
+      Product.promotions.through.objects.all().delete()
+      Product.objects.all().delete()
+
+      totals = CatalogImporter().run(read_rows(exported.splitlines(keepends=True), 'csv'))
+
+      self.assertEqual(totals['created'], 2)
+      self.assertEqual(Product.objects.get(title='Kite, red').description, 'Flies')
+      self.assertEqual(list(Product.objects.get(title='Ball').promotions.all()), [self.promotion])
+
+   def test_import_endpoint_accepts_uploads_and_raw_bodies(self):
+      upload = SimpleUploadedFile('products.csv', b'title,price,inventory,collection\nBall,5.00,3,Toys\n')
+      response = self.client.post('/store/products/import/', {'file': upload}, format='multipart')
+      self.assertEqual(response.status_code, 200)
+      self.assertEqual(response.json()['created'], 1)
+
+      body = json.dumps({'title': 'Kite', 'price': '8', 'inventory': 1, 'collection': 'Toys'}) + '\n'
+      response = self.client.generic('POST', '/store/products/import/', body, content_type='application/x-ndjson')
+      self.assertEqual(response.json()['created'], 1)
+      self.assertEqual(len(response.json()['chunks']), 1)
+
+   def test_export_endpoint_streams(self):
+      self.import_ndjson([{'title': 'Ball', 'price': '5.00', 'inventory': 3, 'collection': 'Toys'}])
+
+      response = self.client.get('/store/products/export/', {'file_format': 'ndjson'})
+
+      self.assertTrue(response.streaming)
+      rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+      self.assertEqual([row['title'] for row in rows], ['Ball'])
+
+   def test_import_requires_staff(self):
+      response = APIClient().post('/store/products/import/', b'', content_type='application/x-ndjson')
+
+      self.assertIn(response.status_code, (401, 403))
+
+class StreamingListTests(TestCase):
+   def setUp(self):
+      collection = Collection.objects.create(title='Toys')
+      self.products = [create_product(collection, title=f'Product {i}', price=i + 1) for i in range(5)]
+
+   def streamed(self, path, params):
+      response = APIClient().get(path, {**params, 'stream': 'true'})
+      self.assertTrue(response.streaming)
+      return response, list(response.streaming_content)
+
+   @mock.patch('store.views.ProductViewSet.stream_chunk_size', 2)
+   def test_stream_matches_the_serialized_list(self):
+      response, chunks = self.streamed('/store/products/', {'ordering': '-price'})
+
+      self.assertEqual(len(chunks), 3)
+      self.assertEqual(response['Content-Type'], 'application/json')
+      rows = json.loads(b''.join(chunks))
+      self.assertEqual([row['id'] for row in rows], [product.id for product in reversed(self.products)])
+      paginated = APIClient().get('/store/products/', {'ordering': '-price', 'page_size': 10}).json()['results']
+      self.assertEqual(rows, paginated)
+
+   @mock.patch('store.views.ProductViewSet.stream_chunk_size', 5)
+   def test_stream_of_whole_chunks_is_valid_json(self):
+      _, chunks = self.streamed('/store/products/', {})
+
+      self.assertEqual(len(json.loads(b''.join(chunks))), 5)
+
+   def test_stream_applies_filters(self):
+      _, chunks = self.streamed('/store/products/', {'price__gt': 3})
+
+      self.assertEqual(len(json.loads(b''.join(chunks))), 2)
+
+   def test_empty_stream_is_an_empty_list(self):
+      _, chunks = self.streamed(f'/store/products/{self.products[0].id}/reviews/', {})
+
+      self.assertEqual(json.loads(b''.join(chunks)), [])
+
+   def test_stream_reads_the_queryset_in_chunks(self):
+      with self.assertNumQueries(1):
+         _, chunks = self.streamed('/store/products/', {})
+      self.assertEqual(len(json.loads(b''.join(chunks))), 5)
+
+class CustomerOrderHistoryTests(TestCase):
+   def setUp(self):
+      cache.get_cache().clear()
+      collection = Collection.objects.create(title='Kitchen')
+      self.products = [create_product(collection, title=f'Product {i}') for i in range(3)]
+      self.customer = Customer.objects.create(first_name='Ana', last_name='Lima', email='ana@example.com', phone='1')
+      self.client = APIClient()
+      self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+
+   def order(self, status=Order.COMPLETE, lines=2):
+      order = Order.objects.create(customer=self.customer, payment_status=status)
+      OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=2, unit_price='2.50') for product in self.products[:lines])
+      return order
+
+   def test_orders_page_has_a_fixed_query_count(self):
+      for _ in range(12):
+         self.order()
+
+      with self.assertNumQueries(2):
+         response = self.client.get(f'/store/customers/{self.customer.id}/orders/', {'page_size': 10})
+
+      body = response.json()
+      self.assertEqual(len(body['results']), 10)
+      self.assertEqual(body['results'][0]['total_price'], 10)
+      self.assertEqual(len(body['results'][0]['items']), 2)
+      with self.assertNumQueries(2):
+         self.assertEqual(len(self.client.get(body['next']).json()['results']), 2)
+
+   def test_summary_is_cached(self):
+      self.order()
+      self.order(status=Order.PENDING)
+
+      with self.assertNumQueries(2):
+         first = self.client.get(f'/store/customers/{self.customer.id}/').json()
+      with self.assertNumQueries(1):
+         second = self.client.get(f'/store/customers/{self.customer.id}/').json()
+
+      self.assertEqual(first['summary'], {'orders_count': 2, 'lifetime_spend': 10})
+      self.assertEqual(second, first)
+
+   def test_payment_status_change_invalidates_summary(self):
+      order = self.order(status=Order.PENDING)
+      self.client.get(f'/store/customers/{self.customer.id}/')
+
+      with self.captureOnCommitCallbacks(execute=True):
+         order.payment_status = Order.COMPLETE
+         order.save(update_fields=['payment_status'])
+
+      summary = self.client.get(f'/store/customers/{self.customer.id}/').json()['summary']
+      self.assertEqual(summary['lifetime_spend'], 10)
+
+   def test_summary_computed_across_an_invalidation_is_not_served(self):
+      def racing():
+         cache.invalidate_customers([self.customer.id])
+         return {'orders_count': 0, 'lifetime_spend': 0}
+      cache.get_customer_summary(self.customer.id, racing)
+
+      self.assertEqual(cache.get_customer_summary(self.customer.id, lambda: 'fresh'), 'fresh')
+
+   def test_requires_admin(self):
+      self.assertEqual(APIClient().get(f'/store/customers/{self.customer.id}/').status_code, 403)
+
+class SalesRollupTests(TestCase):
+   def setUp(self):
+      self.kitchen = Collection.objects.create(title='Kitchen')
+      self.toys = Collection.objects.create(title='Toys')
+      self.mug = create_product(self.kitchen, title='Mug')
+      self.kettle = create_product(self.kitchen, title='Kettle')
+      self.ball = create_product(self.toys, title='Ball')
+      self.customer = Customer.objects.create(first_name='Ana', last_name='Lima', email='ana@example.com', phone='1')
+
+   def order(self, day, *lines, status=Order.COMPLETE):
+      order = Order.objects.create(customer=self.customer, payment_status=status)
+      #Late evening in Sao Paulo is already the next day in UTC
+      Order.objects.filter(pk=order.pk).update(placed_at=datetime.combine(day, datetime.min.time().replace(hour=22), timezone.get_current_timezone()))
+      OrderItem.objects.bulk_create(OrderItem(order=order, product=product, quantity=quantity, unit_price=price) for product, quantity, price in lines)
+      return Order.objects.get(pk=order.pk)
+
+   def rollups(self):
+      return (
+         sorted(DailyProductSales.objects.values_list('day', 'product_id', 'units', 'revenue')),
+         sorted(DailyCollectionSales.objects.values_list('day', 'collection_id', 'units', 'revenue')),
+      )
+
+   def test_refresh_folds_new_items_incrementally(self):
+      self.order(date(2026, 3, 1), (self.mug, 2, '10.00'), (self.ball, 1, '5.50'))
+      analytics.refresh_sales_rollups()
+      self.order(date(2026, 3, 1), (self.mug, 1, '12.00'))
+      self.order(date(2026, 3, 2), (self.kettle, 1, '30.00'))
+
+      totals = analytics.refresh_sales_rollups(batch_size=1)
+
+      self.assertEqual(totals['items'], 2)
+      products, collections = self.rollups()
+      self.assertEqual(products, [
+         (date(2026, 3, 1), self.mug.id, 3, Decimal('32.00')),
+         (date(2026, 3, 1), self.ball.id, 1, Decimal('5.50')),
+         (date(2026, 3, 2), self.kettle.id, 1, Decimal('30.00')),
+      ])
+      self.assertIn((date(2026, 3, 1), self.kitchen.id, 3, Decimal('32.00')), collections)
+      self.assertEqual(Watermark.objects.get(name=analytics.WATERMARK).position, OrderItem.objects.latest('id').id)
+      self.assertEqual(analytics.refresh_sales_rollups()['items'], 0)
+
+   def test_only_completed_payments_count(self):
+      self.order(date(2026, 3, 1), (self.mug, 2, '10.00'))
+      pending = self.order(date(2026, 3, 1), (self.mug, 1, '12.00'), (self.kettle, 1, '30.00'), status=Order.PENDING)
+      self.order(date(2026, 3, 1), (self.ball, 1, '5.50'), status=Order.FAILED)
+      analytics.refresh_sales_rollups()
+      self.assertEqual(self.rollups()[0], [(date(2026, 3, 1), self.mug.id, 2, Decimal('20.00'))])
+
+      pending.payment_status = Order.COMPLETE
+      pending.save()
+      self.assertEqual(self.rollups()[0], [(date(2026, 3, 1), self.mug.id, 3, Decimal('32.00')), (date(2026, 3, 1), self.kettle.id, 1, Decimal('30.00'))])
+      self.assertIn((date(2026, 3, 1), self.kitchen.id, 4, Decimal('62.00')), self.rollups()[1])
+
+      pending.payment_status = Order.FAILED
+      pending.save(update_fields=['payment_status'])
+      refreshed = self.rollups()
+      self.assertEqual(refreshed[0], [(date(2026, 3, 1), self.mug.id, 2, Decimal('20.00'))])
+      analytics.rebuild_sales_rollups(workers=1)
+      self.assertEqual(self.rollups(), refreshed)
+
+   def test_payment_changes_reach_the_top_sellers(self):
+      self.order(date(2026, 3, 1), (self.mug, 2, '10.00'))
+      self.order(date(2026, 3, 8), (self.ball, 1, '5.50'))
+      pending = self.order(date(2026, 3, 1), (self.kettle, 3, '30.00'), status=Order.PENDING)
+      analytics.refresh_sales_rollups()
+      analytics.refresh_leaderboards(today=date(2026, 3, 10))
+      start, end = date(2026, 2, 9), date(2026, 3, 10)
+      self.assertEqual([row['product_id'] for row in analytics.top_sellers(start, end, metric='units')], [self.mug.id, self.ball.id])
+
+      pending.payment_status = Order.COMPLETE
+      pending.save()
+
+      self.assertEqual([row['product_id'] for row in analytics.top_sellers(start, end, metric='units')], [self.kettle.id, self.mug.id, self.ball.id])
+      #Only the windows holding the order's day lost their leaderboard
+      self.assertEqual(sorted(set(SalesLeaderboard.objects.values_list('window_days', flat=True))), [7])
+
+   def test_rebuild_matches_refresh(self):
+      for day in range(1, 20):
+         self.order(date(2026, 1, day), (self.mug, day, '10.00'), (self.ball, 1, '2.00'))
+      analytics.refresh_sales_rollups()
+      refreshed = self.rollups()
+
+      totals = analytics.rebuild_sales_rollups(days_per_chunk=7, workers=1)
+
+      self.assertEqual(totals['chunks'], 3)
+      self.assertEqual(self.rollups(), refreshed)
+
+   def test_endpoints(self):
+      self.order(date(2026, 3, 1), (self.mug, 2, '10.00'), (self.ball, 5, '1.00'))
+      self.order(date(2026, 3, 3), (self.kettle, 1, '30.00'))
+      analytics.refresh_sales_rollups()
+      client = APIClient()
+      client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'secret'))
+      period = {'start': '2026-03-01', 'end': '2026-03-31'}
+
+      by_revenue = client.get('/store/analytics/top-sellers/', period).json()
+      by_units = client.get('/store/analytics/top-sellers/', {**period, 'by': 'collection', 'metric': 'units'}).json()
+      series = client.get('/store/analytics/sales/', {**period, 'collection_id': self.kitchen.id}).json()
+
+      self.assertEqual([row['title'] for row in by_revenue], ['Kettle', 'Mug', 'Ball'])
+      self.assertEqual(by_units[0], {'collection_id': self.toys.id, 'title': 'Toys', 'units': 5, 'revenue': 5.0})
+      self.assertEqual(series, [{'day': '2026-03-01', 'units': 2, 'revenue': 20.0}, {'day': '2026-03-03', 'units': 1, 'revenue': 30.0}])
+      self.assertEqual(client.get('/store/analytics/sales/', {'start': '2026-03-02', 'end': '2026-03-01'}).status_code, 400)
+      self.assertIn(APIClient().get('/store/analytics/top-sellers/').status_code, (401, 403))
+
+   def test_trailing_windows_are_served_from_the_leaderboard(self):
+      today = timezone.localdate()
+      self.order(today, (self.mug, 1, '10.00'), (self.ball, 9, '1.00'))
+      self.order(today - timedelta(days=10), (self.kettle, 1, '30.00'))
+      analytics.refresh_sales_rollups()
+      start = today - timedelta(days=29)
+
+      with self.assertNumQueries(2):
+         leaders = analytics.top_sellers(start, today, metric='units')
+      with mock.patch.object(analytics, 'LEADERBOARD_WINDOWS', []):
+         self.assertEqual(analytics.top_sellers(start, today, metric='units'), leaders)
+      self.assertEqual([row['title'] for row in leaders], ['Ball', 'Mug', 'Kettle'])
+      self.assertEqual([row['title'] for row in analytics.top_sellers(today - timedelta(days=6), today)], ['Mug', 'Ball'])
+
+class ParallelSalesRebuildTests(TransactionTestCase):
+   def setUp(self):
+      with connection.cursor() as cursor:
+         cursor.execute('PRAGMA journal_mode=WAL')
+      self.addCleanup(lambda: connection.cursor().execute('PRAGMA journal_mode=DELETE'))
+
+   def test_forked_workers_aggregate_all_chunks(self):
+      product = create_product(Collection.objects.create(title='Kitchen'))
+      customer = Customer.objects.create(first_name='Ana', last_name='Lima', email='ana@example.com', phone='1')
+      for day in range(1, 11):
+         order = Order.objects.create(customer=customer, payment_status=Order.COMPLETE)
+         Order.objects.filter(pk=order.pk).update(placed_at=timezone.now() - timedelta(days=day))
+         OrderItem.objects.create(order=order, product=product, quantity=day, unit_price=1)
+
+      with mock.patch('store.analytics.ProcessPoolExecutor', wraps=analytics.ProcessPoolExecutor) as executor:
+         totals = analytics.rebuild_sales_rollups(days_per_chunk=2, workers=2)
+
+      executor.assert_called_once()
+      self.assertEqual(totals['rows'], 10)
+      self.assertEqual(sum(DailyProductSales.objects.values_list('units', flat=True)), 55)
+
+SEED_COUNTS = {
+   'collections': 3, 'products': 60, 'promotions': 4, 'tags': 5, 'users': 10, 'customers': 8,
+   'orders': 30, 'carts': 5, 'reviews': 50, 'likes': 40,
+}
+
+@override_settings(LIKES_FLUSH_INTERVAL=0, ALLOWED_HOSTS=['localhost'])
+class SeedDataTests(TestCase):
+   def test_rows_are_seeded_and_consistent(self):
+      totals = seeding.seed(SEED_COUNTS, workers=1, batch_size=25)
+
+      self.assertEqual({table: totals['rows'][table] for table in SEED_COUNTS if table != 'likes'}, {table: count for table, count in SEED_COUNTS.items() if table != 'likes'})
+      self.assertEqual(totals['rows']['likes'], LikedItem.objects.count())
+      self.assertEqual(Product.objects.count(), 60)
+      self.assertEqual(sum(Collection.objects.values_list('products_count', flat=True)), 60)
+      self.assertEqual(LikeCount.objects.aggregate(total=Sum('total'))['total'], LikedItem.objects.count())
+      self.assertEqual(sum(Product.objects.values_list('reviews_count', flat=True)), 50)
+      self.assertTrue(OrderItem.objects.exists())
+      self.assertTrue(DailyProductSales.objects.exists())
+      #Backdated, not all created now
+      self.assertGreater(Order.objects.values('placed_at').distinct().count(), 1)
+      self.assertLess(Order.objects.order_by('placed_at').first().placed_at, timezone.now() - timedelta(days=1))
+      for product in Product.objects.filter(promotions__is_active=True).distinct():
+         self.assertLess(product.effective_price, product.price)
+
+   def test_same_seed_same_rows(self):
+      counts = {'collections': 2, 'products': 20}
+      seeding.seed(counts, workers=1, batch_size=7)
+      seeding.seed(counts, workers=1, batch_size=7)
+      rows = list(Product.objects.order_by('id').values_list('price', 'inventory', 'description'))
+      self.assertEqual(rows[:20], rows[20:])
+      seeding.seed(counts, workers=1, batch_size=7, seed=1)
+      self.assertNotEqual(list(Product.objects.order_by('id').values_list('price', flat=True)[40:]), [price for price, _, _ in rows[:20]])
+
+   def test_missing_referenced_rows(self):
+      with self.assertRaisesMessage(ValueError, 'Seeding orders needs customers too.'):
+         seeding.seed({'collections': 1, 'products': 1, 'orders': 1})
+
+   def test_command(self):
+      out = StringIO()
+      call_command('seed_data', '--workers=1', *[f'--{table}={count}' for table, count in SEED_COUNTS.items()], stdout=out)
+      self.assertIn('seeded 60 products', out.getvalue())
+      self.assertEqual(Product.objects.count(), 60)
+
+   def test_benchmark_drives_every_route(self):
+      from . import benchmarks
+      seeding.seed(SEED_COUNTS, workers=1)
+      client = Client(SERVER_NAME='localhost')
+      client.force_login(User.objects.create_user('admin', 'admin@example.com', 'secret', is_staff=True, is_superuser=True))
+
+      results = benchmarks.run_flows(benchmarks.route_flows(client, random.Random(0)), repeat=1, budget=0)
+      self.assertEqual(benchmarks.store_route_names() - {result['route'] for result in results.values()}, set())
+      self.assertEqual(results['GET products/']['queries'], 3)
+      self.assertTrue(benchmarks.run_flows(benchmarks.admin_flows(client), repeat=1, budget=0))
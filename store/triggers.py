@@ -0,0 +1,68 @@
+from django.core.exceptions import FieldDoesNotExist
+
+#The triggers on store_product, which keep the search index (migration 0011)
+#and the collections' products_count (migration 0013) current. Adding a NOT
+#NULL column makes SQLite copy the table into a new one, dropping its
+#triggers, so rather than have each such migration put them back they are
+#restored after every migrate.
+SEARCH_TRIGGERS = [
+   """
+   CREATE TRIGGER IF NOT EXISTS store_product_fts_insert AFTER INSERT ON store_product BEGIN
+      INSERT INTO store_product_fts (rowid, title, description, tags)
+      VALUES (new.id, new.title, coalesce(new.description, ''), '');
+   END
+   """,
+   """
+   CREATE TRIGGER IF NOT EXISTS store_product_fts_update AFTER UPDATE OF title, description ON store_product BEGIN
+      UPDATE store_product_fts SET title = new.title, description = coalesce(new.description, '')
+      WHERE rowid = new.id;
+   END
+   """,
+   """
+   CREATE TRIGGER IF NOT EXISTS store_product_fts_delete AFTER DELETE ON store_product BEGIN
+      DELETE FROM store_product_fts WHERE rowid = old.id;
+   END
+   """,
+]
+
+COUNTER_TRIGGERS = [
+   """
+   CREATE TRIGGER IF NOT EXISTS store_collection_products_count_insert AFTER INSERT ON store_product BEGIN
+      UPDATE store_collection SET products_count = products_count + 1 WHERE id = new.collection_id;
+   END
+   """,
+   """
+   CREATE TRIGGER IF NOT EXISTS store_collection_products_count_delete AFTER DELETE ON store_product BEGIN
+      UPDATE store_collection SET products_count = products_count - 1 WHERE id = old.collection_id;
+   END
+   """,
+   """
+   CREATE TRIGGER IF NOT EXISTS store_collection_products_count_update AFTER UPDATE OF collection_id ON store_product
+   WHEN old.collection_id IS NOT new.collection_id BEGIN
+      UPDATE store_collection SET products_count = products_count - 1 WHERE id = old.collection_id;
+      UPDATE store_collection SET products_count = products_count + 1 WHERE id = new.collection_id;
+   END
+   """,
+]
+
+def migrated(apps, model, field=None):
+   try:
+      found = apps.get_model('store', model)
+      if field:
+         found._meta.get_field(field)
+   except (LookupError, FieldDoesNotExist):
+      return False
+   return True
+
+def restore_product_triggers(apps, connection):
+   """Creates whichever store_product triggers the migrated schema has and the table lost."""
+   if connection.vendor != 'sqlite':
+      return
+   statements = []
+   if migrated(apps, 'ProductSearchIndex'):
+      statements += SEARCH_TRIGGERS
+   if migrated(apps, 'Collection', 'products_count'):
+      statements += COUNTER_TRIGGERS
+   with connection.cursor() as cursor:
+      for statement in statements:
+         cursor.execute(statement)
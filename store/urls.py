@@ -1,3 +1,4 @@
+from django.urls import path
 from rest_framework_nested import routers
 from . import views
 
@@ -5,6 +6,9 @@ router = routers.DefaultRouter()
 router.register('products', views.ProductViewSet)
 router.register('collections', views.CollectionViewSet)
 router.register('carts', views.CartViewSet)
+router.register('orders', views.OrderViewSet)
+router.register('customers', views.CustomerViewSet)
+router.register('analytics', views.SalesAnalyticsViewSet, basename='analytics')
 
 products_router = routers.NestedDefaultRouter(router, 'products', lookup='product')
 products_router.register('reviews', views.ReviewViewSet, basename='product-reviews')
@@ -12,8 +16,23 @@ products_router.register('reviews', views.ReviewViewSet, basename='product-revie
 carts_routers = routers.NestedDefaultRouter(router, 'carts', lookup='cart')
 carts_routers.register('items', views.CartItemViewSet, basename='cart-items')
 
+customers_router = routers.NestedDefaultRouter(router, 'customers', lookup='customer')
+customers_router.register('orders', views.CustomerOrderViewSet, basename='customer-orders')
+
 #URLConf
-urlpatterns = router.urls + products_router.urls + carts_routers.urls
+urlpatterns = router.urls + products_router.urls + carts_routers.urls + customers_router.urls
+
+#Async variants of the read paths, for ASGI
+urlpatterns += [
+   path('async/products/', views.product_list_async, name='async-product-list'),
+   path('async/products/<int:pk>/', views.product_detail_async, name='async-product-detail'),
+   path('async/carts/<uuid:pk>/', views.cart_detail_async, name='async-cart-detail'),
+]
+
+#The product tag list, mounted at /tags/ by setup/urls.py
+tags_router = routers.SimpleRouter()
+tags_router.register('', views.TagViewSet, basename='tags')
+tag_urlpatterns = tags_router.urls
 
 # urlpatterns = [
 #    path('products/', views.ProductList.as_view()),
@@ -1,32 +1,105 @@
-from django.db.models import Count
+from functools import wraps
+from asgiref.sync import sync_to_async
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import F, Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, MethodNotAllowed, NotFound
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser, IsAuthenticated
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
 from rest_framework.response import Response
-from rest_framework.mixins import CreateModelMixin, RetrieveModelMixin, DestroyModelMixin
-from rest_framework.viewsets import ModelViewSet, GenericViewSet
+from rest_framework.mixins import CreateModelMixin, ListModelMixin, RetrieveModelMixin, DestroyModelMixin
+from rest_framework.viewsets import ModelViewSet, GenericViewSet, ViewSet
 from rest_framework import status
-from rest_framework.filters import SearchFilter, OrderingFilter
+from rest_framework.filters import OrderingFilter
+from likes.models import LikedItem
+from tags.models import TagCount
 
-from .models import Product, Collection, OrderItem, Review, Cart, CartItem
-from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer
+from . import analytics, catalog
+from .cache import CachedResponseMixin, CATALOG_VERSION_KEY, collection_version_key, product_version_key
+from .models import Product, Collection, Customer, Order, OrderItem, Review, Cart, CartItem
+from .serializers import ProductSerializer, CollectionSerializer, ReviewSerializer, CartSerializer, CartItemSerializer, AddCartItemSerializer, UpdateCartItemSerializer, OrderSerializer, CreateOrderSerializer, CustomerSerializer, TagSerializer, TopSellersQuerySerializer, SalesSeriesQuerySerializer
 from .filters import ProductFilter
+from .pagination import KeysetPagination
+from .search import FullTextSearchFilter
+from .streaming import StreamingListMixin
 
-class ProductViewSet(ModelViewSet):
+class ProductViewSet(StreamingListMixin, CachedResponseMixin, ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
-    filter_backends = [DjangoFilterBackend, SearchFilter, OrderingFilter]
+    filter_backends = [DjangoFilterBackend, FullTextSearchFilter, OrderingFilter]
     #filterset_fields = ['collection_id']
     filterset_class = ProductFilter
     search_fields = ['title', 'description']
-    ordering_fields = ['price', 'last_update']
+    ordering_fields = ['price', 'effective_price', 'last_update', 'reviews_count', 'average_rating']
+    pagination_class = KeysetPagination
+    cache_namespace = 'products'
+    #Safe requests read from a replica, see core.middleware
+    replica_reads = True
     
     def get_serializer_context(self):
         return {'request': self.request}
+
+    def get_list_version_keys(self):
+        #A list filtered by collection only goes stale when that collection changes
+        collection_id = self.request.query_params.get('collection_id')
+        if collection_id:
+            return [collection_version_key(collection_id)]
+        return [CATALOG_VERSION_KEY]
+
+    def get_detail_version_keys(self):
+        return [product_version_key(self.kwargs['pk'])]
     
     def destroy(self, request, *args, **kwargs):
         if OrderItem.objects.filter(product_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Product cannot be deleted because it is associated with an order item.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
 
+    @action(detail=True, methods=['post', 'delete'], permission_classes=[IsAuthenticated])
+    def like(self, request, pk=None):
+        #likes_count catches up within LIKES_FLUSH_INTERVAL seconds
+        product = self.get_object()
+        if request.method == 'DELETE':
+            LikedItem.objects.unlike(request.user, product)
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        created = LikedItem.objects.like(request.user, product)
+        return Response({'liked': True}, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAdminUser], parser_classes=[MultiPartParser])
+    def import_catalog(self, request):
+        #Either a multipart upload in 'file' or the raw CSV/NDJSON request body
+        if request.content_type.startswith('multipart/'):
+            upload = request.FILES.get('file')
+            if upload is None:
+                return Response({'error': 'No file was uploaded.'}, status=status.HTTP_400_BAD_REQUEST)
+            lines, file_format = upload, catalog.format_for(upload.name)
+        else:
+            lines, file_format = request._request, 'csv' if 'csv' in request.content_type else 'ndjson'
+        file_format = request.query_params.get('file_format', file_format)
+        if file_format not in catalog.FORMATS:
+            return Response({'error': f'Unsupported file format: {file_format}.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        chunks = []
+        importer = catalog.CatalogImporter(progress=chunks.append)
+        try:
+            totals = importer.run(catalog.read_rows(lines, file_format))
+        except (ValueError, UnicodeDecodeError) as exc:
+            return Response({'error': f'The file could not be parsed: {exc}', 'chunks': chunks}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({**totals, 'chunks': chunks, 'errors': importer.errors})
+
+    @action(detail=False, methods=['get'], url_path='export', permission_classes=[IsAdminUser])
+    def export_catalog(self, request):
+        file_format = request.query_params.get('file_format', 'ndjson')
+        if file_format not in catalog.FORMATS:
+            return Response({'error': f'Unsupported file format: {file_format}.'}, status=status.HTTP_400_BAD_REQUEST)
+        content_type = 'text/csv' if file_format == 'csv' else 'application/x-ndjson'
+        response = StreamingHttpResponse(catalog.export_rows(format=file_format), content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="products.{file_format}"'
+        return response
+
 # class ProductList(ListCreateAPIView):
 #     queryset = Product.objects.select_related('collection').all()
 #     serializer_class = ProductSerializer
@@ -61,11 +134,12 @@ class ProductViewSet(ModelViewSet):
 
 ################################################
 class CollectionViewSet(ModelViewSet):
-    queryset = Collection.objects.annotate(products_count=Count('products')).all()
+    queryset = Collection.objects.all()
     serializer_class = CollectionSerializer
+    replica_reads = True
 
     def destroy(self, request, *args, **kwargs):
-        if Products.objects.filter(collection_id=kwargs['pk']).count() > 0:
+        if Product.objects.filter(collection_id=kwargs['pk']).count() > 0:
             return Response({'error': 'Collection cannot be deleted because it include one or more products.'}, status=status.HTTP_405_METHOD_NOT_ALLOWED)
         return super().destroy(request, *args, **kwargs)
 
@@ -123,8 +197,27 @@ class CollectionViewSet(ModelViewSet):
 
 ######################################
 
-class ReviewViewSet(ModelViewSet):
+class TagViewSet(ListModelMixin, GenericViewSet):
+    #Product counts per tag, as kept by the tags app's TagCount triggers
+    serializer_class = TagSerializer
+    filter_backends = [OrderingFilter]
+    ordering_fields = ['products_count', 'label']
+    ordering = ['-products_count']
+    replica_reads = True
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        return (
+            TagCount.objects.filter(content_type=ContentType.objects.get_for_model(Product), total__gt=0)
+            .annotate(label=F('tag__label'), products_count=F('total'))
+        )
+
+######################################
+
+class ReviewViewSet(StreamingListMixin, ModelViewSet):
     serializer_class = ReviewSerializer
+    pagination_class = KeysetPagination
+    replica_reads = True
 
     def get_queryset(self):
         return Review.objects.filter(product_id=self.kwargs['product_pk'])
@@ -133,11 +226,20 @@ class ReviewViewSet(ModelViewSet):
         return {'product_id': self.kwargs['product_pk']}
 
 class CartViewSet(CreateModelMixin, RetrieveModelMixin, DestroyModelMixin, GenericViewSet):
-    queryset = Cart.objects.prefetch_related('items__product').all()
+    queryset = Cart.objects.with_total_price().prefetch_related(
+        Prefetch('items', queryset=CartItem.objects.select_related('product').with_total_price())
+    )
     serializer_class = CartSerializer
 
 class CartItemViewSet(ModelViewSet):
     http_method_names = ['get', 'post', 'patch', 'delete']
+    pagination_class = KeysetPagination
+
+    def get_serializer(self, *args, **kwargs):
+        #POST accepts a single item or a list of items
+        if isinstance(kwargs.get('data'), list):
+            kwargs['many'] = True
+        return super().get_serializer(*args, **kwargs)
 
     def get_serializer_class(self):
         if self.request.method == 'POST':
@@ -150,5 +252,126 @@ class CartItemViewSet(ModelViewSet):
         return {'cart_id': self.kwargs['cart_pk']}
 
     def get_queryset(self):
-        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related('product')
+        return CartItem.objects.filter(cart_id=self.kwargs['cart_pk']).select_related('product').with_total_price()
+
+class OrderViewSet(CreateModelMixin, RetrieveModelMixin, GenericViewSet):
+    #Customers have no user of their own; a user owns the customer with their email
+    queryset = Order.objects.with_total_price().prefetch_related(
+        Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+    )
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        if self.request.user.is_staff:
+            return self.queryset
+        return self.queryset.filter(customer__email=self.request.user.email)
+
+    def get_serializer_class(self):
+        if self.request.method == 'POST':
+            return CreateOrderSerializer
+        return OrderSerializer
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order = serializer.save()
+        return Response(OrderSerializer(self.get_queryset().get(pk=order.pk)).data, status=status.HTTP_201_CREATED)
+
+class CustomerViewSet(RetrieveModelMixin, GenericViewSet):
+    #The order count and lifetime spend come from the summary cache, see store.signals
+    queryset = Customer.objects.all()
+    serializer_class = CustomerSerializer
+    permission_classes = [IsAdminUser]
+
+class CustomerOrderViewSet(ListModelMixin, GenericViewSet):
+    #One query for the page and one for its items and their products, whatever the page size
+    serializer_class = OrderSerializer
+    pagination_class = KeysetPagination
+    permission_classes = [IsAdminUser]
+
+    def get_queryset(self):
+        return Order.objects.filter(customer_id=self.kwargs['customer_pk']).order_by('-placed_at').with_total_price().prefetch_related(
+            Prefetch('items', queryset=OrderItem.objects.select_related('product'))
+        )
+
+class SalesAnalyticsViewSet(ViewSet):
+    #Reads the daily rollups kept by store.analytics, never OrderItem itself
+    permission_classes = [IsAdminUser]
+
+    @action(detail=False, url_path='top-sellers')
+    def top_sellers(self, request):
+        params = TopSellersQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(analytics.top_sellers(**params.validated_data))
+
+    @action(detail=False)
+    def sales(self, request):
+        params = SalesSeriesQuerySerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        return Response(analytics.sales_series(**params.validated_data))
+
+######################################
+# Async variants of the product list/detail and cart read paths, for ASGI
+# servers. They reuse the viewsets' querysets, filters, pagination
+# and serializers but not DRF's dispatch, which is sync only and would run the
+# whole request on a worker thread; there is no authentication, these reads
+# are public. Each database round trip is one async ORM call; only the
+# parameters whose handling reads the database itself (?tag=, ?search=,
+# ?include=) add a thread hop. ?stream= and the response cache are left to the
+# sync endpoints.
+
+def async_api_view(func):
+    #Renders the view's data, or an APIException, the way a DRF view would
+    @wraps(func)
+    async def view(request, *args, **kwargs):
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise MethodNotAllowed(request.method)
+            data = await func(request, *args, **kwargs)
+            status_code = status.HTTP_200_OK
+        except APIException as exc:
+            data, status_code = {'detail': exc.detail} if isinstance(exc.detail, str) else exc.detail, exc.status_code
+        content = JSONRenderer().render(data)
+        response = HttpResponse(content, status=status_code, content_type='application/json')
+        response['Content-Length'] = len(content)
+        return response
+    return view
+
+def viewset_for(cls, request, action, **kwargs):
+    return cls(request=Request(request), action=action, args=(), kwargs=kwargs, format_kwarg=None)
+
+async def serialized(serializer, request):
+    if 'include' in request.GET:
+        return await sync_to_async(lambda: serializer.data)()
+    return serializer.data
+
+@async_api_view
+async def product_list_async(request):
+    view = viewset_for(ProductViewSet, request, 'list')
+    queryset = view.get_queryset()
+    if 'tag' in request.GET or 'search' in request.GET:
+        queryset = await sync_to_async(view.filter_queryset)(queryset)
+    else:
+        queryset = view.filter_queryset(queryset)
+    products = await view.paginator.apaginate_queryset(queryset, view.request, view)
+    return view.get_paginated_response(await serialized(view.get_serializer(products, many=True), request)).data
+
+@async_api_view
+async def product_detail_async(request, pk):
+    view = viewset_for(ProductViewSet, request, 'retrieve', pk=pk)
+    try:
+        product = await view.get_queryset().aget(pk=pk)
+    except Product.DoesNotExist:
+        raise NotFound()
+    return await serialized(view.get_serializer(product), request)
+
+@async_api_view
+async def cart_detail_async(request, pk):
+    view = viewset_for(CartViewSet, request, 'retrieve', pk=pk)
+    try:
+        cart = await view.get_queryset().aget(pk=pk)
+    except Cart.DoesNotExist:
+        raise NotFound()
+    return view.get_serializer(cart).data
 
+product_list_async.replica_reads = product_detail_async.replica_reads = True
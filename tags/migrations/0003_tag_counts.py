@@ -0,0 +1,124 @@
+# Generated by Django 4.1.6 on 2026-10-18 09:38
+
+"""
+Keeps per tag product counts in TagCount and allows a tag only once per
+tagged object.
+
+Before the unique index is built, duplicate taggings (the same tag on the
+same object more than once) are deleted, keeping the oldest of each. They
+carry nothing the kept row doesn't, but the deletion is not logged and not
+undone: migrating back leaves them deleted.
+"""
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+#Keeps the first of any duplicate taggings so the unique index can be built;
+#irreversible, see above
+DELETE_DUPLICATES = '''
+    DELETE FROM tags_taggeditem WHERE id NOT IN (
+        SELECT MIN(id) FROM tags_taggeditem GROUP BY content_type_id, tag_id, object_id
+    )
+'''
+
+#AddConstraint would make SQLite copy tags_taggeditem into a new table, which
+#drops the product search triggers on it (store migration 0011); a unique
+#index enforces the same thing in place
+CREATE_UNIQUE_INDEX = 'CREATE UNIQUE INDEX tags_one_tag_per_object ON tags_taggeditem (content_type_id, tag_id, object_id)'
+DROP_UNIQUE_INDEX = 'DROP INDEX tags_one_tag_per_object'
+
+CREATE_COUNTER_TRIGGERS = [
+    """
+    CREATE TRIGGER tags_tagcount_insert AFTER INSERT ON tags_taggeditem BEGIN
+        INSERT INTO tags_tagcount (tag_id, content_type_id, total) VALUES (new.tag_id, new.content_type_id, 1)
+        ON CONFLICT (tag_id, content_type_id) DO UPDATE SET total = total + 1;
+    END
+    """,
+    """
+    CREATE TRIGGER tags_tagcount_delete AFTER DELETE ON tags_taggeditem BEGIN
+        UPDATE tags_tagcount SET total = total - 1 WHERE tag_id = old.tag_id AND content_type_id = old.content_type_id;
+    END
+    """,
+    """
+    CREATE TRIGGER tags_tagcount_update AFTER UPDATE OF tag_id, content_type_id ON tags_taggeditem
+    WHEN old.tag_id IS NOT new.tag_id OR old.content_type_id IS NOT new.content_type_id BEGIN
+        UPDATE tags_tagcount SET total = total - 1 WHERE tag_id = old.tag_id AND content_type_id = old.content_type_id;
+        INSERT INTO tags_tagcount (tag_id, content_type_id, total) VALUES (new.tag_id, new.content_type_id, 1)
+        ON CONFLICT (tag_id, content_type_id) DO UPDATE SET total = total + 1;
+    END
+    """,
+]
+
+DROP_COUNTER_TRIGGERS = [
+    'DROP TRIGGER tags_tagcount_update',
+    'DROP TRIGGER tags_tagcount_delete',
+    'DROP TRIGGER tags_tagcount_insert',
+]
+
+COUNT_TAGS = """
+    INSERT INTO tags_tagcount (tag_id, content_type_id, total)
+    SELECT tag_id, content_type_id, COUNT(*) FROM tags_taggeditem GROUP BY tag_id, content_type_id
+"""
+
+def create_counter(apps, schema_editor):
+    schema_editor.execute(COUNT_TAGS)
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in CREATE_COUNTER_TRIGGERS:
+            schema_editor.execute(statement)
+
+def drop_counter(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in DROP_COUNTER_TRIGGERS:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('tags', '0002_content_object_index'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='taggeditem',
+            name='tags_tagged_content_eaa81e_idx',
+        ),
+        migrations.AddIndex(
+            model_name='taggeditem',
+            index=models.Index(fields=['content_type', 'object_id', 'tag'], name='tags_tagged_content_ca264d_idx'),
+        ),
+        migrations.RunSQL(DELETE_DUPLICATES, migrations.RunSQL.noop),
+        migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL(CREATE_UNIQUE_INDEX, DROP_UNIQUE_INDEX)],
+            state_operations=[
+                migrations.AddConstraint(
+                    model_name='taggeditem',
+                    constraint=models.UniqueConstraint(fields=('content_type', 'tag', 'object_id'), name='tags_one_tag_per_object'),
+                ),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tag',
+            index=models.Index(fields=['label'], name='tags_tag_label_5f31d7_idx'),
+        ),
+        migrations.CreateModel(
+            name='TagCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.PositiveIntegerField(default=0)),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+                ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counts', to='tags.tag')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='tagcount',
+            index=models.Index(fields=['content_type', 'total', 'id'], name='tags_tagcou_content_968f59_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='tagcount',
+            constraint=models.UniqueConstraint(fields=('tag', 'content_type'), name='tags_one_count_per_model'),
+        ),
+        migrations.RunPython(create_counter, drop_counter),
+    ]
@@ -8,9 +8,46 @@ class Tag(models.Model):
    def __str__(self):
       return self.label
 
+   class Meta:
+      indexes = [models.Index(fields=['label'])]
+
+class TaggedItemManager(models.Manager):
+   def labels_for(self, objects):
+      """
+      The tag labels of each object, in label order, keyed by the object
+      itself. Objects may be of any model; each model costs one query.
+      """
+      objects = list(objects)
+      labels = {obj: [] for obj in objects}
+      content_types = ContentType.objects.get_for_models(*{type(obj) for obj in objects})
+      for model, content_type in content_types.items():
+         by_id = {obj.pk: labels[obj] for obj in objects if type(obj) is model}
+         rows = self.filter(content_type=content_type, object_id__in=by_id).values_list('object_id', 'tag__label').order_by('tag__label')
+         for object_id, label in rows:
+            by_id[object_id].append(label)
+      return labels
+
 #Part 1 - Cap. 3 - Video 11
 class TaggedItem(models.Model):
+   objects = TaggedItemManager()
    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE) 
    object_id = models.PositiveIntegerField()
    content_object = GenericForeignKey()
+
+   class Meta:
+      #object -> tags and, through the unique constraint, tag -> objects. Both
+      #cover the lookups of the other side, so neither plan falls back on the
+      #other index
+      indexes = [models.Index(fields=['content_type', 'object_id', 'tag'])]
+      constraints = [models.UniqueConstraint(fields=['content_type', 'tag', 'object_id'], name='tags_one_tag_per_object')]
+
+#How many objects of each model carry each tag; kept by triggers on tags_taggeditem, see migration 0003
+class TagCount(models.Model):
+   tag = models.ForeignKey(Tag, on_delete=models.CASCADE, related_name='counts')
+   content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+   total = models.PositiveIntegerField(default=0)
+
+   class Meta:
+      constraints = [models.UniqueConstraint(fields=['tag', 'content_type'], name='tags_one_count_per_model')]
+      indexes = [models.Index(fields=['content_type', 'total', 'id'])]
@@ -1,3 +1,18 @@
 from django.test import TestCase
+from core.models import User
+from store.models import Collection, Product
+from .models import Tag, TaggedItem
 
-# Create your tests here.
+class LabelsForTests(TestCase):
+   def test_objects_of_different_models_take_one_query_each(self):
+      product = Product.objects.create(title='Mug', slug='mug', price=10, inventory=1, collection=Collection.objects.create(title='Kitchen'))
+      user = User.objects.create_user('ana', 'ana@example.com', 'secret')
+      tag = Tag.objects.create(label='new')
+      TaggedItem.objects.create(tag=tag, content_object=product)
+      TaggedItem.objects.create(tag=tag, content_object=user)
+      other = User.objects.create_user('bia', 'bia@example.com', 'secret')
+
+      with self.assertNumQueries(2):
+         labels = TaggedItem.objects.labels_for([product, user, other])
+
+      self.assertEqual(labels, {product: ['new'], user: ['new'], other: []})